@@ -1,11 +1,46 @@
+import time
+
+# Heavy imports are timed for the startup report (see get_startup_report)
+_import_timings = {}
+_t = time.perf_counter()
 import streamlit as st
-import re
-import json
+_import_timings["import streamlit"] = time.perf_counter() - _t
+_t = time.perf_counter()
 import google.generativeai as genai
+_import_timings["import google.generativeai"] = time.perf_counter() - _t
+_t = time.perf_counter()
 import plotly.graph_objects as go
-import base64
+_import_timings["import plotly"] = time.perf_counter() - _t
+_t = time.perf_counter()
+import pandas as pd
+_import_timings["import pandas"] = time.perf_counter() - _t
+import io
+import uuid
+from functools import partial
 from pathlib import Path
 
+from munger.assets import data_uri, logo_asset, static_url
+from munger.backends import EmptyResponseError, build_backend
+from munger.batch import RESULT_COLUMNS, iter_purchase_inputs, load_purchases, score_purchases
+from munger.cache import ResponseCache
+from munger.charts import gauge_svg, radar_svg
+from munger.core import summarize
+from munger.distill import LOCAL_MODEL_NAME, DistilledModel, train_from_history
+from munger.factors import FactorClient, purchase_inputs
+from munger.history import DecisionHistory
+from munger.opportunity import DEFAULT_ASSUMPTIONS, DEFAULT_GAIN_STEPS, calibrated_factors, simulate_purchase
+from munger.packing import PackSizer
+from munger.portfolio import OBJECTIVES, plan_purchases
+from munger.quota import BATCH, INTERACTIVE, QuotaScheduler, ScheduledBackend, requester
+from munger.parsing import FactorParseError, ParseStats
+from munger.resilience import CircuitBreaker, RetryPolicy
+from munger.routing import HedgedBackend
+from munger.scoring import DEFAULT_RULES, FACTORS, compute_pds
+from munger.semantic import SemanticCache
+from munger.sensitivity import grid_axes, max_cost_for, pds_grid
+from munger.singleflight import SingleFlight
+from munger.telemetry import Trace, serve_metrics, span
+
 # ------------------------------------------------------------
 # Set page config (MUST BE FIRST STREAMLIT COMMAND)
 # ------------------------------------------------------------
@@ -19,9 +54,192 @@ st.set_page_config(
 # Configure your Google Generative AI API key
 # ------------------------------------------------------------
 GOOGLE_API_KEY = st.secrets["google"]["api_key"]
-genai.configure(api_key=GOOGLE_API_KEY)
 
-GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_MODEL = st.secrets["google"].get("model", "gemini-2.0-flash")
+# Send a cheap request when the client is first built so the first user
+# doesn't pay for connection setup
+GEMINI_WARMUP = st.secrets["google"].get("warmup", True)
+
+
+@st.cache_resource
+def get_startup_report():
+    """
+    Seconds spent on each startup step. Held process-wide and filled in
+    by the first script run; later reruns hit already-imported modules.
+    """
+    return {}
+
+
+for _step, _seconds in _import_timings.items():
+    get_startup_report().setdefault(_step, _seconds)
+
+
+@st.cache_resource(show_spinner="Connecting to Gemini...")
+def get_model(model_name=GEMINI_MODEL):
+    """
+    One process-wide Gemini client per model. Configuring once (rather than
+    on every rerun) keeps the underlying connection alive between requests.
+    """
+    report = get_startup_report()
+    started = time.perf_counter()
+    genai.configure(api_key=GOOGLE_API_KEY)
+    model = genai.GenerativeModel(model_name)
+    report[f"{model_name} setup"] = time.perf_counter() - started
+    if GEMINI_WARMUP:
+        started = time.perf_counter()
+        try:
+            model.count_tokens("ping")
+            report[f"{model_name} warm-up ping"] = time.perf_counter() - started
+        except Exception:
+            report[f"{model_name} warm-up ping (failed)"] = time.perf_counter() - started
+    return model
+
+
+# ------------------------------------------------------------
+# Backend settings (optional [backend] section in secrets)
+# ------------------------------------------------------------
+# kind: "gemini", "record", "replay" or "fake"; the last two need no network
+BACKEND_SETTINGS = st.secrets.get("backend", {})
+BACKEND_KIND = BACKEND_SETTINGS.get("kind", "gemini")
+RECORDING_PATH = BACKEND_SETTINGS.get("recording_path", str(Path(__file__).parent / "recordings.jsonl"))
+FAKE_LATENCY_MS = BACKEND_SETTINGS.get("fake_latency_ms", 600)
+FAKE_ERROR_RATE = BACKEND_SETTINGS.get("fake_error_rate", 0.0)
+
+# ------------------------------------------------------------
+# Model routing (optional [routing] section in secrets)
+# ------------------------------------------------------------
+# One route per workload, each with its own model and an optional hedge
+# model (same, cheaper or faster; "" disables hedging), e.g.
+#   [routing.basic]
+#   model = "gemini-2.0-flash-lite"
+ROUTING_SETTINGS = st.secrets.get("routing", {})
+ROUTES = {
+    "basic": {"model": GEMINI_MODEL, "hedge_model": GEMINI_MODEL},
+    "advanced": {"model": GEMINI_MODEL, "hedge_model": GEMINI_MODEL},
+    # Hedging buys latency with extra calls, which batch jobs don't need
+    "batch": {"model": GEMINI_MODEL, "hedge_model": ""},
+}
+for _route, _config in ROUTES.items():
+    _config.update(ROUTING_SETTINGS.get(_route, {}))
+HEDGE_QUANTILE = ROUTING_SETTINGS.get("hedge_quantile", 0.95)
+HEDGE_MIN_DELAY_SECONDS = ROUTING_SETTINGS.get("hedge_min_delay_seconds", 0.3)
+HEDGE_INITIAL_DELAY_SECONDS = ROUTING_SETTINGS.get("hedge_initial_delay_seconds", 2.0)
+
+if BACKEND_KIND in ("gemini", "record"):
+    for _model_name in sorted({m for c in ROUTES.values() for m in (c["model"], c["hedge_model"]) if m}):
+        get_model(_model_name)
+
+# ------------------------------------------------------------
+# Response cache settings (optional [cache] section in secrets)
+# ------------------------------------------------------------
+CACHE_SETTINGS = st.secrets.get("cache", {})
+CACHE_ENABLED = CACHE_SETTINGS.get("enabled", True)
+CACHE_PATH = CACHE_SETTINGS.get("path", str(Path(__file__).parent / ".munger_cache.sqlite3"))
+CACHE_TTL_SECONDS = CACHE_SETTINGS.get("ttl_seconds", 7 * 24 * 3600)
+CACHE_MEMORY_ENTRIES = CACHE_SETTINGS.get("memory_entries", 512)
+CACHE_DISK_ENTRIES = CACHE_SETTINGS.get("disk_entries", 50_000)
+# Reuse answers for near-identical purchases ("Laptop (new)" at $499 for "new laptop" at $500)
+SIMILAR_ENABLED = CACHE_SETTINGS.get("similar", CACHE_ENABLED)
+SIMILAR_THRESHOLD = CACHE_SETTINGS.get("similar_threshold", 0.6)
+SIMILAR_ENTRIES = CACHE_SETTINGS.get("similar_entries", 100_000)
+SIMILAR_COST_TOLERANCE = CACHE_SETTINGS.get("cost_tolerance", 0.05)
+SIMILAR_INCOME_TOLERANCE = CACHE_SETTINGS.get("income_tolerance", 0.10)
+
+# ------------------------------------------------------------
+# Decision history settings (optional [history] section in secrets)
+# ------------------------------------------------------------
+HISTORY_SETTINGS = st.secrets.get("history", {})
+HISTORY_ENABLED = HISTORY_SETTINGS.get("enabled", True)
+HISTORY_PATH = HISTORY_SETTINGS.get("path", str(Path(__file__).parent / ".munger_history.sqlite3"))
+
+# ------------------------------------------------------------
+# Instant scoring settings (optional [instant] section in secrets)
+# ------------------------------------------------------------
+# A local model distilled from the history answers when it is at least
+# min_confidence sure of every factor; otherwise Gemini does.
+INSTANT_SETTINGS = st.secrets.get("instant", {})
+INSTANT_ENABLED = INSTANT_SETTINGS.get("enabled", True)
+INSTANT_MODEL_PATH = INSTANT_SETTINGS.get("model_path", str(Path(__file__).parent / ".munger_instant.npz"))
+INSTANT_MIN_CONFIDENCE = INSTANT_SETTINGS.get("min_confidence", 0.8)
+INSTANT_MIN_ROWS = INSTANT_SETTINGS.get("min_rows", 500)
+
+# ------------------------------------------------------------
+# Scoring settings (optional [scoring] section in secrets)
+# ------------------------------------------------------------
+# Hybrid scoring computes D and O locally and asks the model only for
+# G, L and B. Rule thresholds override munger.scoring.DEFAULT_RULES.
+SCORING_SETTINGS = st.secrets.get("scoring", {})
+HYBRID_SCORING = SCORING_SETTINGS.get("hybrid", True)
+SCORING_RULES = {k: SCORING_SETTINGS.get(k, v) for k, v in DEFAULT_RULES.items()}
+# Structured output has Gemini enforce the JSON shape through a response
+# schema; explanation_words caps each explanation (0 drops them).
+STRUCTURED_OUTPUT = SCORING_SETTINGS.get("structured_output", True)
+EXPLANATION_WORDS = SCORING_SETTINGS.get("explanation_words", 12)
+
+# ------------------------------------------------------------
+# Batch settings (optional [batch] section in secrets)
+# ------------------------------------------------------------
+BATCH_SETTINGS = st.secrets.get("batch", {})
+BATCH_MAX_WORKERS = BATCH_SETTINGS.get("max_workers", 8)
+BATCH_MAX_WORKERS_LIMIT = BATCH_SETTINGS.get("max_workers_limit", 32)
+PACKED_MAX_OUTPUT_TOKENS = BATCH_SETTINGS.get("packed_max_output_tokens", 8192)
+PACKED_MAX_ITEMS = BATCH_SETTINGS.get("packed_max_items", 40)
+
+# ------------------------------------------------------------
+# Retry / circuit breaker settings (optional [resilience] section in secrets)
+# ------------------------------------------------------------
+RESILIENCE_SETTINGS = st.secrets.get("resilience", {})
+RETRY_MAX_ATTEMPTS = RESILIENCE_SETTINGS.get("max_attempts", 3)
+RETRY_BASE_DELAY_SECONDS = RESILIENCE_SETTINGS.get("base_delay_seconds", 0.5)
+RETRY_MAX_DELAY_SECONDS = RESILIENCE_SETTINGS.get("max_delay_seconds", 8.0)
+CALL_TIMEOUT_SECONDS = RESILIENCE_SETTINGS.get("call_timeout_seconds", 30.0)
+CALL_DEADLINE_SECONDS = RESILIENCE_SETTINGS.get("deadline_seconds", 60.0)
+BREAKER_FAILURE_RATE = RESILIENCE_SETTINGS.get("breaker_failure_rate", 0.5)
+BREAKER_WINDOW = RESILIENCE_SETTINGS.get("breaker_window", 20)
+BREAKER_MIN_CALLS = RESILIENCE_SETTINGS.get("breaker_min_calls", 5)
+BREAKER_COOLDOWN_SECONDS = RESILIENCE_SETTINGS.get("breaker_cooldown_seconds", 30.0)
+
+# ------------------------------------------------------------
+# Quota settings (optional [quota] section in secrets)
+# ------------------------------------------------------------
+# Global budgets should sit a little under the Gemini project's own RPM and
+# TPM limits; per-session rates keep one user from spending all of it.
+# Interactive requests are served before batch ones. 0 turns a limit off.
+QUOTA_SETTINGS = st.secrets.get("quota", {})
+QUOTA_REQUESTS_PER_MINUTE = QUOTA_SETTINGS.get("requests_per_minute", 900)
+QUOTA_TOKENS_PER_MINUTE = QUOTA_SETTINGS.get("tokens_per_minute", 900_000)
+SESSION_REQUESTS_PER_MINUTE = QUOTA_SETTINGS.get("session_requests_per_minute", 12)
+SESSION_BURST = QUOTA_SETTINGS.get("session_burst", 4)
+BATCH_SESSION_REQUESTS_PER_MINUTE = QUOTA_SETTINGS.get("batch_session_requests_per_minute", 120)
+QUEUE_MAX_WAIT_SECONDS = QUOTA_SETTINGS.get("max_wait_seconds", 30.0)
+ROUTE_PRIORITY = {"basic": INTERACTIVE, "advanced": INTERACTIVE, "batch": BATCH}
+
+# ------------------------------------------------------------
+# Display settings (optional [display] section in secrets)
+# ------------------------------------------------------------
+# "plotly" for interactive charts, "svg" for static ones (lighter on the
+# server and the browser, no hover or zoom).
+CHART_RENDERER = st.secrets.get("display", {}).get("charts", "plotly")
+
+# ------------------------------------------------------------
+# Opportunity cost simulation (optional [opportunity] section in secrets)
+# ------------------------------------------------------------
+# Return/interest assumptions for munger.opportunity; gain_steps are the
+# fractions of a year's leftover income at which simulated O and L step down.
+OPPORTUNITY_SETTINGS = st.secrets.get("opportunity", {})
+OPPORTUNITY_ASSUMPTIONS = {k: OPPORTUNITY_SETTINGS.get(k, v) for k, v in DEFAULT_ASSUMPTIONS.items()}
+OPPORTUNITY_GAIN_STEPS = OPPORTUNITY_SETTINGS.get("gain_steps", DEFAULT_GAIN_STEPS)
+
+# ------------------------------------------------------------
+# Telemetry settings (optional [telemetry] section in secrets)
+# ------------------------------------------------------------
+# Stage timings and token counts are served in the Prometheus text format
+# at http://127.0.0.1:<metrics_port>/metrics (0 turns the endpoint off);
+# debug_panel adds a per-run breakdown to the sidebar.
+TELEMETRY_SETTINGS = st.secrets.get("telemetry", {})
+METRICS_PORT = TELEMETRY_SETTINGS.get("metrics_port", 9464)
+METRICS_HOST = TELEMETRY_SETTINGS.get("metrics_host", "127.0.0.1")
+DEBUG_PANEL = TELEMETRY_SETTINGS.get("debug_panel", False)
 
 # ------------------------------------------------------------
 # Modern Dark Palette CSS
@@ -361,24 +579,31 @@ st.markdown(custom_css, unsafe_allow_html=True)
 # ------------------------------------------------------------
 # Helper Functions
 # ------------------------------------------------------------
+@st.cache_resource
+def get_logo_src(size):
+    """
+    Image source for the logo at a display size ("sidebar" or "hero"):
+    a static URL the browser caches, or a data URI when static serving is
+    off. Worked out once per process; None if the image is missing.
+    """
+    name = logo_asset(size)
+    if st.get_option("server.enableStaticServing"):
+        return static_url(name) if data_uri(name) else None
+    return data_uri(name)
+
 def render_logo():
     """
     Renders the small logo in the sidebar with rounded corners.
     """
-    current_dir = Path(__file__).parent
-    logo_path = current_dir / "munger.png"
-    
-    try:
-        with open(logo_path, "rb") as f:
-            logo_data = base64.b64encode(f.read()).decode()
-        
+    logo_src = get_logo_src("sidebar")
+    if logo_src:
         st.markdown(f"""
         <div class="logo">
-            <img src="data:image/png;base64,{logo_data}" class="logo-img" alt="Munger AI Logo"/>
+            <img src="{logo_src}" class="logo-img" alt="Munger AI Logo"/>
             <div class="logo-text">MUNGER AI</div>
         </div>
         """, unsafe_allow_html=True)
-    except:
+    else:
         # Fallback if file not found
         st.markdown("""
         <div class="logo">
@@ -399,22 +624,17 @@ def render_big_logo_and_title():
     """
     Renders the large, center logo (rounded) and subtitle.
     """
-    current_dir = Path(__file__).parent
-    logo_path = current_dir / "munger.png"
-    
-    try:
-        with open(logo_path, "rb") as f:
-            logo_data = base64.b64encode(f.read()).decode()
-        
+    logo_src = get_logo_src("hero")
+    if logo_src:
         st.markdown(f"""
         <div style="text-align: center; margin-bottom: 2rem;">
-            <img src="data:image/png;base64,{logo_data}"
+            <img src="{logo_src}"
                  style="width:120px; margin-bottom:1rem; border-radius:12px;"
                  alt="Munger AI"/>
             <p class="landing-subtitle">Should you buy it? Our AI decides in seconds.</p>
         </div>
         """, unsafe_allow_html=True)
-    except:
+    else:
         st.markdown("""
         <div style="text-align: center; margin-bottom: 2rem;">
             <h1 class="landing-title">MUNGER AI</h1>
@@ -444,11 +664,12 @@ def render_item_card(item_name, cost):
     """, unsafe_allow_html=True)
 
 def render_factor_card(factor, value, description):
+    value_text = "…" if value is None else f"{value:+d}"
     st.markdown(f"""
     <div class="factor-card">
         <div class="factor-letter">{factor}</div>
         <div class="factor-description">{description}</div>
-        <div class="factor-value">{value:+d}</div>
+        <div class="factor-value">{value_text}</div>
     </div>
     """, unsafe_allow_html=True)
 
@@ -456,49 +677,49 @@ def render_factor_card(factor, value, description):
 # ------------------------------------------------------------
 # Plotly Charts
 # ------------------------------------------------------------
-def create_radar_chart(factors):
-    categories = [
-        "Discretionary Income",
-        "Opportunity Cost",
-        "Goal Alignment",
-        "Long-Term Impact",
-        "Behavioral"
-    ]
-    vals = [
-        factors["D"], 
-        factors["O"], 
-        factors["G"], 
-        factors["L"], 
-        factors["B"]
-    ]
-    # close shape
-    vals.append(vals[0])
-    categories.append(categories[0])
-    
-    fig = go.Figure()
-    fig.add_trace(go.Scatterpolar(
-        r=vals,
-        theta=categories,
+RADAR_CATEGORIES = [
+    "Discretionary Income",
+    "Opportunity Cost",
+    "Goal Alignment",
+    "Long-Term Impact",
+    "Behavioral"
+]
+
+@st.cache_resource
+def get_chart_template():
+    """
+    Dark styling shared by every chart. Replaces Plotly's default template,
+    which is otherwise serialized into each chart sent to the browser.
+    """
+    return go.layout.Template(layout=dict(
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        font={'color': "#ECECEC", 'family': "Inter, sans-serif"}
+    ))
+
+@st.cache_resource
+def get_radar_base():
+    """
+    Radar figure without values, built once. The reference rings at -2..2
+    are the dashed radial grid rather than extra traces.
+    """
+    fig = go.Figure(go.Scatterpolar(
+        r=[0] * (len(RADAR_CATEGORIES) + 1),
+        theta=RADAR_CATEGORIES + RADAR_CATEGORIES[:1],  # close shape
         fill='toself',
         fillcolor='rgba(25,167,206, 0.2)',  # teal accent
         line=dict(color='#19A7CE', width=2),
         name='Factors'
     ))
-    # reference lines
-    for i in [-2, -1, 0, 1, 2]:
-        fig.add_trace(go.Scatterpolar(
-            r=[i]*len(categories),
-            theta=categories,
-            line=dict(color='rgba(236,236,236,0.2)', width=1, dash='dash'),
-            showlegend=False
-        ))
     fig.update_layout(
+        template=get_chart_template(),
         polar=dict(
             radialaxis=dict(
                 visible=True,
                 range=[-3,3],
                 tickvals=[-2,-1,0,1,2],
-                gridcolor='rgba(236,236,236,0.1)',
+                gridcolor='rgba(236,236,236,0.2)',
+                griddash='dash',
                 tickfont=dict(color='#ECECEC')
             ),
             angularaxis=dict(
@@ -509,20 +730,19 @@ def create_radar_chart(factors):
         ),
         showlegend=False,
         margin=dict(l=60, r=60, t=20, b=20),
-        height=350,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)'
+        height=350
     )
     return fig
 
-def create_pds_gauge(pds):
+@st.cache_resource
+def get_gauge_base():
     """
-    Creates a gauge from -10..10 with steps tinted red/orange/green,
-    and teal bar for the needle.
+    Gauge from -10..10 with steps tinted red/orange/green and a teal bar
+    for the needle, built once without a value.
     """
     fig = go.Figure(go.Indicator(
         mode="gauge+number",
-        value=pds,
+        value=0,
         domain={'x':[0,1],'y':[0,1]},
         gauge={
             'axis': {
@@ -542,102 +762,1024 @@ def create_pds_gauge(pds):
         number={'font': {'color': '#ECECEC'}}
     ))
     fig.update_layout(
+        template=get_chart_template(),
         height=250,
-        margin=dict(l=20, r=20, t=50, b=20),
-        paper_bgcolor='rgba(0,0,0,0)',
-        font={'color':"#ECECEC", 'family':"Inter, sans-serif"}
+        margin=dict(l=20, r=20, t=50, b=20)
+    )
+    return fig
+
+def create_radar_chart(factors):
+    fig = go.Figure(get_radar_base())
+    vals = [factors[f] for f in FACTORS]
+    fig.data[0].r = vals + vals[:1]
+    return fig
+
+def create_pds_gauge(pds):
+    fig = go.Figure(get_gauge_base())
+    fig.data[0].value = pds
+    return fig
+
+def create_sensitivity_chart(costs, incomes, pds, item_cost, leftover_income):
+    """
+    PDS heatmap over cost (log x) and leftover income (y). The lines are
+    the recommendation boundaries: buy at 5 and up, don't buy below 0.
+    """
+    fig = go.Figure(go.Contour(
+        z=pds,
+        x=costs,
+        y=incomes,
+        zmin=-10,
+        zmax=10,
+        colorscale=[
+            [0.0, 'rgba(245,101,101,0.8)'],
+            [0.5, 'rgba(237,137,54,0.6)'],
+            [1.0, 'rgba(72,187,120,0.8)']
+        ],
+        contours=dict(start=-0.5, end=4.5, size=5, coloring='heatmap'),
+        line=dict(color='#ECECEC', width=2),
+        colorbar=dict(title='PDS', tickfont=dict(color='#ECECEC')),
+        hovertemplate='Cost $%{x:,.0f}<br>Income $%{y:,.0f}<br>PDS %{z}<extra></extra>'
+    ))
+    fig.add_trace(go.Scatter(
+        x=[item_cost],
+        y=[leftover_income],
+        mode='markers',
+        marker=dict(color='#19A7CE', size=12, line=dict(color='#ECECEC', width=2)),
+        hovertemplate='This purchase<extra></extra>'
+    ))
+    fig.update_layout(
+        template=get_chart_template(),
+        xaxis=dict(type='log', title='Item cost ($)', tickprefix='$'),
+        yaxis=dict(title='Monthly leftover income ($)', tickprefix='$'),
+        showlegend=False,
+        margin=dict(l=20, r=20, t=20, b=20),
+        height=400
     )
     return fig
 
+def create_opportunity_chart(simulation):
+    """
+    Histogram of what the money could be worth at the first horizon if
+    kept, with the price and the median marked.
+    """
+    edges = simulation.bin_edges
+    fig = go.Figure(go.Bar(
+        x=[(lo + hi) / 2 for lo, hi in zip(edges, edges[1:])],
+        y=simulation.counts,
+        width=edges[1] - edges[0],
+        marker=dict(color='rgba(25,167,206,0.6)', line=dict(width=0)),
+        hovertemplate='$%{x:,.0f}: %{y:,} paths<extra></extra>'
+    ))
+    fig.add_vline(x=simulation.item_cost, line=dict(color='#ECECEC', dash='dash'),
+                  annotation_text="price", annotation_font_color='#ECECEC')
+    fig.add_vline(x=simulation.p50[0], line=dict(color='#48BB78'),
+                  annotation_text="median", annotation_font_color='#48BB78')
+    fig.update_layout(
+        template=get_chart_template(),
+        xaxis=dict(title=f"Worth in {simulation.horizons[0]} years if kept ($)", tickprefix='$'),
+        yaxis=dict(visible=False),
+        showlegend=False,
+        bargap=0,
+        margin=dict(l=20, r=20, t=30, b=20),
+        height=250
+    )
+    return fig
+
+def draw_radar(slot, factors, key):
+    """
+    Draws the radar into `slot` (a placeholder or st itself) with the
+    configured renderer; missing factors plot as 0.
+    """
+    factors = {f: factors.get(f, 0) for f in FACTORS}
+    with span("radar_chart"):
+        if CHART_RENDERER == "svg":
+            svg = radar_svg(tuple(factors[f] for f in FACTORS), tuple(RADAR_CATEGORIES))
+            slot.markdown(svg, unsafe_allow_html=True)
+        else:
+            slot.plotly_chart(create_radar_chart(factors), use_container_width=True, key=key)
+
+def draw_gauge(slot, pds, key):
+    with span("gauge_chart"):
+        if CHART_RENDERER == "svg":
+            slot.markdown(gauge_svg(pds), unsafe_allow_html=True)
+        else:
+            slot.plotly_chart(create_pds_gauge(pds), use_container_width=True, key=key)
+
 
 # ------------------------------------------------------------
 # AI Logic
 # ------------------------------------------------------------
+@st.cache_resource
+def get_response_cache():
+    """
+    One process-wide response cache shared by every session.
+    """
+    return ResponseCache(
+        path=CACHE_PATH,
+        memory_entries=CACHE_MEMORY_ENTRIES,
+        disk_entries=CACHE_DISK_ENTRIES,
+        ttl_seconds=CACHE_TTL_SECONDS,
+        enabled=CACHE_ENABLED
+    )
+
+@st.cache_resource
+def get_semantic_cache():
+    """
+    One process-wide near-duplicate index shared by every session.
+    """
+    return SemanticCache(
+        threshold=SIMILAR_THRESHOLD,
+        tolerances={"item_cost": SIMILAR_COST_TOLERANCE, "leftover_income": SIMILAR_INCOME_TOLERANCE},
+        max_entries=SIMILAR_ENTRIES,
+        ttl_seconds=CACHE_TTL_SECONDS,
+        enabled=SIMILAR_ENABLED
+    )
+
+@st.cache_resource
+def get_metrics_server():
+    """
+    The process's metrics endpoint, started on first use; None when turned
+    off or the port is taken (e.g. by another app process).
+    """
+    if not METRICS_PORT:
+        return None
+    try:
+        return serve_metrics(METRICS_PORT, METRICS_HOST)
+    except OSError:
+        return None
+
+@st.cache_resource
+def get_history_store():
+    """
+    One process-wide decision history, or None when it is turned off.
+    """
+    return DecisionHistory(HISTORY_PATH) if HISTORY_ENABLED else None
+
+@st.cache_resource
+def get_distilled_model():
+    """
+    The trained instant-scoring model, or None when turned off or not
+    trained yet (see render_instant_training).
+    """
+    if not INSTANT_ENABLED or not Path(INSTANT_MODEL_PATH).exists():
+        return None
+    try:
+        return DistilledModel.load(INSTANT_MODEL_PATH)
+    except (OSError, ValueError, KeyError):
+        return None
+
+@st.cache_resource
+def get_parse_stats():
+    """
+    Process-wide parse success/failure counters.
+    """
+    return ParseStats()
+
+@st.cache_resource
+def get_pack_sizer():
+    """
+    Shared so every batch job learns from the others' response sizes.
+    """
+    return PackSizer(
+        max_output_tokens=PACKED_MAX_OUTPUT_TOKENS,
+        max_pack_size=PACKED_MAX_ITEMS
+    )
+
+@st.cache_resource
+def get_single_flight():
+    """
+    Process-wide, so identical requests from different sessions share one
+    in-flight model call.
+    """
+    return SingleFlight()
+
+@st.cache_resource
+def get_retry_policy():
+    """
+    Process-wide, so retry counts cover every session.
+    """
+    return RetryPolicy(
+        max_attempts=RETRY_MAX_ATTEMPTS,
+        base_delay=RETRY_BASE_DELAY_SECONDS,
+        max_delay=RETRY_MAX_DELAY_SECONDS,
+        attempt_timeout=CALL_TIMEOUT_SECONDS,
+        deadline=CALL_DEADLINE_SECONDS
+    )
+
+@st.cache_resource
+def get_quota_scheduler():
+    """
+    One scheduler for the process: the quota is per Gemini project, not
+    per session.
+    """
+    return QuotaScheduler(
+        requests_per_minute=QUOTA_REQUESTS_PER_MINUTE,
+        tokens_per_minute=QUOTA_TOKENS_PER_MINUTE,
+        session_limits={
+            INTERACTIVE: (SESSION_REQUESTS_PER_MINUTE, SESSION_BURST),
+            BATCH: (BATCH_SESSION_REQUESTS_PER_MINUTE, None),
+        },
+        max_wait=QUEUE_MAX_WAIT_SECONDS
+    )
+
+@st.cache_resource
+def get_circuit_breaker(route="basic"):
+    """
+    One breaker per route, shared by every session: once it opens, nobody
+    waits on a failing model.
+    """
+    return CircuitBreaker(
+        failure_rate=BREAKER_FAILURE_RATE,
+        window=BREAKER_WINDOW,
+        min_calls=BREAKER_MIN_CALLS,
+        cooldown_seconds=BREAKER_COOLDOWN_SECONDS
+    )
+
+def _model_backend(model_name):
+    """
+    The backend for one model, as selected by [backend] kind: "gemini"
+    (default), "record" (Gemini, logging every exchange), "replay"
+    (recorded answers, offline) or "fake" (synthetic answers, offline).
+    """
+    return build_backend(
+        BACKEND_KIND,
+        model_name,
+        model=get_model(model_name) if BACKEND_KIND in ("gemini", "record") else None,
+        recording_path=RECORDING_PATH,
+        latency_ms=FAKE_LATENCY_MS,
+        error_rate=FAKE_ERROR_RATE
+    )
+
+@st.cache_resource
+def get_backend(route="basic"):
+    """
+    The route's model, hedged with its hedge model once a call runs past
+    the route's recent p95 latency, behind the quota scheduler at the
+    route's priority. Hedges are charged to the quota too, and skipped
+    when it has no room for them right away.
+    """
+    config = ROUTES[route]
+    scheduler = get_quota_scheduler()
+    hedge = None
+    if config["hedge_model"]:
+        hedge = ScheduledBackend(
+            _model_backend(config["hedge_model"]), scheduler,
+            priority=ROUTE_PRIORITY[route], optional=True
+        )
+    hedged = HedgedBackend(
+        _model_backend(config["model"]),
+        hedge,
+        name=route,
+        quantile=HEDGE_QUANTILE,
+        min_delay=HEDGE_MIN_DELAY_SECONDS,
+        initial_delay=HEDGE_INITIAL_DELAY_SECONDS
+    )
+    return ScheduledBackend(hedged, scheduler, priority=ROUTE_PRIORITY[route])
+
+@st.cache_resource
+def get_factor_client(route="basic"):
+    return FactorClient(
+        get_backend(route),
+        cache=get_response_cache(),
+        parse_stats=get_parse_stats(),
+        pack_sizer=get_pack_sizer(),
+        hybrid=HYBRID_SCORING,
+        structured=STRUCTURED_OUTPUT,
+        explanation_words=EXPLANATION_WORDS,
+        rules=SCORING_RULES,
+        packed_max_output_tokens=PACKED_MAX_OUTPUT_TOKENS,
+        flights=get_single_flight(),
+        retry=get_retry_policy(),
+        breaker=get_circuit_breaker(route),
+        similar=get_semantic_cache(),
+        distilled=get_distilled_model(),
+        instant_confidence=INSTANT_MIN_CONFIDENCE
+    )
+
+def get_session_id():
+    """
+    Identifies this browser session to the quota scheduler.
+    """
+    return st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+def in_session(fn):
+    """
+    `fn` wrapped to queue as this session from worker threads, which
+    don't inherit it.
+    """
+    session = get_session_id()
+    def run(*args, **kwargs):
+        with requester(session):
+            return fn(*args, **kwargs)
+    return run
+
+def _error_message(error):
+    if isinstance(error, EmptyResponseError):
+        return "No response from Gemini."
+    if isinstance(error, FactorParseError):
+        return f"Unable to parse valid JSON from AI output: {error}"
+    return f"Error calling Gemini: {error}"
+
 def get_factors_from_gemini(leftover_income, has_high_interest_debt,
                             main_financial_goal, purchase_urgency,
-                            item_name, item_cost, extra_context=None):
+                            item_name, item_cost, extra_context=None,
+                            use_cache=True, on_error=None, route="basic"):
     """
     Returns factor assignments (D,O,G,L,B) from -2..+2 plus brief explanations.
-    Attempts to parse valid JSON from the model's output.
+    In hybrid mode D and O come from the local rules and the model is
+    asked only for G, L and B.
+    Successful answers are cached; pass use_cache=False to force a fresh call.
+    Transient failures are retried; if Gemini stays unavailable the answer
+    is a fallback marked with a "fallback" key (see FALLBACK_NOTICES).
+    Other errors go to `on_error` (st.error by default) and yield all-zero
+    factors. `route` picks the workload's model (see ROUTES).
     """
-    extra_text = f"\nAdditional user context: {extra_context}" if extra_context else ""
+    report_error = on_error or st.error
+    client = get_factor_client(route)
+    inputs = purchase_inputs(
+        leftover_income, has_high_interest_debt, main_financial_goal,
+        purchase_urgency, item_name, item_cost, extra_context
+    )
+    try:
+        return client.get_factors(inputs, use_cache=use_cache)
+    except Exception as e:
+        report_error(_error_message(e))
+        return client.zero_factors(inputs)
+
+def stream_factors_from_gemini(leftover_income, has_high_interest_debt,
+                               main_financial_goal, purchase_urgency,
+                               item_name, item_cost, extra_context=None,
+                               on_error=None, route="basic", instant=False):
+    """
+    Streaming flavour of get_factors_from_gemini. Yields the factor dict
+    again each time the model completes another key (locally scored D and
+    O come first, before any model call); the last value yielded is the
+    final answer. With `instant`, a confident local-model answer is
+    yielded instead and Gemini is not called.
+    """
+    report_error = on_error or st.error
+    client = get_factor_client(route)
+    inputs = purchase_inputs(
+        leftover_income, has_high_interest_debt, main_financial_goal,
+        purchase_urgency, item_name, item_cost, extra_context
+    )
+    try:
+        if instant:
+            factors = client.instant_factors(inputs)
+            if factors is not None:
+                yield factors
+                return
+        yield from client.stream_factors(inputs)
+    except Exception as e:
+        report_error(_error_message(e))
+        yield client.zero_factors(inputs)
+
+def get_factors_packed(items, fallback=None):
+    """
+    Scores several purchases (a list of get_factors_from_gemini keyword
+    dicts) with as few model requests as possible: cached items are
+    served from the cache, the rest share packed prompts sized to fit
+    the output budget, and any item the packed answer lost falls back
+    to its own `fallback` call (get_factors_from_gemini by default).
+    """
+    return get_factor_client("batch").get_factors_packed(
+        items, fallback=fallback or partial(get_factors_from_gemini, route="batch")
+    )
+
+def _score_batch_row(**inputs):
+    """
+    Batch flavour of get_factors_from_gemini: raises instead of rendering
+    st.error, since worker threads can't draw on the page.
+    """
+    errors = []
+    factors = get_factors_from_gemini(**inputs, on_error=errors.append, route="batch")
+    if errors:
+        raise RuntimeError(errors[-1])
+    return factors
+
+def _score_batch_pack(items):
+    """
+    Packed flavour of _score_batch_row: one factor dict per item, or the
+    exception that item's fallback call failed with.
+    """
+    def fallback(**inputs):
+        try:
+            return _score_batch_row(**inputs)
+        except RuntimeError as e:
+            return e
+    return get_factors_packed(items, fallback=fallback)
+
+
+# ------------------------------------------------------------
+# Results
+# ------------------------------------------------------------
+FACTOR_LABELS = {
+    "D": "Discretionary Income",
+    "O": "Opportunity Cost",
+    "G": "Goal Alignment",
+    "L": "Long-Term Impact",
+    "B": "Behavioral"
+}
+
+FALLBACK_NOTICES = {
+    "cache": (
+        "Gemini is unavailable right now, so this is the last saved answer "
+        "for this purchase rather than a fresh one."
+    ),
+    "rules": (
+        "Gemini is unavailable right now. Discretionary income and opportunity "
+        "cost come from the local rules; the other factors are left neutral, "
+        "so treat this score as a rough estimate."
+    ),
+    "blocked": (
+        "Gemini declined to answer for this purchase. Discretionary income and "
+        "opportunity cost come from the local rules; the other factors are left "
+        "neutral, so treat this score as a rough estimate."
+    ),
+    "rate_limited": (
+        "Too many requests are waiting for Gemini right now, so this one ran out "
+        "of time in the queue. Discretionary income and opportunity cost come from "
+        "the local rules; the other factors are left neutral. Try again in a moment."
+    ),
+}
+
+CHART_VIEWS = ["Radar", "Gauge", "Both"]
+
+def render_decision_box(summary):
+    st.markdown(f"""
+    <div class="decision-box">
+        <h2>Purchase Decision Score</h2>
+        <div class="score">{summary['pds']}</div>
+        <div class="recommendation {summary['recommendation_class']}">{summary['recommendation']}</div>
+    </div>
+    """, unsafe_allow_html=True)
+    if summary["fallback"]:
+        st.warning(FALLBACK_NOTICES[summary["fallback"]])
+    elif summary["factors"].get("instant") is not None:
+        st.caption(
+            f"Instant estimate from the local model ({summary['factors']['instant']:.0%} confident). "
+            "Turn off instant scoring for a fresh Gemini answer."
+        )
+
+def served_by(route, factors, model_calls):
+    """
+    The model name a decision is recorded under: the local model for
+    instant answers, "cache:<model>" when no model call was made (cache
+    hits and joined in-flight calls), else the route's model.
+    """
+    if "instant" in factors:
+        return LOCAL_MODEL_NAME
+    model = get_backend(route).model_name
+    return model if model_calls else f"cache:{model}"
+
+def render_results(page, inputs, route="basic", instant=False):
+    """
+    Scores a purchase (purchase_inputs) on `route`, filling each factor
+    card and updating the charts as soon as its key streams in. The final
+    result is kept in session state for render_saved_results, which then
+    takes over the display, and appended to the decision history.
+    `instant` tries the local model first (see stream_factors_from_gemini).
+    """
+    started = time.perf_counter()
+    live = st.empty()
+    with Trace() as trace, live.container():
+        factors = _render_stream(
+            inputs["item_name"], inputs["item_cost"],
+            stream_factors_from_gemini(**inputs, route=route, instant=instant)
+        )
+    latency = time.perf_counter() - started
+    st.session_state.setdefault("results", {})[page] = {
+        "item_name": inputs["item_name"],
+        "cost": inputs["item_cost"],
+        "leftover_income": inputs["leftover_income"],
+        "has_high_interest_debt": inputs["has_high_interest_debt"],
+        "summary": summarize(factors),
+    }
+    history = get_history_store()
+    if history is not None:
+        history.record(
+            inputs, factors, page=page, model=served_by(route, factors, trace.model_calls),
+            latency_seconds=latency, input_tokens=trace.input_tokens,
+            output_tokens=trace.output_tokens
+        )
+    live.empty()
+
+def _render_stream(item_name, cost, factor_stream):
+    render_item_card(item_name, cost)
+    decision_slot = st.empty()
+    decision_slot.caption("Analyzing with AI...")
     
-    prompt = f"""
-We have a Purchase Decision Score (PDS) formula:
-PDS = D + O + G + L + B, each factor is -2 to 2.
-
-Guidelines:
-1. D: Higher if leftover_income >> item_cost
-2. O: Positive if no high-interest debt, negative if debt
-3. G: Positive if aligns with main_financial_goal, negative if conflicts
-4. L: Positive if it has a long-term benefit, negative if not
-5. B: Positive if it's an urgent need, negative if it's an impulsive or non-essential
-
-Evaluate:
-- Item: {item_name}
-- Cost: {item_cost}
-- leftover_income: {leftover_income}
-- high_interest_debt: {has_high_interest_debt}
-- main_financial_goal: {main_financial_goal}
-- purchase_urgency: {purchase_urgency}
-{extra_text}
-
-Return valid JSON:
-{{
-  "D": 2,
-  "O": 1,
-  "G": 0,
-  "L": -1,
-  "B": 2,
-  "D_explanation": "...",
-  "O_explanation": "...",
-  "G_explanation": "...",
-  "L_explanation": "...",
-  "B_explanation": "..."
-}}
-""".strip()
+    c1, c2 = st.columns(2)
+    with c1:
+        st.markdown("### Decision Factors")
+        card_slots = {f: st.empty() for f in FACTORS}
+    with c2:
+        st.markdown("### Factor Analysis")
+        radar_slot = st.empty()
+        gauge_slot = st.empty()
     
-    try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        resp = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.2,
-                max_output_tokens=512
+    def draw_card(f, factors):
+        with card_slots[f].container():
+            render_factor_card(f, factors.get(f), FACTOR_LABELS[f])
+            exp_key = f"{f}_explanation"
+            if exp_key in factors:
+                st.caption(factors[exp_key])
+    
+    for f in FACTORS:
+        draw_card(f, {})
+    
+    def show_queue(position, eta):
+        if not position:
+            decision_slot.caption("Analyzing with AI...")
+        elif eta < 1:
+            decision_slot.info(f"You're #{position} in line, starting any moment...")
+        else:
+            decision_slot.info(f"You're #{position} in line, about {eta:.0f}s to go...")
+    
+    factors = {}
+    drawn_values = None
+    with requester(get_session_id(), on_wait=show_queue):
+        for update, factors in enumerate(factor_stream):
+            for f in FACTORS:
+                draw_card(f, factors)
+            values = tuple(factors.get(f) for f in FACTORS)
+            if values != drawn_values:
+                drawn_values = values
+                with span("compute_pds"):
+                    pds = compute_pds(factors)
+                draw_radar(radar_slot, factors, key=f"radar_{update}")
+                draw_gauge(gauge_slot, pds, key=f"gauge_{update}")
+    return factors
+
+@st.fragment
+def render_saved_results(page):
+    """
+    Renders the last result scored on `page` from session state. Display
+    options rerun only this fragment: no model call, no full-page redraw.
+    """
+    saved = st.session_state.get("results", {}).get(page)
+    if saved is None:
+        return
+    summary = saved["summary"]
+    factors = summary["factors"]
+    
+    render_item_card(saved["item_name"], saved["cost"])
+    decision_slot = st.empty()
+    
+    o1, o2, o3 = st.columns([2, 1, 1])
+    with o1:
+        view = st.radio("Chart", CHART_VIEWS, index=2, horizontal=True, key=f"{page}_chart_view")
+    with o2:
+        explain = st.toggle("Show explanations", value=True, key=f"{page}_explanations")
+    with o3:
+        simulate = st.toggle("Simulate opportunity cost", value=False, key=f"{page}_simulate")
+    simulation = None
+    if simulate:
+        simulation = simulate_purchase(saved["cost"], saved["has_high_interest_debt"], OPPORTUNITY_ASSUMPTIONS)
+        if st.toggle("Use the simulated O and L in the score", value=False, key=f"{page}_use_simulated"):
+            factors = {**factors, **calibrated_factors(simulation, saved["leftover_income"], OPPORTUNITY_GAIN_STEPS)}
+            summary = summarize(factors)
+    with decision_slot.container():
+        render_decision_box(summary)
+    
+    c1, c2 = st.columns(2)
+    with c1:
+        st.markdown("### Decision Factors")
+        for f in FACTORS:
+            render_factor_card(f, factors.get(f), FACTOR_LABELS[f])
+            if explain and f"{f}_explanation" in factors:
+                st.caption(factors[f"{f}_explanation"])
+    with c2:
+        st.markdown("### Factor Analysis")
+        if view in ("Radar", "Both"):
+            draw_radar(st, factors, key=f"{page}_radar")
+        if view in ("Gauge", "Both"):
+            draw_gauge(st, summary["pds"], key=f"{page}_gauge")
+        if simulation is not None:
+            st.plotly_chart(
+                create_opportunity_chart(simulation),
+                use_container_width=True, key=f"{page}_opportunity"
+            )
+            st.caption(
+                f"{simulation.paths:,} simulated paths. Over {simulation.horizons[-1]} years "
+                f"the money could reach ${simulation.p50[-1]:,.0f} "
+                f"(90% range ${simulation.p5[-1]:,.0f} to ${simulation.p95[-1]:,.0f})."
             )
+
+@st.fragment
+def render_sensitivity(page):
+    """
+    What-if explorer for the last result on `page`: the PDS over a grid of
+    costs and incomes, computed locally from the model's judgment factors
+    (G, L, B) already in hand, so exploring never calls the model.
+    """
+    saved = st.session_state.get("results", {}).get(page)
+    if saved is None:
+        return
+    if not st.toggle("What if the price or my income changed?", key=f"{page}_what_if"):
+        return
+    
+    factors = saved["summary"]["factors"]
+    cost, income = saved["cost"], saved["leftover_income"]
+    debt = saved["has_high_interest_debt"]
+    points = st.select_slider(
+        "Grid resolution", options=[50, 100, 200], value=100, key=f"{page}_what_if_points"
+    )
+    costs, incomes = grid_axes(cost, income, points)
+    pds = pds_grid(factors, costs, incomes, debt, SCORING_RULES)
+    st.plotly_chart(
+        create_sensitivity_chart(costs, incomes, pds, cost, income),
+        use_container_width=True, key=f"{page}_what_if_chart"
+    )
+    
+    max_cost = max_cost_for(factors, income, debt, rules=SCORING_RULES)
+    if max_cost == float("inf"):
+        verdict = "it's a buy at any price"
+    elif max_cost <= 0:
+        verdict = "no price makes it a buy; the AI's judgment factors hold it back"
+    else:
+        verdict = f"it's a buy up to ${max_cost:,.2f}"
+    st.caption(
+        f"At ${income:,.0f} leftover a month, {verdict}. Goal alignment, long-term "
+        "impact and behavior are held at the AI's answer for this purchase."
+    )
+
+
+# ------------------------------------------------------------
+# Route Latency
+# ------------------------------------------------------------
+def _bucket_counts(histogram):
+    """
+    Per-bucket (not cumulative) counts of a LatencyHistogram snapshot,
+    labelled by upper bound.
+    """
+    counts = {}
+    previous = 0
+    for bound, cumulative in histogram["buckets"]:
+        label = f"≤{bound:g}s" if bound != float("inf") else "slower"
+        counts[label] = cumulative - previous
+        previous = cumulative
+    return counts
+
+def render_route_latency():
+    """
+    Sidebar expander comparing, per route, the latency users were served
+    with the primary model's own: when hedging pays off, served p95 sits
+    below primary p95. Streaming routes are measured to the first chunk.
+    """
+    rows = []
+    charts = {}
+    for route in ROUTES:
+        stats = get_backend(route).snapshot()
+        if not stats["calls"]:
+            continue
+        kind = max(("stream", "generate"), key=lambda k: stats["latency"][f"{k}/served"]["count"])
+        served = stats["latency"][f"{kind}/served"]
+        primary = stats["latency"][f"{kind}/primary"]
+        rows.append({
+            "route": route,
+            "model": stats["model"],
+            "hedge": stats["hedge_model"] or "-",
+            "calls": stats["calls"],
+            "hedged": stats["hedged"],
+            "hedge wins": stats["hedge_wins"],
+            "served p50 (s)": served["p50"],
+            "served p95 (s)": served["p95"],
+            "primary p95 (s)": primary["p95"],
+        })
+        charts[route] = pd.DataFrame({
+            "served": _bucket_counts(served),
+            "primary": _bucket_counts(primary),
+        })
+
+    if not rows:
+        return
+    with st.expander("Latency by route"):
+        st.dataframe(pd.DataFrame(rows).round(2), hide_index=True, use_container_width=True)
+        for route, chart in charts.items():
+            st.caption(route)
+            st.bar_chart(chart, height=160)
+
+
+# ------------------------------------------------------------
+# Batch Scoring
+# ------------------------------------------------------------
+def record_scored(page, scored, route="batch"):
+    """
+    Appends the successfully scored rows of a score_purchases result to
+    the decision history in one transaction, labelled like render_results
+    does (see served_by).
+    """
+    history = get_history_store()
+    if history is None:
+        return
+    rows = []
+    for (_, inputs), result, model_calls in zip(
+        iter_purchase_inputs(scored), scored[RESULT_COLUMNS].itertuples(index=False),
+        scored.attrs["model_calls"]
+    ):
+        if pd.notna(result.error):
+            continue
+        factors = {f: int(getattr(result, f)) for f in FACTORS}
+        if pd.notna(result.fallback):
+            factors["fallback"] = result.fallback
+        rows.append(history.row(inputs, factors, page=page, model=served_by(route, factors, model_calls)))
+    if rows:
+        history.record_rows(rows)
+
+def render_batch_results(upload, max_workers, packed=False):
+    """
+    Scores an uploaded CSV concurrently, streaming rows into a table
+    as they finish, and records the results in the decision history.
+    """
+    try:
+        purchases = load_purchases(upload)
+    except ValueError as e:
+        st.error(f"Couldn't read that CSV: {e}")
+        return
+
+    progress = st.progress(0.0, text=f"Scoring {len(purchases):,} purchases...")
+    table = st.empty()
+    streamed = []
+    last_draw = [0.0]
+
+    def on_result(idx, result, finished, total):
+        streamed.append({"row": idx, "item_name": purchases.at[idx, "item_name"], **result})
+        now = time.perf_counter()
+        if finished == total or now - last_draw[0] > 0.5:
+            last_draw[0] = now
+            progress.progress(finished / total, text=f"Scored {finished:,} of {total:,}")
+            table.dataframe(pd.DataFrame(streamed), use_container_width=True, hide_index=True)
+
+    if packed:
+        scored = score_purchases(
+            purchases, in_session(_score_batch_row), max_workers, on_result,
+            pack_fn=in_session(_score_batch_pack), pack_size=get_pack_sizer().pack_size
         )
-        if not resp:
-            st.error("No response from Gemini.")
-            return {"D":0,"O":0,"G":0,"L":0,"B":0}
-        
-        text = resp.text
-        # Attempt to extract valid JSON from the response
-        candidates = re.findall(r"(\{[\s\S]*?\})", text)
-        for c in candidates:
-            try:
-                data = json.loads(c)
-                if all(k in data for k in ["D","O","G","L","B"]):
-                    return data
-            except json.JSONDecodeError:
-                pass
-        
-        st.error("Unable to parse valid JSON from AI output.")
-        return {"D":0,"O":0,"G":0,"L":0,"B":0}
-    except Exception as e:
-        st.error(f"Error calling Gemini: {e}")
-        return {"D":0,"O":0,"G":0,"L":0,"B":0}
+    else:
+        scored = score_purchases(purchases, in_session(_score_batch_row), max_workers, on_result)
+    progress.empty()
+    record_scored("batch", scored)
+    table.dataframe(scored, use_container_width=True)
+
+    failed = int(scored["error"].notna().sum())
+    degraded = int(scored["fallback"].notna().sum())
+    if degraded:
+        st.warning(
+            f"Gemini was unavailable for {degraded:,} rows; their scores are "
+            "fallbacks (see the fallback column), not fresh AI answers."
+        )
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Scored", f"{len(scored):,}")
+    c2.metric("Buy it.", f"{int((scored['Recommendation'] == 'Buy it.').sum()):,}")
+    c3.metric("Errors", f"{failed:,}")
+    mode = f"packed requests of up to {get_pack_sizer().pack_size()} items" if packed else "one request per item"
+    st.caption(
+        f"Finished in {scored.attrs['elapsed_seconds']:.1f}s with "
+        f"{max_workers} concurrent requests ({mode})."
+    )
+    st.download_button(
+        "Download results CSV",
+        scored.to_csv(index=False),
+        file_name="munger_batch_results.csv",
+        mime="text/csv"
+    )
 
-def compute_pds(factors):
-    return sum(factors.get(f, 0) for f in ["D","O","G","L","B"])
 
-def get_recommendation(pds):
-    if pds >= 5:
-        return "Buy it.", "positive"
-    elif pds < 0:
-        return "Don't buy it.", "negative"
+# ------------------------------------------------------------
+# Wishlist Planner
+# ------------------------------------------------------------
+WISHLIST_EXAMPLE = pd.DataFrame({
+    "item": ["Noise-cancelling headphones", "Standing desk", "Weekend trip", "Espresso machine", "Running shoes"],
+    "cost": [300.0, 450.0, 800.0, 650.0, 120.0],
+})
+
+def score_wishlist(items, leftover_income, has_debt, main_goal, urgency):
+    """
+    Scores every wishlist item once (through the response cache), records
+    the results in the decision history and keeps them in session state
+    for render_wishlist_plan.
+    """
+    purchases = items.dropna(subset=["item", "cost"]).copy()
+    purchases = purchases[purchases["item"].astype(str).str.strip() != ""]
+    if purchases.empty:
+        st.warning("Add at least one item with a cost.")
+        return
+    purchases["income"] = leftover_income
+    purchases["debt"] = has_debt
+    purchases["goal"] = main_goal
+    purchases["urgency"] = urgency
+
+    progress = st.progress(0.0, text=f"Scoring {len(purchases):,} items...")
+    def on_result(idx, result, finished, total):
+        progress.progress(finished / total, text=f"Scored {finished:,} of {total:,}")
+    scored = score_purchases(
+        purchases.reset_index(drop=True), in_session(_score_batch_row), BATCH_MAX_WORKERS, on_result,
+        pack_fn=in_session(_score_batch_pack), pack_size=get_pack_sizer().pack_size
+    )
+    progress.empty()
+    record_scored("wishlist", scored)
+    st.session_state["wishlist"] = {"scored": scored, "leftover_income": leftover_income}
+
+@st.fragment
+def render_wishlist_plan():
+    """
+    Picks the best set of scored wishlist items for a budget. Changing the
+    budget or objective re-plans locally (see munger.portfolio): no model
+    calls.
+    """
+    wishlist = st.session_state.get("wishlist")
+    if wishlist is None:
+        return
+    scored = wishlist["scored"]
+    
+    c1, c2 = st.columns(2)
+    with c1:
+        budget = st.number_input(
+            "Budget ($)", min_value=0.0, value=float(wishlist["leftover_income"]),
+            step=50.0, key="wishlist_budget"
+        )
+    with c2:
+        objective = st.selectbox(
+            "Maximize", list(OBJECTIVES), format_func=OBJECTIVES.get, key="wishlist_objective"
+        )
+    skip_negative = st.checkbox(
+        "Leave out items the AI says not to buy", value=True, key="wishlist_skip_negative"
+    )
+    plan = plan_purchases(
+        scored, budget, objective, min_pds=0 if skip_negative else -10, rules=SCORING_RULES
+    )
+    
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Items to buy", f"{int(plan['selected'].sum())} of {len(plan)}")
+    m2.metric("Total cost", f"${plan.attrs['total_cost']:,.2f}")
+    m3.metric("Left over", f"${budget - plan.attrs['total_cost']:,.2f}")
+    m4.metric("Total PDS", plan.attrs["total_pds"])
+    st.dataframe(
+        plan.sort_values(["selected", "value"], ascending=False)[
+            ["selected", "item_name", "item_cost"] + FACTORS + ["PDS", "value"]
+        ],
+        hide_index=True, use_container_width=True,
+        column_config={
+            "selected": st.column_config.CheckboxColumn("Buy"),
+            "item_name": "Item",
+            "item_cost": st.column_config.NumberColumn("Cost", format="$%.2f"),
+        }
+    )
+    failed = int(scored["error"].notna().sum() + scored["fallback"].notna().sum())
+    if failed:
+        st.warning(f"{failed} items weren't scored by the AI; their judgment factors are neutral.")
+    st.caption(
+        f"Planned in {plan.attrs['solve_seconds'] * 1000:,.1f} ms. D and PDS are recomputed "
+        "for the budget; goal alignment, long-term impact and behavior are the AI's scores."
+    )
+
+
+# ------------------------------------------------------------
+# Decision History
+# ------------------------------------------------------------
+HISTORY_WINDOWS = {
+    "Last 7 days": 7,
+    "Last 30 days": 30,
+    "Last 90 days": 90,
+    "Last year": 365,
+    "All time": None,
+}
+
+@st.fragment
+def render_history():
+    """
+    Trends over past decisions. Everything above the table reads the daily
+    rollup (see munger.history), so it stays quick with millions of rows.
+    """
+    history = get_history_store()
+    if history is None:
+        st.info("Decision history is turned off (see the [history] secrets section).")
+        return
+    
+    window = st.selectbox("Period", list(HISTORY_WINDOWS), index=1, key="history_window")
+    since = history.since_day(HISTORY_WINDOWS[window])
+    daily = history.daily(since)
+    if daily.empty:
+        st.info("No decisions in this period yet.")
+        return
+    
+    latency = history.latency_percentiles(since)
+    decisions = int(daily["decisions"].sum())
+    m1, m2, m3, m4, m5 = st.columns(5)
+    m1.metric("Decisions", f"{decisions:,}")
+    m2.metric("Buy rate", f"{daily['buys'].sum() / decisions:.0%}")
+    m3.metric("p50 latency", f"{latency[0.5] / 1000:.2f}s" if latency[0.5] is not None else "-")
+    m4.metric("p95 latency", f"{latency[0.95] / 1000:.2f}s" if latency[0.95] is not None else "-")
+    m5.metric("Tokens", f"{int(daily['input_tokens'].sum() + daily['output_tokens'].sum()):,}")
+    
+    c1, c2 = st.columns(2)
+    with c1:
+        st.markdown("### Decisions per day")
+        per_day = daily.set_index("day")
+        per_day["other"] = per_day["decisions"] - per_day["buys"] - per_day["dont_buys"]
+        st.bar_chart(per_day[["buys", "other", "dont_buys"]], height=260)
+    with c2:
+        st.markdown("### PDS distribution")
+        st.bar_chart(history.pds_distribution(since).set_index("pds"), height=260)
+    st.markdown("### Buy rate and latency")
+    st.line_chart(daily.set_index("day")[["buy_rate"]], height=180)
+    st.line_chart(daily.set_index("day")[["mean_latency_ms"]], height=180)
+    
+    st.markdown("### Recent decisions")
+    f1, f2 = st.columns(2)
+    with f1:
+        item = st.text_input("Item", key="history_item", placeholder="Any item")
+    with f2:
+        recommendation = st.selectbox(
+            "Recommendation", ["Any", "Buy it.", "Consider carefully.", "Don't buy it."],
+            key="history_recommendation"
+        )
+    st.dataframe(
+        history.recent(200, item=item.strip() or None,
+                       recommendation=None if recommendation == "Any" else recommendation),
+        hide_index=True, use_container_width=True
+    )
+    
+    if st.button("Export to Parquet", key="history_export"):
+        export = io.BytesIO()
+        rows = history.export_parquet(export, since)
+        st.download_button(
+            f"Download {rows:,} decisions", export.getvalue(),
+            file_name="munger_history.parquet", mime="application/octet-stream"
+        )
+    
+    if INSTANT_ENABLED:
+        render_instant_training(history)
+
+def render_instant_training(history):
+    """
+    Status of the instant-scoring model and a button to (re)train it on
+    the history's Gemini answers.
+    """
+    st.markdown("### Instant model")
+    model = get_distilled_model()
+    if model is None:
+        st.caption("Not trained yet.")
     else:
-        return "Consider carefully.", "neutral"
+        holdout = model.meta.get("holdout", {})
+        trained_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(model.meta.get("trained_at", 0)))
+        if holdout.get("coverage"):
+            quality = (
+                f"On held-out decisions it answers {holdout['coverage']:.0%} instantly "
+                f"and agrees with Gemini on {holdout['recommendation']:.0%} of those verdicts "
+                f"({holdout['exact']:.0%} on every factor)."
+            )
+        else:
+            quality = "On held-out decisions it is never sure enough to answer instantly."
+        st.caption(f"Trained {trained_at} on {model.meta.get('trained_rows', 0):,} decisions. {quality}")
+    if st.button("Train from history", key="instant_train"):
+        required = get_factor_client().required
+        with st.spinner("Training..."):
+            try:
+                trained = train_from_history(history, min_confidence=INSTANT_MIN_CONFIDENCE, required=required)
+            except ValueError as e:
+                st.warning(f"Not enough history to train on: {e}")
+                return
+        if trained.meta["trained_rows"] < INSTANT_MIN_ROWS:
+            st.warning(
+                f"Only {trained.meta['trained_rows']:,} Gemini-scored decisions so far; "
+                f"instant scoring needs {INSTANT_MIN_ROWS:,}."
+            )
+            return
+        trained.save(INSTANT_MODEL_PATH)
+        get_distilled_model.clear()
+        get_factor_client.clear()
+        st.rerun()
+
 
+# ------------------------------------------------------------
+# Debug panel
+# ------------------------------------------------------------
+def render_debug_panel(trace):
+    """
+    Sidebar breakdown of where this run's time and tokens went. Stages
+    nest (page_render contains all the others), so the rows don't add up.
+    """
+    with st.sidebar.expander("Debug: this run", expanded=False):
+        breakdown = trace.breakdown()
+        if breakdown:
+            st.dataframe(
+                pd.DataFrame([
+                    {"stage": s["stage"], "calls": s["calls"], "ms": round(s["seconds"] * 1000, 1)}
+                    for s in breakdown
+                ]),
+                hide_index=True,
+                use_container_width=True
+            )
+        st.caption(
+            f"{trace.model_calls} model calls, {trace.input_tokens:,} input / "
+            f"{trace.output_tokens:,} output tokens"
+        )
+        server = get_metrics_server()
+        if server is not None:
+            host, port = server.server_address[:2]
+            st.caption(f"Metrics: http://{host}:{port}/metrics")
 
 # ------------------------------------------------------------
 # Main App
@@ -647,18 +1789,78 @@ def main():
         render_logo()
         st.markdown("##### Decision Assistant")
         
-        pages = ["Decision Tool", "Advanced Tool"]
+        pages = ["Decision Tool", "Advanced Tool", "Batch", "Wishlist", "History"]
         selection = st.radio("", pages, label_visibility="collapsed")
+        instant = get_distilled_model() is not None and st.toggle(
+            "Instant scoring", key="instant_mode",
+            help="Score with the local model trained on past answers; Gemini only when it is unsure."
+        )
         
         st.markdown("---")
         st.markdown("### Quick Tips")
         st.markdown("""
         - Enter the item and cost
         - Or use Advanced Tool for full control
+        - Batch scores a whole CSV at once
+        - Wishlist picks what fits your budget
         - Score ≥ 5 suggests buying
         """)
         
         st.markdown("---")
+        cache_stats = get_response_cache().snapshot()
+        if cache_stats["enabled"]:
+            st.caption(
+                f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+                f"({cache_stats['hit_rate']:.0%}), {cache_stats['disk_size']} stored"
+            )
+        else:
+            st.caption("Cache: bypassed")
+        similar_stats = get_semantic_cache().snapshot()
+        if similar_stats["enabled"] and similar_stats["hits"]:
+            st.caption(
+                f"Near matches: {similar_stats['hits']} reused answers, "
+                f"lookup p99 {similar_stats['lookup_p99_ms']:.2f} ms"
+            )
+        parse_stats = get_parse_stats().snapshot()
+        if parse_stats["attempts"]:
+            st.caption(
+                f"Parse failures: {parse_stats.get('failed', 0)} of "
+                f"{parse_stats['attempts']} ({parse_stats['failure_rate']:.1%})"
+            )
+        retry_stats = get_retry_policy().snapshot()
+        tripped = {
+            route: get_circuit_breaker(route).snapshot()
+            for route in ROUTES
+            if get_circuit_breaker(route).state != "closed"
+        }
+        if retry_stats["calls"] or tripped:
+            state = ", ".join(
+                f"{route} {b['state']}" + (f" (retry in {b['retry_in_seconds']:.0f}s)" if b["state"] == "open" else "")
+                for route, b in tripped.items()
+            ) or "closed"
+            st.caption(
+                f"Gemini: circuit {state} · {retry_stats['retries']} retries · "
+                f"{retry_stats['timeouts']} timeouts · {retry_stats['fallbacks']} fallbacks"
+            )
+        render_route_latency()
+        queue_stats = get_quota_scheduler().snapshot()
+        if queue_stats["queued"] or queue_stats["timeouts"]:
+            st.caption(
+                f"Queue: {sum(queue_stats['waiting'].values())} waiting · {queue_stats['queued']} of "
+                f"{queue_stats['admitted']} requests waited (mean {queue_stats['mean_wait_seconds']:.1f}s) · "
+                f"{queue_stats['timeouts']} gave up"
+            )
+        flight_stats = get_single_flight().snapshot()
+        if flight_stats["coalesced"]:
+            st.caption(
+                f"Coalesced: {flight_stats['coalesced']} requests shared "
+                f"{flight_stats['leaders']} model calls ({flight_stats['coalesced_rate']:.0%})"
+            )
+        with st.expander("Startup report"):
+            report = get_startup_report()
+            for step, seconds in report.items():
+                st.caption(f"{step}: {seconds * 1000:,.0f} ms")
+            st.caption(f"Total: {sum(report.values()) * 1000:,.0f} ms")
         st.markdown("© 2025 Munger AI")
     
     # Show the big center logo & subtitle
@@ -678,59 +1880,23 @@ def main():
             submit_btn = st.form_submit_button("Should I Buy It?")
         
         if submit_btn:
-            with st.spinner("Analyzing with AI..."):
-                leftover_income = max(1000, cost * 2)
-                has_high_interest_debt = "No"
-                main_financial_goal = "Save for emergencies"
-                purchase_urgency = "Mixed"
-                
-                factors = get_factors_from_gemini(
-                    leftover_income,
-                    has_high_interest_debt,
-                    main_financial_goal,
-                    purchase_urgency,
-                    item_name,
-                    cost
-                )
-                pds = compute_pds(factors)
-                rec_text, rec_class = get_recommendation(pds)
-                
-                render_item_card(item_name, cost)
-                st.markdown(f"""
-                <div class="decision-box">
-                    <h2>Purchase Decision Score</h2>
-                    <div class="score">{pds}</div>
-                    <div class="recommendation {rec_class}">{rec_text}</div>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                c1, c2 = st.columns(2)
-                with c1:
-                    st.markdown("### Decision Factors")
-                    factor_labels = {
-                        "D": "Discretionary Income",
-                        "O": "Opportunity Cost",
-                        "G": "Goal Alignment",
-                        "L": "Long-Term Impact",
-                        "B": "Behavioral"
-                    }
-                    for f in ["D","O","G","L","B"]:
-                        val = factors.get(f, 0)
-                        render_factor_card(f, val, factor_labels[f])
-                        exp_key = f"{f}_explanation"
-                        if exp_key in factors:
-                            st.caption(factors[exp_key])
-                            
-                with c2:
-                    st.markdown("### Factor Analysis")
-                    radar_fig = create_radar_chart(factors)
-                    st.plotly_chart(radar_fig, use_container_width=True)
-                    
-                    gauge_fig = create_pds_gauge(pds)
-                    st.plotly_chart(gauge_fig, use_container_width=True)
+            leftover_income = max(1000, cost * 2)
+            has_high_interest_debt = "No"
+            main_financial_goal = "Save for emergencies"
+            purchase_urgency = "Mixed"
+            
+            render_results("basic", purchase_inputs(
+                leftover_income,
+                has_high_interest_debt,
+                main_financial_goal,
+                purchase_urgency,
+                item_name,
+                cost
+            ), route="basic", instant=instant)
+        render_saved_results("basic")
     
     # 2. Advanced Tool
-    else:
+    elif selection == "Advanced Tool":
         render_section_header("Advanced Purchase Query", "⚙️")
         st.markdown("Customize **all** parameters for a more precise analysis.")
         
@@ -751,54 +1917,83 @@ def main():
             advanced_submit = st.form_submit_button("Analyze My Purchase")
         
         if advanced_submit:
-            with st.spinner("Contacting AI for advanced analysis..."):
-                factors = get_factors_from_gemini(
-                    leftover_income,
-                    has_debt,
-                    main_goal,
-                    urgency,
-                    item_name,
-                    item_cost,
-                    extra_context=extra_notes
-                )
-                pds = compute_pds(factors)
-                rec_text, rec_class = get_recommendation(pds)
-                
-                render_item_card(item_name, item_cost)
-                st.markdown(f"""
-                <div class="decision-box">
-                    <h2>Purchase Decision Score</h2>
-                    <div class="score">{pds}</div>
-                    <div class="recommendation {rec_class}">{rec_text}</div>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                c1, c2 = st.columns(2)
-                with c1:
-                    st.markdown("### Decision Factors")
-                    factor_labels = {
-                        "D": "Discretionary Income",
-                        "O": "Opportunity Cost",
-                        "G": "Goal Alignment",
-                        "L": "Long-Term Impact",
-                        "B": "Behavioral"
-                    }
-                    for f in ["D","O","G","L","B"]:
-                        val = factors.get(f, 0)
-                        render_factor_card(f, val, factor_labels[f])
-                        exp_key = f"{f}_explanation"
-                        if exp_key in factors:
-                            st.caption(factors[exp_key])
-                with c2:
-                    st.markdown("### Factor Analysis")
-                    radar_fig = create_radar_chart(factors)
-                    st.plotly_chart(radar_fig, use_container_width=True)
-                    
-                    gauge_fig = create_pds_gauge(pds)
-                    st.plotly_chart(gauge_fig, use_container_width=True)
+            render_results("advanced", purchase_inputs(
+                leftover_income,
+                has_debt,
+                main_goal,
+                urgency,
+                item_name,
+                item_cost,
+                extra_context=extra_notes
+            ), route="advanced", instant=instant)
+        render_saved_results("advanced")
+        render_sensitivity("advanced")
+    
+    # 3. Batch scoring
+    elif selection == "Batch":
+        render_section_header("Batch Scoring", "📋")
+        st.markdown(
+            "Upload a CSV with `item` and `cost` columns. Optional columns: "
+            "`income`, `debt`, `goal`, `urgency`, `context`."
+        )
+        
+        with st.form("batch_form"):
+            upload = st.file_uploader("Purchases CSV", type=["csv"])
+            max_workers = st.slider(
+                "Concurrent requests", min_value=1,
+                max_value=BATCH_MAX_WORKERS_LIMIT, value=BATCH_MAX_WORKERS
+            )
+            packed = st.checkbox(
+                "Pack several purchases into each AI request",
+                value=True,
+                help="Fewer, larger requests: the scoring rubric is sent once per pack."
+            )
+            batch_submit = st.form_submit_button("Score All")
+        
+        if batch_submit:
+            if upload is None:
+                st.warning("Please upload a CSV first.")
+            else:
+                render_batch_results(upload, max_workers, packed)
+    
+    # 4. Wishlist planner
+    elif selection == "Wishlist":
+        render_section_header("Wishlist Planner", "🎯")
+        st.markdown(
+            "List what you'd like to buy. Each item is scored once; then pick "
+            "a budget and the planner finds the best set that fits."
+        )
+        
+        with st.form("wishlist_form"):
+            items = st.data_editor(
+                WISHLIST_EXAMPLE, num_rows="dynamic", use_container_width=True, hide_index=True,
+                column_config={"cost": st.column_config.NumberColumn("cost", min_value=0.0, format="$%.2f")}
+            )
+            c1, c2 = st.columns(2)
+            with c1:
+                leftover_income = st.number_input("Monthly Leftover Income ($)", min_value=0.0, value=1500.0, step=100.0)
+                has_debt = st.selectbox("High-Interest Debt?", ["No", "Yes"])
+            with c2:
+                main_goal = st.text_input("Main Financial Goal", "Build an emergency fund")
+                urgency = st.selectbox("Purchase Urgency", ["Urgent Needs","Mixed","Mostly Wants"], index=2)
+            wishlist_submit = st.form_submit_button("Score My Wishlist")
+        
+        if wishlist_submit:
+            score_wishlist(items, leftover_income, has_debt, main_goal, urgency)
+        render_wishlist_plan()
+    
+    # 5. Decision history
+    else:
+        render_section_header("Decision History", "📈")
+        render_history()
 
 # ------------------------------------------------------------
 # Run the App
 # ------------------------------------------------------------
 if __name__ == "__main__":
-    main()
+    get_metrics_server()
+    with Trace() as page_trace, requester(get_session_id()):
+        with span("page_render"):
+            main()
+        if DEBUG_PANEL:
+            render_debug_panel(page_trace)
@@ -0,0 +1,123 @@
+"""
+Measure how often the distilled instant model agrees with the model it
+learned from, offline.
+
+With --history, trains on that decision history's model-scored rows (the
+same rows the app trains on) and tests on a held-out share of them.
+Without it, the labels come from a synthetic teacher: a fixed rule over
+the purchase (essential vs. luxury item, cost/income ratio, goal, debt,
+urgency, context) with a share of answers nudged by one, standing in for
+the model's judgment. Reports agreement at several confidence floors, the
+share of purchases each floor would answer instantly, and prediction
+latency.
+
+    python -m benchmarks.distill_agreement --rows 20000
+    python -m benchmarks.distill_agreement --history .munger_history.sqlite3
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from benchmarks.load_test import CATALOG, CONTEXTS, GOALS, PRICES, URGENCIES, percentile
+from munger.distill import DistilledModel, evaluate, examples_from_frame
+from munger.history import DecisionHistory
+from munger.scoring import FACTORS, JUDGMENT_FACTORS, compute_local_factors
+
+ESSENTIAL = {
+    "New Laptop", "Winter coat", "Air purifier", "Power drill", "Online course",
+    "Used car", "Standing desk", "Bicycle",
+}
+DURABLE = {"New Laptop", "Used car", "Standing desk", "Bicycle", "Power drill", "Online course"}
+
+
+def teacher(inputs, rng, noise):
+    """
+    Synthetic factor answer for a purchase.
+    """
+    item, goal = inputs["item_name"], inputs["main_financial_goal"]
+    ratio = inputs["item_cost"] / inputs["leftover_income"]
+    debt = inputs["has_high_interest_debt"] == "Yes"
+    local = compute_local_factors(inputs["leftover_income"], inputs["item_cost"], debt and "Yes" or "No")
+    g = (1 if item in ESSENTIAL else -1) + (goal == "Pay off credit cards" and debt and -1 or 0)
+    g += 1 if goal == "Invest for retirement" and item == "Online course" else 0
+    long_term = (1 if item in DURABLE else 0) - (ratio > 0.5) - (ratio > 1.5)
+    b = {"Urgent Needs": 1, "Mixed": 0, "Mostly Wants": -1}[inputs["purchase_urgency"]]
+    context = inputs.get("extra_context") or ""
+    b += ("broke" in context) - ("sale" in context)
+    answer = {"D": local["D"], "O": local["O"], "G": g, "L": long_term, "B": b}
+    for f in JUDGMENT_FACTORS:
+        if rng.random() < noise:
+            answer[f] += rng.choice([-1, 1])
+    return [max(-2, min(2, answer[f])) for f in FACTORS]
+
+
+def synthetic(rows, noise, seed):
+    rng = random.Random(seed)
+    inputs = []
+    for _ in range(rows):
+        inputs.append({
+            "item_name": rng.choice(CATALOG),
+            "item_cost": float(rng.choice(PRICES)),
+            "leftover_income": float(rng.choice([300, 500, 1000, 1500, 3000, 6000])),
+            "has_high_interest_debt": rng.choice(["No", "Yes"]),
+            "main_financial_goal": rng.choice(GOALS),
+            "purchase_urgency": rng.choice(URGENCIES),
+            "extra_context": rng.choice(CONTEXTS),
+        })
+    return inputs, np.array([teacher(x, rng, noise) for x in inputs])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--history", help="decision history file to train and test on")
+    ap.add_argument("--rows", type=int, default=20_000, help="synthetic rows without --history")
+    ap.add_argument("--noise", type=float, default=0.1, help="share of synthetic answers nudged by one")
+    ap.add_argument("--holdout", type=float, default=0.2)
+    ap.add_argument("--epochs", type=int, default=12)
+    ap.add_argument("--factors", choices=["judgment", "all"], default="judgment",
+                    help="factors that must be confident (judgment: G, L, B, as in hybrid mode)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    if args.history:
+        inputs, labels = examples_from_frame(DecisionHistory(args.history).training_rows())
+        source = args.history
+    else:
+        inputs, labels = synthetic(args.rows, args.noise, args.seed)
+        source = f"synthetic teacher, {args.noise:.0%} noise"
+    order = np.random.default_rng(args.seed).permutation(len(inputs))
+    cut = max(1, int(len(inputs) * args.holdout))
+    test, train = order[:cut], order[cut:]
+    test_inputs = [inputs[i] for i in test]
+    print(f"{len(inputs):,} labelled purchases ({source}): {len(train):,} train, {len(test):,} test")
+
+    started = time.perf_counter()
+    model = DistilledModel().fit([inputs[i] for i in train], labels[train], epochs=args.epochs, seed=args.seed)
+    model.calibrate(test_inputs, labels[test])
+    print(f"trained in {time.perf_counter() - started:.1f}s, temperature {model.temperature:.1f}")
+
+    factors = JUDGMENT_FACTORS if args.factors == "judgment" else FACTORS
+    print(f"\n{'confidence':>10} {'coverage':>9} {'exact':>7} {'within 1':>9} {'PDS':>7} {'verdict':>8}  per factor")
+    for floor in (0.0, 0.5, 0.6, 0.7, 0.8, 0.9):
+        r = evaluate(model, test_inputs, labels[test], floor, factors)
+        per_factor = " ".join(f"{f} {share:.0%}" for f, share in r["per_factor"].items())
+        print(
+            f"{floor:>10.0%} {r['coverage']:>9.1%} {r['exact']:>7.1%} {r['within_one']:>9.1%} "
+            f"{r['pds_exact']:>7.1%} {r['recommendation']:>8.1%}  {per_factor}"
+        )
+
+    latencies = []
+    for x in test_inputs[:5000]:
+        started = time.perf_counter()
+        model.predict(x)
+        latencies.append((time.perf_counter() - started) * 1000)
+    print(
+        f"\npredict    p50 {percentile(latencies, 50):.3f} ms, p99 {percentile(latencies, 99):.3f} ms, "
+        f"max {max(latencies):.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Fill a decision history with synthetic rows and time the dashboard queries.
+
+    python -m benchmarks.history_load --rows 1000000
+    python -m benchmarks.history_load --rows 200000 --path /tmp/history.sqlite3 --parquet /tmp/history.parquet
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.load_test import CATALOG, PRICES
+from munger.history import DecisionHistory
+from munger.scoring import FACTORS
+
+
+def _timed(label, fn):
+    started = time.perf_counter()
+    result = fn()
+    print(f"{label:<24} {(time.perf_counter() - started) * 1000:>9.1f} ms")
+    return result
+
+
+def fill(history, rows, days, seed, batch=20_000):
+    rng = random.Random(seed)
+    now = time.time()
+    pending = []
+    for i in range(rows):
+        factors = {f: rng.randint(-2, 2) for f in FACTORS}
+        if rng.random() < 0.02:
+            factors["fallback"] = "rules"
+        inputs = {
+            "item_name": rng.choice(CATALOG),
+            "item_cost": float(rng.choice(PRICES)),
+            "leftover_income": float(rng.choice([500, 1500, 3000, 6000])),
+            "has_high_interest_debt": rng.choice(["No", "Yes"]),
+            "main_financial_goal": "Save for emergencies",
+            "purchase_urgency": "Mixed",
+        }
+        pending.append(history.row(
+            inputs, factors, page="benchmark", model="fake:gemini-2.0-flash",
+            latency_seconds=rng.lognormvariate(-0.5, 0.6),
+            input_tokens=rng.randint(300, 500), output_tokens=rng.randint(40, 120),
+            created_at=now - rng.random() * days * 86400,
+        ))
+        if len(pending) == batch or i == rows - 1:
+            history.record_rows(pending)
+            pending = []
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--path", help="history file (default: a temporary one)")
+    ap.add_argument("--parquet", help="also time a Parquet export to this file")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    path = args.path or os.path.join(tempfile.mkdtemp(), "history.sqlite3")
+    history = DecisionHistory(path)
+    started = time.perf_counter()
+    fill(history, args.rows, args.days, args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"inserted {args.rows:,} rows in {elapsed:.1f}s ({args.rows / elapsed:,.0f}/s) into {path}")
+
+    since = history.since_day(30)
+    _timed("count", lambda: len(history))
+    _timed("daily, all time", history.daily)
+    _timed("daily, 30 days", lambda: history.daily(since))
+    _timed("PDS distribution", history.pds_distribution)
+    percentiles = _timed("latency percentiles", history.latency_percentiles)
+    print("  " + ", ".join(f"p{q * 100:g} {ms:,.0f} ms" for q, ms in percentiles.items()))
+    _timed("recent 200", history.recent)
+    _timed("recent for one item", lambda: history.recent(item=CATALOG[0]))
+    _timed("recent don't-buys", lambda: history.recent(recommendation="Don't buy it."))
+    if args.parquet:
+        written = _timed("Parquet export", lambda: history.export_parquet(args.parquet))
+        print(f"exported {written:,} rows, {os.path.getsize(args.parquet) / 1e6:,.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
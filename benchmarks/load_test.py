@@ -0,0 +1,213 @@
+"""
+Load test the Decision Tool and Advanced Tool flows offline.
+
+Drives many concurrent simulated sessions through the same FactorClient
+the app uses, backed by FakeBackend (or ReplayBackend with --replay), and
+reports p50/p95/p99 latency, throughput and memory. No network needed.
+
+    python -m benchmarks.load_test --sessions 50 --requests 20
+    python -m benchmarks.load_test --replay recordings.jsonl --speed 0
+    python -m benchmarks.load_test --hedge --latency-sigma 0.8
+"""
+import argparse
+import random
+import resource
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+from munger.backends import FakeBackend, ReplayBackend
+from munger.cache import ResponseCache
+from munger.factors import FactorClient, purchase_inputs
+from munger.routing import HedgedBackend
+from munger.scoring import compute_pds, get_recommendation
+
+CATALOG = [
+    "New Laptop", "Noise-cancelling headphones", "Espresso machine", "Gym membership",
+    "Used car", "Standing desk", "Smartphone upgrade", "Concert tickets",
+    "Winter coat", "Online course", "Gaming console", "Bicycle",
+    "Designer handbag", "Air purifier", "Weekend getaway", "Power drill",
+]
+PRICES = [49, 99, 199, 299, 499, 799, 1200, 2000]
+GOALS = ["Build an emergency fund", "Pay off credit cards", "Save for a house", "Invest for retirement"]
+URGENCIES = ["Urgent Needs", "Mixed", "Mostly Wants"]
+CONTEXTS = [None, "", "My current one broke last week.", "It's on sale until Friday."]
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of an unsorted list (q in 0..100).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _popular_item(rng):
+    # Zipf-like popularity so identical questions actually recur
+    weights = [1 / (i + 1) for i in range(len(CATALOG))]
+    return rng.choices(CATALOG, weights)[0]
+
+
+def decision_tool_flow(client, rng):
+    """
+    The basic form: item and cost only, everything else hard-coded.
+    """
+    cost = rng.choice(PRICES)
+    inputs = purchase_inputs(
+        max(1000, cost * 2), "No", "Save for emergencies", "Mixed",
+        _popular_item(rng), cost
+    )
+    factors = client.get_factors(inputs)
+    return get_recommendation(compute_pds(factors))
+
+
+def advanced_tool_flow(client, rng, marks=None):
+    """
+    The advanced form, consumed through the streaming path like the page.
+    `marks`, if given, gets the seconds to the first update ("first
+    factor": in hybrid mode the locally scored D and O, before any model
+    call) and to the first factor the model produced ("first model
+    factor").
+    """
+    cost = rng.choice(PRICES)
+    inputs = purchase_inputs(
+        rng.choice([500, 1500, 3000, 6000]), rng.choice(["No", "Yes"]),
+        rng.choice(GOALS), rng.choice(URGENCIES), _popular_item(rng), cost,
+        rng.choice(CONTEXTS)
+    )
+    started = time.perf_counter()
+    factors = {}
+    for factors in client.stream_factors(inputs):
+        if marks is not None:
+            elapsed = time.perf_counter() - started
+            marks.setdefault("advanced first factor", elapsed)
+            if any(f in factors for f in client.required):
+                marks.setdefault("advanced first model factor", elapsed)
+    return get_recommendation(compute_pds(factors))
+
+
+def run_session(client, seed, requests, advanced_share, think_ms, results, lock):
+    rng = random.Random(seed)
+    for _ in range(requests):
+        flow = "advanced" if rng.random() < advanced_share else "decision"
+        marks = {} if flow == "advanced" else None
+        started = time.perf_counter()
+        try:
+            if flow == "advanced":
+                advanced_tool_flow(client, rng, marks)
+            else:
+                decision_tool_flow(client, rng)
+            error = None
+        except Exception as e:
+            error = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            results[flow].append(elapsed)
+            for name, seconds in (marks or {}).items():
+                results[name].append(seconds)
+            if error:
+                results["errors"].append(error)
+        if think_ms:
+            time.sleep(rng.expovariate(1000 / think_ms))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--sessions", type=int, default=50, help="concurrent simulated sessions")
+    ap.add_argument("--requests", type=int, default=20, help="requests per session")
+    ap.add_argument("--advanced-share", type=float, default=0.3)
+    ap.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a session's requests")
+    ap.add_argument("--latency-ms", type=float, default=600.0, help="fake backend median latency")
+    ap.add_argument("--latency-sigma", type=float, default=0.35)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--malformed-rate", type=float, default=0.0)
+    ap.add_argument("--replay", help="serve a RecordingBackend JSONL file instead of fake answers")
+    ap.add_argument("--speed", type=float, default=1.0, help="replay latency multiplier")
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--no-hybrid", action="store_true")
+    ap.add_argument("--hedge", action="store_true", help="hedge slow calls with a second fake backend")
+    ap.add_argument("--hedge-quantile", type=float, default=0.95)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    backend = FakeBackend(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate, malformed_rate=args.malformed_rate, seed=args.seed
+    )
+    if args.replay:
+        backend = ReplayBackend(args.replay, speed=args.speed, fallback=backend,
+                                error_rate=args.error_rate, seed=args.seed)
+    if args.hedge:
+        hedge = FakeBackend(
+            latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+            error_rate=args.error_rate, malformed_rate=args.malformed_rate, seed=args.seed + 1
+        )
+        backend = HedgedBackend(backend, hedge, quantile=args.hedge_quantile,
+                                min_delay=args.latency_ms / 1000 / 4, max_workers=args.sessions * 2)
+    cache = ResponseCache(enabled=not args.no_cache)
+    client = FactorClient(backend, cache=cache, hybrid=not args.no_hybrid)
+
+    results = defaultdict(list)
+    lock = threading.Lock()
+    tracemalloc.start()
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(
+            target=run_session,
+            args=(client, args.seed * 100_003 + i, args.requests, args.advanced_share,
+                  args.think_ms, results, lock)
+        )
+        for i in range(args.sessions)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = len(results["decision"]) + len(results["advanced"])
+    print(f"{args.sessions} sessions x {args.requests} requests against {backend.model_name} "
+          f"({args.latency_ms:.0f} ms median upstream)")
+    print(f"{'flow':<30}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for flow in ("decision", "advanced", "advanced first factor", "advanced first model factor"):
+        values = results[flow]
+        if values:
+            print(f"{flow:<30}{len(values):>7}"
+                  f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+                  f"{percentile(values, 99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+    print()
+    print(f"throughput: {total / wall:,.1f} requests/s over {wall:.2f}s")
+    stats = cache.snapshot()
+    print(f"cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%})")
+    flights = client.flights.snapshot()
+    print(f"coalesced: {flights['coalesced']} requests shared {flights['leaders']} model calls "
+          f"(largest pile-up {flights['max_waiters']})")
+    retry = client.retry.snapshot()
+    breaker = client.breaker.snapshot()
+    print(f"resilience: {retry['retries']} retries, {retry['timeouts']} timeouts, "
+          f"{retry['fallbacks']} fallbacks; breaker {breaker['state']} "
+          f"({breaker['trips']} trips, {breaker['short_circuited']} short-circuited)")
+    if args.hedge:
+        hedged = backend.snapshot()
+        print(f"hedging: {hedged['hedged']} of {hedged['calls']} calls hedged "
+              f"({hedged['hedge_rate']:.0%}), hedge won {hedged['hedge_wins']}")
+        for kind in ("generate", "stream"):
+            served = hedged["latency"][f"{kind}/served"]
+            primary = hedged["latency"][f"{kind}/primary"]
+            if served["count"]:
+                print(f"  {kind:<9} served p95/p99 {served['p95'] * 1000:7.1f}/{served['p99'] * 1000:7.1f} ms"
+                      f"  vs primary alone {primary['p95'] * 1000:7.1f}/{primary['p99'] * 1000:7.1f} ms")
+    print(f"errors: {len(results['errors'])} ({len(results['errors']) / max(total, 1):.1%})")
+    print(f"parse: {client.parse_stats.snapshot()}")
+    print(f"memory: {peak / 2**20:.1f} MiB traced peak, "
+          f"{resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB max RSS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Measure the bytes the app sends to the browser per script run.
+
+Runs app.py under Streamlit's AppTest harness with the fake backend and
+totals the serialized size of every message the script enqueues for the
+websocket: first load, a plain rerun, scoring a purchase, and changing a
+display option on the result.
+
+    python -m benchmarks.page_payload
+    python -m benchmarks.page_payload --no-static-serving --charts svg
+"""
+import argparse
+from pathlib import Path
+
+from streamlit import config
+from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+from streamlit.testing.v1 import AppTest
+
+APP = Path(__file__).resolve().parent.parent / "app.py"
+
+
+class PayloadMeter:
+    """
+    Counts the bytes of ForwardMsgs enqueued while it is active.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.messages = 0
+        self._enqueue = ForwardMsgQueue.enqueue
+
+    def __enter__(self):
+        meter = self
+
+        def enqueue(queue, msg):
+            meter.bytes += msg.ByteSize()
+            meter.messages += 1
+            return meter._enqueue(queue, msg)
+
+        ForwardMsgQueue.enqueue = enqueue
+        return self
+
+    def __exit__(self, *exc):
+        ForwardMsgQueue.enqueue = self._enqueue
+
+
+def _measure(label, action):
+    with PayloadMeter() as meter:
+        app = action()
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    print(f"{label:<18} {meter.bytes:>10,} bytes in {meter.messages} messages")
+    return app
+
+
+def _widget(app, kind, key):
+    try:
+        return getattr(app, kind)(key=key)
+    except KeyError:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--no-static-serving", action="store_true",
+                    help="inline assets as data URIs, as when static serving is off")
+    ap.add_argument("--charts", choices=["plotly", "svg"], default="plotly")
+    args = ap.parse_args()
+    config.set_option("server.enableStaticServing", not args.no_static_serving)
+
+    app = AppTest.from_file(str(APP), default_timeout=60)
+    app.secrets["google"] = {"api_key": "benchmark"}
+    app.secrets["backend"] = {"kind": "fake", "fake_latency_ms": 5}
+    app.secrets["cache"] = {"enabled": False}
+    app.secrets["display"] = {"charts": args.charts}
+
+    app = _measure("first load", app.run)
+    app = _measure("rerun", app.run)
+    app = _measure("score purchase", lambda: app.button[0].click().run())
+    view = _widget(app, "radio", "basic_chart_view")
+    if view is not None:
+        _measure("change chart view", lambda: view.set_value("Gauge").run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Fuzz and benchmark the factor extractor against malformed model output.
+
+Generates model-like responses from a fixed seed (clean JSON, code fences,
+prose with braces, nested wrappers, string/float/out-of-range values,
+non-finite numbers, truncation, missing keys, junk) and checks munger.parsing.extract_factors
+against the expected outcome of each case. The regex scan the app used to
+rely on is run over the same corpus for comparison.
+
+Exits non-zero if extract_factors gets any case wrong.
+
+    python -m benchmarks.parser_fuzz [--cases 5000] [--seed 7]
+"""
+import argparse
+import json
+import random
+import re
+import time
+from collections import Counter, defaultdict
+
+from munger.parsing import (
+    FactorParseError,
+    InvalidFactorValueError,
+    MissingFactorsError,
+    NoJSONObjectError,
+    extract_factors,
+)
+from munger.scoring import FACTORS
+
+NON_FINITE = ["Infinity", "-Infinity", "NaN", "1e999", "-1e999", '"inf"', '"-inf"', '"Infinity"', '"nan"']
+WORDS = "budget laptop need want goal savings impulse value durable \"quoted\" 50%".split()
+
+
+def legacy_extract(text, required=FACTORS):
+    """
+    The original non-greedy regex scan from get_factors_from_gemini.
+    """
+    for c in re.findall(r"(\{[\s\S]*?\})", text):
+        try:
+            data = json.loads(c)
+            if all(k in data for k in required):
+                return data
+        except json.JSONDecodeError:
+            pass
+    return None
+
+
+def _sentence(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+
+
+def _answer(rng):
+    factors = {k: rng.randint(-2, 2) for k in FACTORS}
+    obj = dict(factors)
+    for k in FACTORS:
+        obj[f"{k}_explanation"] = _sentence(rng)
+    return factors, obj
+
+
+def make_case(rng):
+    """
+    Returns (category, text, expected) where expected is a factor dict or
+    the FactorParseError subclass extract_factors should raise.
+    """
+    factors, obj = _answer(rng)
+    kind = rng.choice([
+        "clean", "fenced", "prose", "brace_in_explanation", "nested",
+        "string_values", "float_values", "out_of_range", "stray_brace",
+        "echoed_example", "truncated", "missing_key", "bad_value", "non_finite",
+        "no_json",
+    ])
+    dumped = json.dumps(obj, indent=rng.choice([None, 2]))
+
+    if kind == "clean":
+        return kind, dumped, factors
+    if kind == "fenced":
+        return kind, f"```json\n{dumped}\n```", factors
+    if kind == "prose":
+        return kind, f"{_sentence(rng)}\n{dumped}\n{_sentence(rng)}", factors
+    if kind == "brace_in_explanation":
+        obj["G_explanation"] = "fits the {emergency fund} goal, see {\"note\": 1}"
+        return kind, json.dumps(obj), factors
+    if kind == "nested":
+        return kind, json.dumps({"result": {"factors": obj}}), factors
+    if kind == "string_values":
+        text = json.dumps({k: (f"{v:+d}" if k in FACTORS else v) for k, v in obj.items()})
+        return kind, text, factors
+    if kind == "float_values":
+        text = json.dumps({k: (float(v) if k in FACTORS else v) for k, v in obj.items()})
+        return kind, text, factors
+    if kind == "out_of_range":
+        obj["D"] = rng.choice([-7, 3, 10])
+        expected = dict(factors, D=max(-2, min(2, obj["D"])))
+        return kind, json.dumps(obj), expected
+    if kind == "stray_brace":
+        return kind, f"Format: {{ D, O, G ... \n{dumped}", factors
+    if kind == "echoed_example":
+        example = json.dumps({k: 0 for k in ["D", "O"]})
+        return kind, f"Example {example}\nAnswer: {dumped}", factors
+    if kind == "truncated":
+        return kind, dumped[:rng.randint(1, len(dumped) - 2)], (NoJSONObjectError, MissingFactorsError)
+    if kind == "missing_key":
+        del obj[rng.choice(FACTORS)]
+        return kind, json.dumps(obj), MissingFactorsError
+    if kind == "bad_value":
+        obj[rng.choice(FACTORS)] = rng.choice(["high", None, True, [1]])
+        return kind, json.dumps(obj), InvalidFactorValueError
+    if kind == "non_finite":
+        obj[rng.choice(FACTORS)] = "__non_finite__"
+        return kind, json.dumps(obj).replace('"__non_finite__"', rng.choice(NON_FINITE)), InvalidFactorValueError
+    return kind, _sentence(rng).replace("{", "").replace("}", ""), NoJSONObjectError
+
+
+def _check(text, expected):
+    try:
+        got = extract_factors(text)
+    except FactorParseError as e:
+        return isinstance(expected, (tuple, type)) and isinstance(e, expected)
+    if not isinstance(expected, dict):
+        return False
+    return all(got[k] == expected[k] for k in FACTORS)
+
+
+def _legacy_check(text, expected):
+    got = legacy_extract(text)
+    if not isinstance(expected, dict):
+        return got is None
+    return got is not None and all(got[k] == expected[k] for k in FACTORS)
+
+
+def _time_per_call(fn, texts, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for t in texts:
+            try:
+                fn(t)
+            except FactorParseError:
+                pass
+        best = min(best, time.perf_counter() - started)
+    return best / len(texts) * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--cases", type=int, default=5000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = [make_case(rng) for _ in range(args.cases)]
+
+    totals = Counter()
+    passed = defaultdict(Counter)
+    for kind, text, expected in cases:
+        totals[kind] += 1
+        passed[kind]["new"] += _check(text, expected)
+        passed[kind]["legacy"] += _legacy_check(text, expected)
+
+    print(f"{'category':<22}{'cases':>7}{'extract_factors':>17}{'legacy regex':>14}")
+    for kind in sorted(totals):
+        n = totals[kind]
+        print(f"{kind:<22}{n:>7}{passed[kind]['new'] / n:>17.1%}{passed[kind]['legacy'] / n:>14.1%}")
+    n = sum(totals.values())
+    new_ok = sum(p["new"] for p in passed.values())
+    old_ok = sum(p["legacy"] for p in passed.values())
+    print(f"{'all':<22}{n:>7}{new_ok / n:>17.1%}{old_ok / n:>14.1%}")
+    failed = sorted(kind for kind in totals if passed[kind]["new"] < totals[kind])
+
+    texts = [text for _, text, _ in cases]
+    big = [" ".join(texts[:200])] * 20
+    print()
+    print(f"extract_factors: {_time_per_call(extract_factors, texts):8.1f} us/response")
+    print(f"legacy regex:    {_time_per_call(legacy_extract, texts):8.1f} us/response")
+    print(f"extract_factors, {len(big[0]):,}-char response: {_time_per_call(extract_factors, big):10.1f} us")
+    print(f"legacy regex,    {len(big[0]):,}-char response: {_time_per_call(legacy_extract, big):10.1f} us")
+    if failed:
+        raise SystemExit(f"extract_factors got these categories wrong: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
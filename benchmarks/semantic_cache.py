@@ -0,0 +1,140 @@
+"""
+Measure the near-duplicate cache: recall, precision, hit rate and lookup
+latency on synthetic purchases.
+
+Indexes `--entries` distinct purchases, then looks up a mix of rephrased
+copies of indexed ones (case, word order, "(new)", plurals, a typo, a
+cost a few dollars off), which should hit the original, and unseen
+purchases that differ in a model number or variant word ("pro", "mini",
+...), which should miss.
+
+    python -m benchmarks.semantic_cache --entries 100000
+    python -m benchmarks.semantic_cache --entries 20000 --threshold 0.5
+"""
+import argparse
+import random
+import time
+
+from benchmarks.load_test import GOALS, URGENCIES, percentile
+from munger.semantic import SemanticCache
+
+BRANDS = [
+    "Apple", "Samsung", "Sony", "Bose", "Dell", "Lenovo", "Breville", "DeLonghi",
+    "Nike", "Adidas", "Canon", "Nikon", "Dyson", "Peloton", "Garmin", "Fitbit",
+    "LG", "Asus", "Acer", "HP", "Razer", "Logitech", "Philips", "Panasonic",
+    "KitchenAid", "Ninja", "Trek", "Specialized", "Patagonia", "North Face",
+]
+PRODUCTS = [
+    "laptop", "headphones", "espresso machine", "smartphone", "tablet", "smartwatch",
+    "camera", "lens", "vacuum", "air purifier", "treadmill", "bike", "running shoes",
+    "winter coat", "monitor", "keyboard", "mouse", "speaker", "soundbar", "tv",
+    "blender", "stand mixer", "router", "gaming console", "drone", "projector",
+    "e-reader", "fitness tracker", "backpack", "desk chair",
+]
+VARIANTS = ["", "pro", "max", "mini", "lite", "air", "plus", "ultra"]
+
+
+def item_name(brand, product, variant, model):
+    return " ".join(part for part in (brand, product, variant, str(model) if model else "") if part)
+
+
+def rephrase(rng, name):
+    words = name.split()
+    style = rng.randrange(6)
+    if style == 0:
+        return name.upper()
+    if style == 1:
+        rng.shuffle(words)
+        return " ".join(words)
+    if style == 2:
+        return f"{name} (new)"
+    if style == 3:
+        return "New " + name.lower()
+    if style == 4:
+        # Swap two letters inside the longest word
+        i = max(range(len(words)), key=lambda j: len(words[j]))
+        word = words[i]
+        if len(word) >= 6:
+            k = rng.randrange(1, len(word) - 2)
+            words[i] = word[:k] + word[k + 1] + word[k] + word[k + 2:]
+        return " ".join(words)
+    return " ".join(w + "s" if w.isalpha() and len(w) > 3 and not w.endswith("s") else w for w in words)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--entries", type=int, default=100_000)
+    ap.add_argument("--queries", type=int, default=20_000)
+    ap.add_argument("--threshold", type=float, default=0.6)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    cache = SemanticCache(threshold=args.threshold, max_entries=args.entries)
+    scope = "bench"
+
+    def purchase(key, name, cost):
+        goal, urgency = key[4], key[5]
+        return {"item_name": name, "item_cost": cost, "main_financial_goal": goal, "purchase_urgency": urgency}
+
+    def random_key():
+        return (
+            rng.choice(BRANDS), rng.choice(PRODUCTS), rng.choice(VARIANTS),
+            rng.choice([0] + list(range(1, 30))), rng.choice(GOALS), rng.choice(URGENCIES),
+        )
+
+    indexed = {}
+    started = time.perf_counter()
+    while len(indexed) < args.entries:
+        key = random_key()
+        if key in indexed:
+            continue
+        cost = float(rng.choice([49, 99, 199, 299, 499, 799, 1200, 2000]))
+        indexed[key] = cost
+        cache.add(scope, purchase(key, item_name(*key[:4]), cost), len(indexed))
+    ids = {key: i + 1 for i, key in enumerate(indexed)}
+    elapsed = time.perf_counter() - started
+    print(f"indexed {len(cache):,} entries in {elapsed:.1f}s ({elapsed / args.entries * 1e6:.0f} us each)")
+
+    keys = list(indexed)
+    positives = hits_right = hits_wrong = negatives = false_hits = 0
+    latencies = []
+    for _ in range(args.queries):
+        if rng.random() < 0.5:
+            key = rng.choice(keys)
+            query = purchase(key, rephrase(rng, item_name(*key[:4])), indexed[key] + rng.choice([-1, 0, 1]))
+            expected = ids[key]
+            positives += 1
+        else:
+            key = random_key()
+            if key in indexed:
+                continue
+            query = purchase(key, item_name(*key[:4]), float(rng.choice([99, 499, 1200])))
+            expected = None
+            negatives += 1
+        started = time.perf_counter()
+        found = cache.get(scope, query)
+        latencies.append(time.perf_counter() - started)
+        if expected is not None:
+            if found == expected:
+                hits_right += 1
+            elif found is not None:
+                hits_wrong += 1
+        elif found is not None:
+            false_hits += 1
+
+    hits = hits_right + hits_wrong + false_hits
+    print(f"recall     {hits_right / positives:.1%} of {positives:,} rephrased purchases")
+    print(f"precision  {hits_right / hits:.1%} of {hits:,} hits" if hits else "precision  n/a (no hits)")
+    print(f"false hits {false_hits / negatives:.2%} of {negatives:,} unseen purchases")
+    stats = cache.snapshot()
+    print(f"hit rate   {stats['hit_rate']:.1%} ({stats['exact_hits']:,} exact, {stats['near_hits']:,} near)")
+    ms = [s * 1000 for s in latencies]
+    print(
+        f"lookup     p50 {percentile(ms, 50):.3f} ms, p99 {percentile(ms, 99):.3f} ms, "
+        f"max {max(ms):.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
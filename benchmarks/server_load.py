@@ -0,0 +1,141 @@
+"""
+Load test the HTTP scoring service.
+
+Starts `python -m munger.server --backend fake` in a subprocess (or targets
+--url), then drives it from many keep-alive connections and reports
+throughput, latency percentiles, status codes and the server's batching
+stats.
+
+    python -m benchmarks.server_load --connections 200 --requests 20
+    python -m benchmarks.server_load --url http://127.0.0.1:8080 --batch 10
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+from benchmarks.load_test import CATALOG, PRICES, percentile
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _request(reader, writer, host, method, path, payload=None):
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1")
+        + body
+    )
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    length = 0
+    for line in lines[1:]:
+        if line.lower().startswith("content-length:"):
+            length = int(line.split(":", 1)[1])
+    return status, json.loads(await reader.readexactly(length))
+
+
+def _purchase(rng):
+    weights = [1 / (i + 1) for i in range(len(CATALOG))]
+    return {
+        "item": rng.choices(CATALOG, weights)[0],
+        "cost": rng.choice(PRICES),
+        "income": rng.choice([500, 1500, 3000, 6000]),
+        "debt": rng.choice(["No", "Yes"]),
+        "context": f"order {rng.randint(1, 10_000)}",
+    }
+
+
+async def _connection(host, port, requests, batch, seed, latencies, statuses):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(requests):
+            started = time.perf_counter()
+            if batch > 1:
+                status, _ = await _request(reader, writer, host, "POST", "/score/batch",
+                                           {"purchases": [_purchase(rng) for _ in range(batch)]})
+            else:
+                status, _ = await _request(reader, writer, host, "POST", "/score", _purchase(rng))
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+    finally:
+        writer.close()
+
+
+async def _run(args, host, port):
+    latencies = []
+    statuses = Counter()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _connection(host, port, args.requests, args.batch, args.seed * 7919 + i, latencies, statuses)
+        for i in range(args.connections)
+    ))
+    wall = time.perf_counter() - started
+
+    reader, writer = await asyncio.open_connection(host, port)
+    _, stats = await _request(reader, writer, host, "GET", "/stats")
+    writer.close()
+
+    requests = len(latencies)
+    print(f"{args.connections} connections x {args.requests} requests"
+          f"{f' of {args.batch} purchases' if args.batch > 1 else ''}")
+    print(f"throughput: {requests / wall:,.0f} requests/s, "
+          f"{requests * args.batch / wall:,.0f} purchases/s over {wall:.2f}s")
+    print(f"latency ms: p50 {percentile(latencies, 50) * 1000:.1f}  p95 {percentile(latencies, 95) * 1000:.1f}"
+          f"  p99 {percentile(latencies, 99) * 1000:.1f}  max {max(latencies) * 1000:.1f}")
+    print(f"status: {dict(statuses)}")
+    batcher = stats["batcher"]
+    print(f"server: {batcher['batches']} model batches, mean size {batcher['mean_batch_size']:.1f}, "
+          f"{batcher['rejected']} rejected; cache hit rate {stats['cache']['hit_rate']:.0%}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--url", help="existing server; otherwise a fake-backed one is started")
+    ap.add_argument("--connections", type=int, default=200)
+    ap.add_argument("--requests", type=int, default=20, help="requests per connection")
+    ap.add_argument("--batch", type=int, default=1, help="purchases per request (uses /score/batch)")
+    ap.add_argument("--latency-ms", type=float, default=600.0, help="fake backend median latency")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    server = None
+    if args.url:
+        url = urlparse(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port = "127.0.0.1", _free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "munger.server", "--backend", "fake", "--port", str(port),
+             "--latency-ms", str(args.latency_ms)],
+            stdout=subprocess.DEVNULL
+        )
+        for _ in range(100):
+            try:
+                socket.create_connection((host, port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+    try:
+        asyncio.run(_run(args, host, port))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
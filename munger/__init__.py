@@ -0,0 +1,6 @@
+"""
+Munger AI support package.
+
+Everything in here is free of Streamlit so it can be imported by the app,
+by scripts and by other services alike.
+"""
@@ -0,0 +1,83 @@
+"""
+Static images for the app.
+
+Every image lives once, in static/. With Streamlit's static file serving
+on (server.enableStaticServing, see .streamlit/config.toml) pages link to
+it by URL, so the browser fetches and caches it once instead of receiving
+it inline on every rerun. Without static serving it is inlined as a data
+URI. Each display size gets a downscaled variant, twice its CSS width for
+HiDPI screens, so a 50px icon doesn't ship the full-size original.
+
+Regenerate the variants after replacing an image:
+
+    python -m munger.assets
+"""
+import base64
+import io
+import mimetypes
+from pathlib import Path
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+STATIC_URL = "app/static"
+
+LOGO = "munger.png"
+# Display size -> pixel width of its variant
+LOGO_VARIANTS = {
+    "sidebar": 100,
+    "hero": 240,
+}
+
+
+def variant_name(name, width):
+    path = Path(name)
+    return f"{path.stem}-{width}w{path.suffix}"
+
+
+def logo_asset(size):
+    """
+    File name of the logo variant for a display size, falling back to the
+    original if the variant hasn't been generated.
+    """
+    name = variant_name(LOGO, LOGO_VARIANTS[size])
+    return name if (STATIC_DIR / name).exists() else LOGO
+
+
+def static_url(name):
+    return f"{STATIC_URL}/{name}"
+
+
+def data_uri(name):
+    """
+    The asset inlined as a data URI, or None if it doesn't exist.
+    """
+    path = STATIC_DIR / name
+    if not path.is_file():
+        return None
+    mime = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return f"data:{mime};base64,{base64.b64encode(path.read_bytes()).decode()}"
+
+
+def build_variants(name=LOGO, widths=LOGO_VARIANTS.values()):
+    """
+    Writes a downscaled copy of static/`name` for each width and returns
+    {file name: size in bytes}.
+    """
+    # Pillow ships with Streamlit but is only needed here, not at runtime
+    from PIL import Image
+
+    written = {}
+    with Image.open(STATIC_DIR / name) as image:
+        for width in widths:
+            height = round(image.height * width / image.width)
+            out = io.BytesIO()
+            image.resize((width, height), Image.LANCZOS).save(out, format=image.format, optimize=True)
+            target = variant_name(name, width)
+            (STATIC_DIR / target).write_bytes(out.getvalue())
+            written[target] = len(out.getvalue())
+    return written
+
+
+if __name__ == "__main__":
+    print(f"{LOGO}: {(STATIC_DIR / LOGO).stat().st_size:,} bytes")
+    for target, size in build_variants().items():
+        print(f"{target}: {size:,} bytes")
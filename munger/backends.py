@@ -0,0 +1,398 @@
+"""
+Model backends behind the factor client.
+
+Every backend has a `model_name` and two methods taking a prompt plus a
+generation options dict (temperature, max_output_tokens, an optional
+response_schema and an optional per-call `timeout` in seconds):
+
+    generate(prompt, options) -> Completion
+    stream(prompt, options)   -> iterator of text chunks
+
+`GeminiBackend` talks to the real API. `RecordingBackend` wraps any
+backend and appends every exchange to a JSONL file that `ReplayBackend`
+can serve back offline. `FakeBackend` invents plausible answers with
+configurable latency and error injection, for load tests with no network.
+`build_backend` picks one by name.
+"""
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import NamedTuple
+
+from munger.scoring import FACTORS
+
+
+class Completion(NamedTuple):
+    text: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+
+class EmptyResponseError(RuntimeError):
+    """
+    The backend answered with nothing at all.
+    """
+
+
+class BlockedResponseError(RuntimeError):
+    """
+    The backend declined to answer: the response was safety-blocked or
+    came back without any text to read.
+    """
+
+
+class InjectedError(RuntimeError):
+    """
+    A failure injected by FakeBackend/ReplayBackend; the message mimics
+    the upstream status it stands in for (e.g. "429 ...").
+    """
+
+
+class DeadlineExceededError(TimeoutError):
+    """
+    A simulated call ran past its `timeout` option.
+    """
+
+
+class ReplayMissError(LookupError):
+    """
+    ReplayBackend has no recording for this prompt and no fallback.
+    """
+
+
+def recording_key(prompt, options):
+    # The timeout shrinks from retry to retry; it doesn't change the answer
+    options = {k: v for k, v in options.items() if k != "timeout"}
+    blob = json.dumps({"prompt": prompt, "options": options}, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+# ------------------------------------------------------------
+# Gemini
+# ------------------------------------------------------------
+class GeminiBackend:
+    def __init__(self, model, model_name):
+        self.model = model
+        self.model_name = model_name
+
+    @staticmethod
+    def _config(options):
+        import google.generativeai as genai
+
+        kwargs = {
+            "temperature": options.get("temperature", 0.2),
+            "max_output_tokens": options.get("max_output_tokens", 512),
+        }
+        if options.get("response_schema"):
+            kwargs["response_mime_type"] = "application/json"
+            kwargs["response_schema"] = options["response_schema"]
+        return genai.types.GenerationConfig(**kwargs)
+
+    @staticmethod
+    def _request_options(options):
+        timeout = options.get("timeout")
+        return {"timeout": timeout} if timeout else None
+
+    @staticmethod
+    def _block_reason(resp):
+        return getattr(getattr(resp, "prompt_feedback", None), "block_reason", None)
+
+    @classmethod
+    def _blocked(cls, resp):
+        reason = cls._block_reason(resp)
+        detail = f" (block reason: {reason})" if reason else ""
+        return BlockedResponseError(f"Gemini returned no answer{detail}.")
+
+    @classmethod
+    def _text(cls, resp):
+        # The SDK raises ValueError from .text for blocked or empty candidates
+        try:
+            return resp.text
+        except ValueError as e:
+            raise cls._blocked(resp) from e
+
+    def generate(self, prompt, options):
+        resp = self.model.generate_content(
+            prompt,
+            generation_config=self._config(options),
+            request_options=self._request_options(options)
+        )
+        if not resp:
+            raise EmptyResponseError("No response from Gemini.")
+        usage = getattr(resp, "usage_metadata", None)
+        return Completion(
+            self._text(resp),
+            getattr(usage, "prompt_token_count", 0) or 0,
+            getattr(usage, "candidates_token_count", 0) or 0,
+        )
+
+    def stream(self, prompt, options):
+        resp = self.model.generate_content(
+            prompt,
+            generation_config=self._config(options),
+            request_options=self._request_options(options),
+            stream=True
+        )
+        produced = False
+        for chunk in resp:
+            if self._block_reason(chunk):
+                raise self._blocked(chunk)
+            try:
+                text = chunk.text
+            except ValueError:
+                # A chunk with no parts, such as a closing one that only
+                # carries finish_reason after the answer was streamed
+                continue
+            produced = produced or bool(text)
+            yield text
+        if not produced:
+            raise self._blocked(resp)
+
+
+# ------------------------------------------------------------
+# Record / replay
+# ------------------------------------------------------------
+class RecordingBackend:
+    """
+    Passes calls through to `inner` and appends each prompt, answer and
+    latency to a JSONL file.
+    """
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = str(path)
+        self.model_name = inner.model_name
+        self._lock = threading.Lock()
+
+    def _record(self, prompt, options, completion, latency):
+        record = {
+            "key": recording_key(prompt, options),
+            "model": self.model_name,
+            "prompt": prompt,
+            "text": completion.text,
+            "input_tokens": completion.input_tokens,
+            "output_tokens": completion.output_tokens,
+            "latency_ms": round(latency * 1000, 1),
+        }
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def generate(self, prompt, options):
+        started = time.perf_counter()
+        completion = self.inner.generate(prompt, options)
+        self._record(prompt, options, completion, time.perf_counter() - started)
+        return completion
+
+    def stream(self, prompt, options):
+        started = time.perf_counter()
+        chunks = []
+        for chunk in self.inner.stream(prompt, options):
+            chunks.append(chunk)
+            yield chunk
+        text = "".join(chunks)
+        self._record(prompt, options, Completion(text, 0, len(text) // 4),
+                     time.perf_counter() - started)
+
+
+def _injected_failure(rng, error_rate):
+    if error_rate and rng.random() < error_rate:
+        raise InjectedError(rng.choice([
+            "429 Resource has been exhausted (e.g. check quota).",
+            "503 The service is currently unavailable.",
+            "504 Deadline Exceeded",
+        ]))
+
+
+def _sleep_within(delay, timeout):
+    """
+    Sleeps `delay` seconds, or raises DeadlineExceededError once `timeout`
+    (if any) would be passed.
+    """
+    if timeout is not None and delay > timeout:
+        time.sleep(timeout)
+        raise DeadlineExceededError(f"504 Deadline Exceeded after {timeout:.1f}s")
+    time.sleep(delay)
+
+
+def _stream_text(text, delay, chunk_chars=24, timeout=None):
+    """
+    Yields `text` in chunks spread over `delay` seconds, with the first
+    chunk arriving after roughly a third of it.
+    """
+    chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+    _sleep_within(delay * 0.35, timeout)
+    elapsed = delay * 0.35
+    step = delay * 0.65 / len(chunks)
+    for chunk in chunks:
+        yield chunk
+        _sleep_within(step, None if timeout is None else timeout - elapsed)
+        elapsed += step
+
+
+class ReplayBackend:
+    """
+    Serves answers recorded by RecordingBackend. `speed` scales the
+    recorded latency (0 replays instantly); prompts that were never
+    recorded go to `fallback`, or raise ReplayMissError without one. A
+    missing file is an empty recording.
+    """
+
+    def __init__(self, path, speed=1.0, fallback=None, error_rate=0.0, seed=None,
+                 model_name="replay"):
+        self.path = str(path)
+        self.speed = speed
+        self.fallback = fallback
+        self.error_rate = error_rate
+        self.model_name = model_name
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.records = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records[record["key"]] = record
+
+    def _lookup(self, prompt, options):
+        with self._lock:
+            _injected_failure(self._rng, self.error_rate)
+        return self.records.get(recording_key(prompt, options))
+
+    def generate(self, prompt, options):
+        record = self._lookup(prompt, options)
+        if record is None:
+            if self.fallback is None:
+                raise ReplayMissError("No recording for this prompt.")
+            return self.fallback.generate(prompt, options)
+        _sleep_within(record["latency_ms"] / 1000 * self.speed, options.get("timeout"))
+        return Completion(record["text"], record.get("input_tokens", 0), record.get("output_tokens", 0))
+
+    def stream(self, prompt, options):
+        record = self._lookup(prompt, options)
+        if record is None:
+            if self.fallback is None:
+                raise ReplayMissError("No recording for this prompt.")
+            yield from self.fallback.stream(prompt, options)
+            return
+        yield from _stream_text(record["text"], record["latency_ms"] / 1000 * self.speed,
+                                timeout=options.get("timeout"))
+
+
+# ------------------------------------------------------------
+# Fake
+# ------------------------------------------------------------
+_RUBRIC_FACTOR = re.compile(r"^\d+\. ([A-Z]):", re.MULTILINE)
+_PURCHASE_ID = re.compile(r"^Purchase id (\d+):", re.MULTILINE)
+
+
+class FakeBackend:
+    """
+    Offline stand-in that answers any factor prompt with deterministic,
+    well-formed JSON (same prompt, same answer).
+
+    Latency is log-normal around `latency_ms` with spread `latency_sigma`.
+    `error_rate` raises InjectedError and `malformed_rate` truncates the
+    answer, so retry and parse-failure paths get exercised too.
+    """
+
+    def __init__(self, latency_ms=600.0, latency_sigma=0.35, error_rate=0.0,
+                 malformed_rate=0.0, seed=None, model_name="fake"):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.model_name = model_name
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _latency(self):
+        with self._lock:
+            return self.latency_ms / 1000 * math.exp(self.latency_sigma * self._rng.gauss(0, 1))
+
+    def _answer(self, prompt, options):
+        schema = options.get("response_schema") or {}
+        if schema:
+            item = schema.get("items", schema)
+            factors = [k for k in item.get("properties", {}) if k in FACTORS]
+            explain = any(k.endswith("_explanation") for k in item.get("properties", {}))
+        else:
+            factors = [f for f in _RUBRIC_FACTOR.findall(prompt) if f in FACTORS] or FACTORS
+            explain = True
+        ids = [int(i) for i in _PURCHASE_ID.findall(prompt)]
+
+        def one(seed_text):
+            rng = random.Random(hashlib.sha256(seed_text.encode("utf-8")).digest())
+            obj = {f: rng.randint(-2, 2) for f in factors}
+            if explain:
+                for f in factors:
+                    obj[f"{f}_explanation"] = "Simulated answer."
+            return obj
+
+        if ids:
+            blocks = _PURCHASE_ID.split(prompt)[1:]
+            answer = [
+                {"id": int(pid), **one(block)}
+                for pid, block in zip(blocks[0::2], blocks[1::2])
+            ]
+        else:
+            answer = one(prompt)
+        text = json.dumps(answer)
+        with self._lock:
+            _injected_failure(self._rng, self.error_rate)
+            if self.malformed_rate and self._rng.random() < self.malformed_rate:
+                text = text[: len(text) // 2]
+        return text
+
+    def generate(self, prompt, options):
+        _sleep_within(self._latency(), options.get("timeout"))
+        text = self._answer(prompt, options)
+        return Completion(text, len(prompt) // 4, len(text) // 4)
+
+    def stream(self, prompt, options):
+        delay = self._latency()
+        text = self._answer(prompt, options)
+        yield from _stream_text(text, delay, timeout=options.get("timeout"))
+
+
+# ------------------------------------------------------------
+# Factory
+# ------------------------------------------------------------
+BACKEND_KINDS = ("gemini", "record", "replay", "fake")
+
+
+def build_backend(kind, model_name, model=None, recording_path="recordings.jsonl",
+                  latency_ms=600.0, error_rate=0.0):
+    """
+    The backend for one model by kind: "gemini", "record" (Gemini, logging
+    every exchange to `recording_path`), "replay" (that file, offline) or
+    "fake" (synthetic answers, offline).
+
+    Gemini kinds use `model`, a GenerativeModel, when given; otherwise one
+    is configured from the GOOGLE_API_KEY environment variable.
+    """
+    if kind == "fake":
+        return FakeBackend(latency_ms=latency_ms, error_rate=error_rate, model_name=f"fake:{model_name}")
+    if kind == "replay":
+        return ReplayBackend(
+            recording_path,
+            fallback=FakeBackend(latency_ms=latency_ms, error_rate=error_rate),
+            model_name=f"replay:{model_name}"
+        )
+    if kind not in BACKEND_KINDS:
+        raise ValueError(f"unknown backend kind {kind!r}; expected one of {', '.join(BACKEND_KINDS)}")
+    if model is None:
+        import google.generativeai as genai
+
+        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+        model = genai.GenerativeModel(model_name)
+    backend = GeminiBackend(model, model_name)
+    if kind == "record":
+        return RecordingBackend(backend, recording_path)
+    return backend
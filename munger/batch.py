@@ -0,0 +1,256 @@
+"""
+Batch scoring of many purchases with a bounded worker pool.
+
+Rows come from a CSV or a DataFrame. Each row is scored through a
+caller-supplied `score_fn` (in the app: `get_factors_from_gemini`) so this
+module stays free of Streamlit and of any particular model client.
+Optionally rows are grouped into packs and handed to a `pack_fn` that
+scores a whole list of purchases with one model request.
+"""
+import math
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from munger.scoring import FACTORS, compute_pds, get_recommendation
+from munger.telemetry import Trace
+
+# Accepted CSV headers -> get_factors_from_gemini keyword arguments
+COLUMN_ALIASES = {
+    "item": "item_name",
+    "item_name": "item_name",
+    "cost": "item_cost",
+    "item_cost": "item_cost",
+    "income": "leftover_income",
+    "leftover_income": "leftover_income",
+    "debt": "has_high_interest_debt",
+    "has_high_interest_debt": "has_high_interest_debt",
+    "goal": "main_financial_goal",
+    "main_financial_goal": "main_financial_goal",
+    "urgency": "purchase_urgency",
+    "purchase_urgency": "purchase_urgency",
+    "context": "extra_context",
+    "extra_context": "extra_context",
+}
+
+# Same assumptions the basic Decision Tool makes
+DEFAULT_DEBT = "No"
+DEFAULT_GOAL = "Save for emergencies"
+DEFAULT_URGENCY = "Mixed"
+
+RESULT_COLUMNS = FACTORS + ["PDS", "Recommendation", "fallback", "error"]
+
+
+def load_purchases(source):
+    """
+    Returns a normalized purchases DataFrame from a DataFrame, a path or a
+    file-like CSV. Only `item` and `cost` are required; the other columns
+    fall back to the basic Decision Tool defaults. Unreadable numbers load
+    as NaN and are reported per row (see purchase_error).
+    """
+    df = source.copy() if isinstance(source, pd.DataFrame) else pd.read_csv(source)
+    df = df.rename(columns=lambda c: COLUMN_ALIASES.get(str(c).strip().lower(), c))
+
+    missing = [c for c in ("item_name", "item_cost") if c not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+
+    df["item_cost"] = pd.to_numeric(df["item_cost"], errors="coerce").astype(float)
+    default_income = (df["item_cost"] * 2).clip(lower=1000)
+    if "leftover_income" not in df.columns:
+        df["leftover_income"] = default_income
+    # A blank income gets the default, as in server.parse_purchase
+    blank = df["leftover_income"].isna() | (df["leftover_income"].astype(str).str.strip() == "")
+    df["leftover_income"] = pd.to_numeric(
+        df["leftover_income"].mask(blank, default_income), errors="coerce"
+    ).astype(float)
+    if "has_high_interest_debt" not in df.columns:
+        df["has_high_interest_debt"] = DEFAULT_DEBT
+    if "main_financial_goal" not in df.columns:
+        df["main_financial_goal"] = DEFAULT_GOAL
+    if "purchase_urgency" not in df.columns:
+        df["purchase_urgency"] = DEFAULT_URGENCY
+    if "extra_context" not in df.columns:
+        df["extra_context"] = None
+
+    df = df.drop(columns=RESULT_COLUMNS, errors="ignore")
+    return df.reset_index(drop=True)
+
+
+def _clean(value):
+    return None if pd.isna(value) or value == "" else value
+
+
+def _row_inputs(row):
+    return {
+        "leftover_income": row["leftover_income"],
+        "has_high_interest_debt": _clean(row["has_high_interest_debt"]) or DEFAULT_DEBT,
+        "main_financial_goal": _clean(row["main_financial_goal"]) or DEFAULT_GOAL,
+        "purchase_urgency": _clean(row["purchase_urgency"]) or DEFAULT_URGENCY,
+        "item_name": row["item_name"],
+        "item_cost": row["item_cost"],
+        "extra_context": _clean(row["extra_context"]),
+    }
+
+
+def purchase_error(inputs):
+    """
+    Why a purchase can't be scored, or None: the checks
+    server.parse_purchase applies to request bodies.
+    """
+    if _clean(inputs["item_name"]) is None or not str(inputs["item_name"]).strip():
+        return "item is required"
+    if not math.isfinite(inputs["item_cost"]) or inputs["item_cost"] <= 0:
+        return "cost must be a positive number"
+    if not math.isfinite(inputs["leftover_income"]):
+        return "income must be a finite number"
+    return None
+
+
+def iter_purchase_inputs(purchases):
+    """
+    Yields (row_index, inputs dict) for a normalized purchases DataFrame.
+    """
+    for idx, row in purchases.iterrows():
+        yield idx, _row_inputs(row)
+
+
+def result_row(factors, error=None):
+    """
+    One output row (RESULT_COLUMNS) for a factor dict, or for a failure.
+    """
+    result = {f: int(factors.get(f, 0)) for f in FACTORS}
+    result["PDS"] = compute_pds(result)
+    result["Recommendation"] = get_recommendation(result["PDS"])[0]
+    result["fallback"] = factors.get("fallback")
+    result["error"] = error
+    return result
+
+
+def _score_one(score_fn, inputs):
+    with Trace() as trace:
+        try:
+            result = result_row(score_fn(**inputs))
+        except Exception as e:
+            result = result_row({}, error=str(e))
+    result["model_calls"] = trace.model_calls
+    return result
+
+
+def _score_pack(pack_fn, inputs_list):
+    """
+    `pack_fn` returns one factor dict per item, or an exception for items
+    it couldn't score. Items it answered from the cache are marked with a
+    "cached" key; every other item is charged the pack's model calls.
+    """
+    with Trace() as trace:
+        try:
+            outcomes = pack_fn(inputs_list)
+        except Exception as e:
+            outcomes = [e] * len(inputs_list)
+    results = []
+    for o in outcomes:
+        if isinstance(o, Exception):
+            result = result_row({}, error=str(o))
+        else:
+            result = result_row(o)
+        result["model_calls"] = 0 if isinstance(o, dict) and o.get("cached") else trace.model_calls
+        results.append(result)
+    return results
+
+
+def iter_scored_purchases(purchases, score_fn, max_workers=8,
+                          pack_fn=None, pack_size=1):
+    """
+    Scores every row of a normalized purchases DataFrame and yields
+    (row_index, result) pairs in completion order. Each result also has a
+    "model_calls" count; zero means the row was served without a model
+    call (a cache hit or a joined in-flight call). Rows failing
+    purchase_error aren't scored; their result carries the error.
+
+    At most `max_workers` calls are in flight at once, and no more than
+    twice that many are queued, so huge files don't pile up futures.
+    With `pack_fn`, each call covers `pack_size` rows; `pack_size` may be
+    a callable so an adaptive size is re-read for every pack.
+    """
+    max_workers = max(1, int(max_workers))
+    rows = iter(purchases.iterrows())
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+        rejected = deque()
+
+        def top_up():
+            while len(pending) < max_workers * 2:
+                size = 1
+                if pack_fn is not None:
+                    size = max(1, int(pack_size() if callable(pack_size) else pack_size))
+                pack = []
+                for idx, row in rows:
+                    inputs = _row_inputs(row)
+                    error = purchase_error(inputs)
+                    if error is not None:
+                        rejected.append((idx, dict(result_row({}, error=error), model_calls=0)))
+                        continue
+                    pack.append((idx, inputs))
+                    if len(pack) == size:
+                        break
+                if not pack:
+                    return
+                indexes = [idx for idx, _ in pack]
+                if pack_fn is None:
+                    future = pool.submit(_score_one, score_fn, pack[0][1])
+                else:
+                    future = pool.submit(_score_pack, pack_fn, [inputs for _, inputs in pack])
+                pending[future] = indexes
+
+        top_up()
+        while pending or rejected:
+            while rejected:
+                yield rejected.popleft()
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                indexes = pending.pop(future)
+                results = future.result()
+                if pack_fn is None:
+                    results = [results]
+                yield from zip(indexes, results)
+            top_up()
+
+
+def score_purchases(source, score_fn, max_workers=8, on_result=None,
+                    pack_fn=None, pack_size=1):
+    """
+    Scores every purchase in `source` (CSV path/file or DataFrame).
+
+    `on_result(row_index, result, finished, total)` is called from the
+    calling thread as each row completes, so a UI can stream progress.
+    Returns the input rows with D/O/G/L/B, PDS, Recommendation, fallback
+    (set when the answer is a degraded one) and error columns appended, in
+    the original row order. `attrs["model_calls"]` holds each row's model
+    call count (see iter_scored_purchases).
+    """
+    purchases = load_purchases(source)
+    total = len(purchases)
+    results = [None] * total
+    model_calls = [0] * total
+    started = time.perf_counter()
+
+    for finished, (idx, result) in enumerate(
+        iter_scored_purchases(purchases, score_fn, max_workers, pack_fn, pack_size),
+        start=1
+    ):
+        model_calls[idx] = result.pop("model_calls")
+        results[idx] = result
+        if on_result is not None:
+            on_result(idx, result, finished, total)
+
+    scored = pd.concat(
+        [purchases, pd.DataFrame(results, columns=RESULT_COLUMNS)], axis=1
+    )
+    scored.attrs["elapsed_seconds"] = time.perf_counter() - started
+    scored.attrs["model_calls"] = model_calls
+    return scored
@@ -0,0 +1,243 @@
+"""
+Two-tier response cache for model answers.
+
+Tier 1 is an in-process LRU (an OrderedDict), tier 2 is a SQLite file so
+answers survive restarts. Both tiers honour the same TTL; the memory tier
+is bounded by `memory_entries` and the disk tier by `disk_entries`.
+Expired entries linger for `stale_seconds` more, invisible to `get` but
+still available to `get_stale` as a fallback when the model is down.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def _normalize(value):
+    """
+    Normalizes a prompt input so trivially different spellings share a key:
+    strings are stripped, lower-cased and whitespace-collapsed, numbers are
+    rounded to cents and empty values collapse to None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), 2)
+    text = " ".join(str(value).split()).lower()
+    return text or None
+
+
+def make_cache_key(model, **inputs):
+    """
+    Returns a stable hex digest for a model name plus its prompt inputs.
+    """
+    payload = {"model": model}
+    payload.update({k: _normalize(v) for k, v in inputs.items()})
+    blob = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU in memory in front of a SQLite store, with TTL and size eviction.
+
+    Values must be JSON-serializable. Pass `path=None` to keep the cache
+    purely in memory, or `enabled=False` to bypass it entirely.
+    """
+
+    def __init__(self, path=None, memory_entries=512, disk_entries=50_000,
+                 ttl_seconds=7 * 24 * 3600, enabled=True, stale_seconds=30 * 24 * 3600):
+        self.path = str(path) if path else None
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.enabled = enabled
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "stale_hits": 0,
+        }
+        self._db = None
+        if self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed"
+                " ON responses (accessed_at)"
+            )
+            self._db.commit()
+
+    # --------------------------------------------------------
+    # Public API
+    # --------------------------------------------------------
+    def get(self, key):
+        """
+        Returns the cached value for `key`, or None on a miss.
+        """
+        with self._lock:
+            if not self.enabled:
+                self.stats["bypassed"] += 1
+                return None
+
+            now = time.time()
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if self._expired(created_at, now):
+                    if self._dead(created_at, now):
+                        del self._memory[key]
+                        self.stats["expirations"] += 1
+                else:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return value
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?",
+                    (key,)
+                ).fetchone()
+                if row is not None:
+                    if self._expired(row[1], now):
+                        if self._dead(row[1], now):
+                            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                            self._db.commit()
+                            self.stats["expirations"] += 1
+                    else:
+                        self._db.execute(
+                            "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                            (now, key)
+                        )
+                        self._db.commit()
+                        value = json.loads(row[0])
+                        self._remember(key, row[1], value)
+                        self.stats["disk_hits"] += 1
+                        return value
+
+            self.stats["misses"] += 1
+            return None
+
+    def get_stale(self, key):
+        """
+        Like get, but also returns entries past their TTL (within the
+        stale window). Meant for fallbacks, so it touches neither the
+        LRU order nor the hit/miss counters.
+        """
+        with self._lock:
+            if not self.enabled:
+                return None
+            now = time.time()
+            entry = self._memory.get(key)
+            if entry is not None and not self._dead(entry[0], now):
+                self.stats["stale_hits"] += 1
+                return entry[1]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?",
+                    (key,)
+                ).fetchone()
+                if row is not None and not self._dead(row[1], now):
+                    self.stats["stale_hits"] += 1
+                    return json.loads(row[0])
+            return None
+
+    def set(self, key, value):
+        """
+        Stores `value` under `key` in both tiers.
+        """
+        with self._lock:
+            if not self.enabled:
+                return
+            now = time.time()
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses"
+                    " (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now)
+                )
+                self._db.commit()
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= max(1, self.disk_entries // 100):
+                    self._prune_disk(now)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def snapshot(self):
+        """
+        Returns hit/miss counters plus current sizes, for display.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+            stats["memory_size"] = len(self._memory)
+            stats["disk_size"] = (
+                self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if self._db is not None else 0
+            )
+            stats["enabled"] = self.enabled
+            return stats
+
+    # --------------------------------------------------------
+    # Internals (callers hold self._lock)
+    # --------------------------------------------------------
+    def _expired(self, created_at, now):
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _dead(self, created_at, now):
+        # Past the stale window too: not even get_stale may serve it
+        return (
+            self.ttl_seconds is not None
+            and now - created_at > self.ttl_seconds + (self.stale_seconds or 0)
+        )
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _prune_disk(self, now):
+        self._writes_since_prune = 0
+        if self.ttl_seconds is not None:
+            cur = self._db.execute(
+                "DELETE FROM responses WHERE created_at < ?",
+                (now - self.ttl_seconds - (self.stale_seconds or 0),)
+            )
+            self.stats["expirations"] += cur.rowcount
+        overflow = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.disk_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,)
+            )
+            self.stats["evictions"] += overflow
+        self._db.commit()
@@ -0,0 +1,113 @@
+"""
+Static SVG versions of the result charts.
+
+A lighter alternative to the Plotly figures: no chart library in the
+browser and well under a kilobyte or two per chart. Factor values are
+integers in -2..2 and the PDS lies in -10..10, so the set of distinct charts
+is small and every one is memoized after it is first drawn.
+"""
+import math
+from functools import lru_cache
+
+TEXT = "#ECECEC"
+ACCENT = "#19A7CE"
+GRID = "rgba(236,236,236,0.2)"
+RADAR_RANGE = (-3, 3)
+GAUGE_RANGE = (-10, 10)
+GAUGE_STEPS = (
+    (-10, 0, "rgba(245,101,101,0.3)"),
+    (0, 5, "rgba(237,137,54,0.3)"),
+    (5, 10, "rgba(72,187,120,0.3)"),
+)
+
+
+def _point(cx, cy, radius, angle):
+    return cx + radius * math.cos(angle), cy - radius * math.sin(angle)
+
+
+@lru_cache(maxsize=4096)
+def radar_svg(values, labels, height=350):
+    """
+    Radar of `values` (one per label, in order) on a -3..3 scale with
+    dashed rings at -2..2. The first label sits at 3 o'clock and the rest
+    follow counter-clockwise, as in the Plotly version.
+    """
+    width = 2 * height
+    cx, cy, outer = width / 2, height / 2, height / 2 - 40
+    low, high = RADAR_RANGE
+    angles = [2 * math.pi * i / len(labels) for i in range(len(labels))]
+
+    def radius(value):
+        return (value - low) / (high - low) * outer
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="100%" height="{height}" font-family="Inter, sans-serif" font-size="12">'
+    ]
+    for ring in range(low + 1, high):
+        parts.append(
+            f'<circle cx="{cx}" cy="{cy}" r="{radius(ring):.1f}" fill="none" '
+            f'stroke="{GRID}" stroke-dasharray="4 4"/>'
+        )
+    for label, angle in zip(labels, angles):
+        x, y = _point(cx, cy, outer, angle)
+        parts.append(f'<line x1="{cx}" y1="{cy}" x2="{x:.1f}" y2="{y:.1f}" stroke="{GRID}"/>')
+        lx, ly = _point(cx, cy, outer + 12, angle)
+        anchor = "start" if math.cos(angle) > 0.1 else "end" if math.cos(angle) < -0.1 else "middle"
+        parts.append(
+            f'<text x="{lx:.1f}" y="{ly + 4:.1f}" fill="{TEXT}" text-anchor="{anchor}">{label}</text>'
+        )
+    points = " ".join(
+        "{:.1f},{:.1f}".format(*_point(cx, cy, radius(value), angle))
+        for value, angle in zip(values, angles)
+    )
+    parts.append(
+        f'<polygon points="{points}" fill="rgba(25,167,206,0.2)" stroke="{ACCENT}" stroke-width="2"/>'
+    )
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def _arc(cx, cy, radius, start, end):
+    """
+    SVG path along the gauge's upper half-circle between two values.
+    """
+    low, high = GAUGE_RANGE
+
+    def angle(value):
+        return math.pi * (1 - (value - low) / (high - low))
+
+    x1, y1 = _point(cx, cy, radius, angle(start))
+    x2, y2 = _point(cx, cy, radius, angle(end))
+    return f"M{x1:.1f},{y1:.1f} A{radius},{radius} 0 0 1 {x2:.1f},{y2:.1f}"
+
+
+@lru_cache(maxsize=256)
+def gauge_svg(pds, height=250):
+    """
+    Half-circle gauge over -10..10 with the red/orange/green steps and a
+    teal bar up to `pds`.
+    """
+    low, high = GAUGE_RANGE
+    value = max(low, min(high, pds))
+    width = 2 * height
+    cx, cy, radius = width / 2, height - 50, height - 100
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+        f'width="100%" height="{height}" font-family="Inter, sans-serif">',
+        f'<path d="{_arc(cx, cy, radius, low, high)}" fill="none" stroke="#2A2E3D" stroke-width="52"/>',
+    ]
+    for start, end, color in GAUGE_STEPS:
+        parts.append(f'<path d="{_arc(cx, cy, radius, start, end)}" fill="none" stroke="{color}" stroke-width="48"/>')
+    if value > low:
+        parts.append(f'<path d="{_arc(cx, cy, radius, low, value)}" fill="none" stroke="{ACCENT}" stroke-width="18"/>')
+    for tick in range(low, high + 1, 5):
+        x, y = _point(cx, cy, radius + 34, math.pi * (1 - (tick - low) / (high - low)))
+        parts.append(
+            f'<text x="{x:.1f}" y="{y + 4:.1f}" fill="{TEXT}" font-size="12" text-anchor="middle">{tick}</text>'
+        )
+    parts.append(
+        f'<text x="{cx}" y="{cy}" fill="{TEXT}" font-size="48" text-anchor="middle">{pds}</text>'
+    )
+    parts.append("</svg>")
+    return "".join(parts)
@@ -0,0 +1,232 @@
+"""
+Async scoring API for services and back-end jobs.
+
+    scorer = AsyncScorer(client, max_concurrency=32)
+    result = await scorer.score_purchase(item_name="Laptop", item_cost=800, ...)
+    async for idx, result in scorer.score_many(purchases):
+        ...
+
+The FactorClient underneath is synchronous (the model SDK is, and the
+retry, hedging and single-flight layers are thread-based), so calls run on
+a bounded thread pool; a semaphore caps how many are in flight at once.
+No Streamlit anywhere.
+
+Run as a script to score a CSV:
+
+    python -m munger.core purchases.csv -o scored.csv --backend fake
+"""
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, TypedDict
+
+from munger.backends import BACKEND_KINDS, build_backend
+from munger.cache import ResponseCache
+from munger.factors import FactorClient, purchase_inputs
+from munger.parsing import FactorDict
+from munger.scoring import compute_pds, get_recommendation
+from munger.telemetry import span
+
+_DONE = object()
+
+
+class PurchaseScore(TypedDict):
+    factors: FactorDict
+    pds: int
+    recommendation: str
+    recommendation_class: str
+    fallback: Optional[str]
+    error: Optional[str]
+
+
+def summarize(factors, error=None) -> PurchaseScore:
+    """
+    The PDS and recommendation for a factor dict.
+    """
+    with span("compute_pds"):
+        pds = compute_pds(factors)
+    text, css_class = get_recommendation(pds)
+    return {
+        "factors": factors,
+        "pds": pds,
+        "recommendation": text,
+        "recommendation_class": css_class,
+        "fallback": factors.get("fallback"),
+        "error": error,
+    }
+
+
+def _next_or_done(iterator):
+    try:
+        return next(iterator)
+    except StopIteration:
+        return _DONE
+
+
+class AsyncScorer:
+    """
+    Async front for a FactorClient. At most `max_concurrency` purchases
+    are scored at once, across every coroutine using this scorer.
+    """
+
+    def __init__(self, client, max_concurrency=16):
+        self.client = client
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="scorer")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    async def score_purchase(self, **inputs) -> PurchaseScore:
+        """
+        Scores one purchase (the purchase_inputs keyword arguments).
+        Raises what FactorClient.get_factors raises; an unreachable model
+        still yields a fallback answer (see `fallback`).
+        """
+        inputs = purchase_inputs(**inputs)
+        async with self._semaphore:
+            factors = await self._run(self.client.get_factors, inputs)
+        return summarize(factors)
+
+    async def stream_purchase(self, **inputs):
+        """
+        Yields the factor dict again each time another factor arrives (see
+        FactorClient.stream_factors); the last one is the final answer.
+        However the consumer stops, the underlying stream gets closed, so
+        an in-flight call it leads is finished for everyone waiting on it.
+        """
+        inputs = purchase_inputs(**inputs)
+        async with self._semaphore:
+            stream = self.client.stream_factors(inputs)
+            step = None
+            try:
+                while True:
+                    step = self._pool.submit(_next_or_done, stream)
+                    factors = await asyncio.wrap_future(step)
+                    if factors is _DONE:
+                        return
+                    yield factors
+            finally:
+                self._close_stream(stream, step)
+
+    def _close_stream(self, stream, step):
+        """
+        Closes a stream_factors generator on the pool, since closing may
+        block, once `step` (its last next() call) is no longer running.
+        """
+        def close(_=None):
+            try:
+                self._pool.submit(stream.close)
+            except RuntimeError:
+                # The pool is shut down
+                stream.close()
+
+        if step is None or step.cancel():
+            close()
+        else:
+            step.add_done_callback(close)
+
+    async def _score_indexed(self, idx, inputs):
+        try:
+            return idx, await self.score_purchase(**inputs)
+        except Exception as e:
+            return idx, summarize(self.client.zero_factors(purchase_inputs(**inputs)), error=str(e))
+
+    async def score_many(self, purchases):
+        """
+        Scores an iterable of inputs dicts (or (index, inputs) pairs) and
+        yields (index, PurchaseScore) as each finishes. Failures come back
+        with `error` set instead of raising. Only about twice
+        `max_concurrency` purchases are read ahead, so the iterable may be
+        huge or lazy.
+        """
+        items = iter(purchases)
+        first = next(items, None)
+        if first is None:
+            return
+        items = itertools.chain([first], items)
+        if isinstance(first, dict):
+            items = enumerate(items)
+
+        pending = set()
+        try:
+            for idx, inputs in items:
+                pending.add(asyncio.ensure_future(self._score_indexed(idx, inputs)))
+                if len(pending) >= self.max_concurrency * 2:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+
+# ------------------------------------------------------------
+# Command line: score a CSV
+# ------------------------------------------------------------
+async def _score_csv(args):
+    # pandas only for the CSV job, so services importing this module skip it
+    import pandas as pd
+
+    from munger.batch import RESULT_COLUMNS, iter_purchase_inputs, load_purchases, purchase_error, result_row
+
+    purchases = load_purchases(args.csv)
+    backend = build_backend(args.backend, args.model, recording_path=args.recording_path,
+                            latency_ms=args.latency_ms)
+    cache = ResponseCache(path=args.cache, enabled=args.cache is not None)
+    scorer = AsyncScorer(FactorClient(backend, cache=cache), max_concurrency=args.concurrency)
+
+    rows = [None] * len(purchases)
+    valid = []
+    for idx, inputs in iter_purchase_inputs(purchases):
+        error = purchase_error(inputs)
+        if error is None:
+            valid.append((idx, inputs))
+        else:
+            rows[idx] = result_row({}, error)
+    started = time.perf_counter()
+    finished = len(rows) - len(valid)
+    async for idx, score in scorer.score_many(valid):
+        rows[idx] = result_row(score["factors"], score["error"])
+        finished += 1
+        if finished % 100 == 0 or finished == len(rows):
+            print(f"\r{finished:,}/{len(rows):,} scored", end="", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    scorer.close()
+
+    scored = pd.concat([purchases, pd.DataFrame(rows, columns=RESULT_COLUMNS)], axis=1)
+    if args.output:
+        scored.to_csv(args.output, index=False)
+    else:
+        scored.to_csv(sys.stdout, index=False)
+    print(f"\n{len(rows):,} purchases in {elapsed:.2f}s "
+          f"({len(rows) / max(elapsed, 1e-9):,.0f}/s, {scored['error'].notna().sum()} errors)",
+          file=sys.stderr)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Score a CSV of purchases.")
+    ap.add_argument("csv")
+    ap.add_argument("-o", "--output", help="write results here instead of stdout")
+    ap.add_argument("--backend", choices=BACKEND_KINDS, default="gemini")
+    ap.add_argument("--model", default="gemini-2.0-flash")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--cache", help="SQLite response cache file (off by default)")
+    ap.add_argument("--recording-path", default="recordings.jsonl")
+    ap.add_argument("--latency-ms", type=float, default=600.0, help="fake backend median latency")
+    asyncio.run(_score_csv(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
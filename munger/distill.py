@@ -0,0 +1,312 @@
+"""
+Instant scoring: a small local model distilled from logged model answers.
+
+The inputs are low-dimensional (cost, income, debt flag, urgency, goal and
+item text) and the answers are five integers from -2 to +2, so a linear
+softmax classifier per factor over hashed features gets most of the way
+there. Features are a few numeric terms plus hashed one-hots for the
+cost/income ratio band, debt and urgency (and their crosses) and for the
+words and character trigrams of the item, goal and context; see
+`features`. Prediction is one sparse row gather and a softmax: tens of
+microseconds, no network.
+
+    model = train_from_history(history)      # or DistilledModel().fit(...)
+    values, confidence = model.predict(inputs)
+    model.save("instant.npz"); DistilledModel.load("instant.npz")
+
+Confidence is the calibrated probability of the predicted value; callers
+fall back to the real model when it is low (FactorClient.instant_factors).
+NumPy only, CPU only.
+"""
+import bisect
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+from munger.cache import _normalize
+from munger.scoring import FACTORS, compute_pds, get_recommendation
+from munger.semantic import normalize_item, trigrams
+
+# Model name recorded for instant answers; training skips these rows
+LOCAL_MODEL_NAME = "local:distilled"
+
+CLASSES = np.arange(-2, 3)
+FEATURE_DIM = 1 << 12
+# Slots before the hashed ones hold numeric features
+_DENSE = 4
+RATIO_EDGES = (0.02, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.5)
+COST_EDGES = (25, 50, 100, 250, 500, 1000, 2500, 5000)
+INCOME_EDGES = (0, 250, 500, 1000, 2000, 4000, 8000)
+TEMPERATURES = np.round(np.arange(0.5, 3.01, 0.1), 2)
+
+
+# ------------------------------------------------------------
+# Features
+# ------------------------------------------------------------
+def _hash(name):
+    return _DENSE + zlib.crc32(name.encode("utf-8")) % (FEATURE_DIM - _DENSE)
+
+
+def features(inputs):
+    """
+    Hashed sparse features of a purchase_inputs dict: (indices, values).
+    """
+    cost = float(inputs.get("item_cost") or 0.0)
+    income = float(inputs.get("leftover_income") or 0.0)
+    ratio = cost / income if income > 0 else 10.0
+    band = bisect.bisect_right(RATIO_EDGES, ratio)
+    debt = _normalize(inputs.get("has_high_interest_debt")) or "unknown"
+    urgency = _normalize(inputs.get("purchase_urgency")) or "unknown"
+    item = normalize_item(inputs.get("item_name") or "").split()
+    goal = normalize_item(inputs.get("main_financial_goal") or "").split()
+    context = normalize_item(inputs.get("extra_context") or "").split()
+
+    names = [
+        f"ratio={band}", f"cost={bisect.bisect_right(COST_EDGES, cost)}",
+        f"income={bisect.bisect_right(INCOME_EDGES, income)}",
+        f"debt={debt}", f"urgency={urgency}", f"ratio={band}|debt={debt}",
+        f"ratio={band}|urgency={urgency}", f"debt={debt}|urgency={urgency}",
+        f"goal={' '.join(goal)}", f"item={' '.join(item)}",
+    ]
+    names += [f"item:{w}" for w in item]
+    names += [f"item3:{g}" for g in trigrams(" ".join(item))]
+    names += [f"goal:{w}" for w in goal]
+    names += [f"context:{w}" for w in context]
+    names += [f"goal:{g}|item:{w}" for g in goal for w in item]
+    names += [f"urgency={urgency}|item:{w}" for w in item]
+
+    indices = [0, 1, 2, 3] + [_hash(n) for n in names]
+    values = [
+        1.0,
+        float(np.clip(np.log(max(ratio, 1e-3)), -5.0, 3.0)) / 3,
+        np.log1p(max(cost, 0.0)) / 10,
+        np.log1p(max(income, 0.0)) / 10,
+    ] + [1.0] * len(names)
+    return np.asarray(indices, dtype=np.int64), np.asarray(values, dtype=np.float32)
+
+
+def _dense(rows):
+    """
+    A dense batch matrix from a list of features() pairs.
+    """
+    matrix = np.zeros((len(rows), FEATURE_DIM), dtype=np.float32)
+    for i, (indices, values) in enumerate(rows):
+        np.add.at(matrix[i], indices, values)
+    return matrix
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+# ------------------------------------------------------------
+# Model
+# ------------------------------------------------------------
+class DistilledModel:
+    """
+    One softmax classifier per factor over the hashed purchase features,
+    trained with Adam on the logged answers. `temperature` (fitted by
+    calibrate) softens the probabilities so confidence tracks accuracy.
+    """
+
+    def __init__(self, factors=FACTORS, weights=None, bias=None, temperature=1.0, meta=None):
+        self.factors = list(factors)
+        width = len(self.factors) * len(CLASSES)
+        self.weights = weights if weights is not None else np.zeros((FEATURE_DIM, width), dtype=np.float32)
+        self.bias = bias if bias is not None else np.zeros(width, dtype=np.float32)
+        self.temperature = float(temperature)
+        self.meta = dict(meta or {})
+
+    # --------------------------------------------------------
+    # Training
+    # --------------------------------------------------------
+    def fit(self, inputs, labels, epochs=12, batch_size=256, learning_rate=0.02, l2=1e-5, seed=0):
+        """
+        Trains on a list of purchase_inputs dicts and an (n, factors) array
+        of their answers (-2..+2). Returns self.
+        """
+        rows = [features(x) for x in inputs]
+        targets = np.asarray(labels, dtype=np.int64) - CLASSES[0]
+        n, k = len(rows), len(CLASSES)
+        rng = np.random.default_rng(seed)
+        params = [self.weights, self.bias]
+        moments = [(np.zeros_like(p), np.zeros_like(p)) for p in params]
+        beta1, beta2, step = 0.9, 0.999, 0
+        for _ in range(epochs):
+            order = rng.permutation(n)
+            for start in range(0, n, batch_size):
+                batch = order[start:start + batch_size]
+                matrix = _dense([rows[i] for i in batch])
+                logits = (matrix @ self.weights + self.bias).reshape(len(batch), -1, k)
+                grad = _softmax(logits)
+                grad[np.arange(len(batch))[:, None], np.arange(len(self.factors)), targets[batch]] -= 1
+                grad = grad.reshape(len(batch), -1) / len(batch)
+                grads = [matrix.T @ grad + l2 * self.weights, grad.sum(axis=0)]
+                step += 1
+                for param, g, (m, v) in zip(params, grads, moments):
+                    m *= beta1
+                    m += (1 - beta1) * g
+                    v *= beta2
+                    v += (1 - beta2) * g * g
+                    m_hat = m / (1 - beta1 ** step)
+                    v_hat = v / (1 - beta2 ** step)
+                    param -= learning_rate * m_hat / (np.sqrt(v_hat) + 1e-8)
+        self.meta.update(trained_rows=n, trained_at=time.time())
+        return self
+
+    def calibrate(self, inputs, labels):
+        """
+        Picks the temperature that minimizes log loss on held-out rows.
+        """
+        logits = np.stack([self._logits(features(x)) for x in inputs])
+        targets = np.asarray(labels, dtype=np.int64) - CLASSES[0]
+        picked = np.take_along_axis(logits, targets[..., None], axis=-1)[..., 0]
+        losses = []
+        for t in TEMPERATURES:
+            scaled = logits / t
+            top = scaled.max(axis=-1)
+            log_norm = top + np.log(np.exp(scaled - top[..., None]).sum(axis=-1))
+            losses.append(float((log_norm - picked / t).mean()))
+        self.temperature = float(TEMPERATURES[int(np.argmin(losses))])
+        return self.temperature
+
+    # --------------------------------------------------------
+    # Prediction
+    # --------------------------------------------------------
+    def _logits(self, feature_pair):
+        indices, values = feature_pair
+        logits = values @ self.weights[indices] + self.bias
+        return logits.reshape(len(self.factors), len(CLASSES))
+
+    def predict_proba(self, inputs):
+        """
+        (factors, 5) probabilities of -2..+2 for each factor.
+        """
+        return _softmax(self._logits(features(inputs)) / self.temperature)
+
+    def predict(self, inputs):
+        """
+        ({factor: value}, {factor: confidence}) for a purchase_inputs dict.
+        """
+        proba = self.predict_proba(inputs)
+        best = proba.argmax(axis=1)
+        values = {f: int(CLASSES[i]) for f, i in zip(self.factors, best)}
+        confidence = {f: float(p[i]) for f, p, i in zip(self.factors, proba, best)}
+        return values, confidence
+
+    # --------------------------------------------------------
+    # Persistence
+    # --------------------------------------------------------
+    def save(self, path):
+        """
+        Writes the model to an .npz file (atomically, so a running app
+        never loads half a model).
+        """
+        path = str(path)
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp, weights=self.weights, bias=self.bias, temperature=self.temperature,
+            factors=np.array(self.factors), meta=np.array(json.dumps(self.meta))
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(str(path), allow_pickle=False) as data:
+            return cls(
+                factors=[str(f) for f in data["factors"]], weights=data["weights"],
+                bias=data["bias"], temperature=float(data["temperature"]),
+                meta=json.loads(str(data["meta"]))
+            )
+
+
+# ------------------------------------------------------------
+# Training data and evaluation
+# ------------------------------------------------------------
+def examples_from_frame(frame, factors=FACTORS):
+    """
+    (inputs list, labels array) from a DecisionHistory.training_rows frame.
+    """
+    frame = frame.dropna(subset=list(factors))
+    inputs = [
+        {
+            "item_name": row.item_name, "item_cost": row.item_cost,
+            "leftover_income": row.leftover_income,
+            "has_high_interest_debt": row.has_high_interest_debt,
+            "main_financial_goal": row.main_financial_goal,
+            "purchase_urgency": row.purchase_urgency,
+            "extra_context": row.extra_context,
+        }
+        for row in frame.itertuples(index=False)
+    ]
+    labels = frame[list(factors)].to_numpy(dtype=np.int64).clip(-2, 2)
+    return inputs, labels
+
+
+def evaluate(model, inputs, labels, min_confidence=0.0, factors=None):
+    """
+    How well `model` agrees with the labels on rows where its confidence
+    over `factors` (default: all it predicts) reaches `min_confidence`.
+    `coverage` is the share of rows it would answer; the agreement rates
+    are over those rows. PDS and recommendation use the label for any
+    factor not in `factors`, as the hybrid client does with D and O.
+    """
+    factors = list(factors or model.factors)
+    columns = [model.factors.index(f) for f in factors]
+    covered = exact = within_one = pds_exact = pds_within_one = recommendation = 0
+    per_factor = np.zeros(len(factors))
+    for x, label in zip(inputs, labels):
+        values, confidence = model.predict(x)
+        if min(confidence[f] for f in factors) < min_confidence:
+            continue
+        covered += 1
+        predicted = np.array([values[f] for f in factors])
+        truth = np.asarray(label)[columns]
+        hits = predicted == truth
+        per_factor += hits
+        exact += bool(hits.all())
+        within_one += bool((np.abs(predicted - truth) <= 1).all())
+        reference = dict(zip(model.factors, (int(v) for v in label)))
+        answer = {**reference, **{f: values[f] for f in factors}}
+        pds, true_pds = compute_pds(answer), compute_pds(reference)
+        pds_exact += pds == true_pds
+        pds_within_one += abs(pds - true_pds) <= 1
+        recommendation += get_recommendation(pds)[0] == get_recommendation(true_pds)[0]
+    share = (lambda count: count / covered if covered else 0.0)
+    return {
+        "rows": len(inputs),
+        "min_confidence": min_confidence,
+        "coverage": covered / len(inputs) if len(inputs) else 0.0,
+        "exact": share(exact),
+        "within_one": share(within_one),
+        "per_factor": {f: share(c) for f, c in zip(factors, per_factor)},
+        "pds_exact": share(pds_exact),
+        "pds_within_one": share(pds_within_one),
+        "recommendation": share(recommendation),
+    }
+
+
+def train_from_history(history, since=None, limit=200_000, holdout=0.2, min_confidence=0.8,
+                       factors=FACTORS, required=None, seed=0, **fit_options):
+    """
+    Distills a model from a DecisionHistory's model-scored decisions.
+    Half of the `holdout` rows calibrate the confidence, the other half
+    are scored with evaluate() over `required` (the factors that must be
+    confident); the result is kept in `model.meta["holdout"]`. Raises
+    ValueError when there is too little to learn from.
+    """
+    inputs, labels = examples_from_frame(history.training_rows(since=since, limit=limit), factors)
+    if len(inputs) < 4:
+        raise ValueError(f"need at least 4 model-scored decisions, found {len(inputs)}")
+    order = np.random.default_rng(seed).permutation(len(inputs))
+    cut = max(2, int(len(inputs) * holdout))
+    calibration, test, train = order[:cut // 2], order[cut // 2:cut], order[cut:]
+    model = DistilledModel(factors).fit([inputs[i] for i in train], labels[train], seed=seed, **fit_options)
+    model.calibrate([inputs[i] for i in calibration], labels[calibration])
+    model.meta["holdout"] = evaluate(model, [inputs[i] for i in test], labels[test], min_confidence, required)
+    return model
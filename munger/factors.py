@@ -0,0 +1,508 @@
+"""
+Factor scoring client: prompt building, the model call, parsing, caching
+and the hybrid local rules, independent of Streamlit and of any one
+model backend (see munger.backends).
+
+Transient upstream failures are retried under a RetryPolicy and counted
+by a CircuitBreaker; once those give up, answers degrade to a fallback
+(see FactorClient.fallback_factors) instead of raising, as do answers
+the model declined to give (BlockedResponseError). Other errors
+propagate as exceptions (EmptyResponseError, FactorParseError, ...);
+callers decide how to surface them.
+"""
+import hashlib
+import itertools
+import json
+import time
+
+from munger.backends import BlockedResponseError, EmptyResponseError
+from munger.cache import ResponseCache, make_cache_key
+from munger.packing import PackSizer, parse_packed_response, split_into_packs
+from munger.parsing import (
+    FactorParseError,
+    IncrementalFactorParser,
+    ParseStats,
+    extract_factors,
+    partial_factors,
+    validate_factors,
+)
+from munger.prompts import (
+    build_factor_prompt,
+    build_judgment_prompt,
+    build_packed_prompt,
+    build_structured_prompt,
+    judgment_inputs,
+    response_schema,
+    structured_output_budget,
+)
+from munger.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    QueueTimeoutError,
+    RetryPolicy,
+    StreamStalledError,
+    bounded_stream,
+    is_transient,
+)
+from munger.scoring import FACTORS, JUDGMENT_FACTORS, compute_local_factors
+from munger.singleflight import FlightAbandonedError, FlightTimeoutError, SingleFlight
+from munger.telemetry import METRICS, record_span, record_usage, span
+
+METRICS.describe("munger_instant_total", "Instant-mode requests, by whether the local model answered.")
+
+
+def purchase_inputs(leftover_income, has_high_interest_debt,
+                    main_financial_goal, purchase_urgency,
+                    item_name, item_cost, extra_context=None):
+    """
+    The inputs dict every FactorClient method takes, in the same argument
+    order as get_factors_from_gemini.
+    """
+    return {
+        "leftover_income": leftover_income,
+        "has_high_interest_debt": has_high_interest_debt,
+        "main_financial_goal": main_financial_goal,
+        "purchase_urgency": purchase_urgency,
+        "item_name": item_name,
+        "item_cost": item_cost,
+        "extra_context": extra_context,
+    }
+
+
+# Rendered to fingerprint the prompt template; any purchase would do
+_PROMPT_PROBE = purchase_inputs(1000.0, "No", "Save for emergencies", "Mixed", "Probe", 100.0)
+
+
+class FactorClient:
+    """
+    Scores purchases through `backend`, with an optional response cache.
+
+    `hybrid` scores D and O locally and asks the model for G, L and B only;
+    `structured` sends a response schema instead of an example object.
+    Concurrent cache misses for the same key share one model call
+    through `flights`; calls go through the `retry` policy and `breaker`.
+    `similar`, a SemanticCache, answers exact-cache misses from a
+    near-identical purchase already scored ("Laptop (new)" at $499 for
+    "new laptop" at $500). `distilled`, a DistilledModel, answers
+    instant_factors when at least `instant_confidence` sure.
+    """
+
+    def __init__(self, backend, cache=None, parse_stats=None, pack_sizer=None,
+                 hybrid=True, structured=True, explanation_words=12, rules=None,
+                 packed_max_output_tokens=8192, flights=None, retry=None, breaker=None,
+                 similar=None, distilled=None, instant_confidence=0.8):
+        self.backend = backend
+        self.cache = cache if cache is not None else ResponseCache(enabled=False)
+        self.similar = similar
+        self.distilled = distilled
+        self.instant_confidence = instant_confidence
+        self.parse_stats = parse_stats if parse_stats is not None else ParseStats()
+        self.flights = flights if flights is not None else SingleFlight()
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.pack_sizer = pack_sizer or PackSizer(max_output_tokens=packed_max_output_tokens)
+        self.hybrid = hybrid
+        self.structured = structured
+        self.explanation_words = explanation_words
+        self.rules = rules
+        self.packed_max_output_tokens = packed_max_output_tokens
+        self.prompt_version = self._prompt_version()
+
+    @property
+    def required(self):
+        return JUDGMENT_FACTORS if self.hybrid else FACTORS
+
+    # --------------------------------------------------------
+    # Helpers
+    # --------------------------------------------------------
+    def _prompt_version(self):
+        """
+        A short hash of the rendered prompt template and its generation
+        options, so answers to an older prompt shape (free text instead of
+        structured, other explanation lengths or factors, reworded
+        instructions) are never served from the cache.
+        """
+        prompt, options = self.request(_PROMPT_PROBE)
+        blob = json.dumps({"prompt": prompt, "options": options}, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:12]
+
+    def cache_key(self, inputs):
+        """
+        In hybrid mode only the judgment inputs reach the model, so only they
+        belong in the key: a new cost or debt answer reuses the cached G/L/B.
+        """
+        if self.hybrid:
+            return make_cache_key(self.backend.model_name, prompt=self.prompt_version,
+                                  scope="judgment", **judgment_inputs(inputs))
+        return make_cache_key(self.backend.model_name, prompt=self.prompt_version, **inputs)
+
+    def _similar_key(self, inputs):
+        if self.hybrid:
+            return (self.backend.model_name, self.prompt_version, "judgment"), judgment_inputs(inputs)
+        return (self.backend.model_name, self.prompt_version), inputs
+
+    def cached(self, inputs, cache_key):
+        """
+        The cached answer for `inputs`, else one for a near-identical
+        purchase (which is then cached under this key too), else None.
+        """
+        data = self.cache.get(cache_key)
+        if data is not None or self.similar is None:
+            return data
+        data = self.similar.get(*self._similar_key(inputs))
+        if data is not None:
+            self.cache.set(cache_key, data)
+        return data
+
+    def store(self, inputs, cache_key, data):
+        self.cache.set(cache_key, data)
+        if self.similar is not None:
+            self.similar.add(*self._similar_key(inputs), data)
+
+    def with_local_factors(self, inputs, data):
+        """
+        Overlays the locally computed D and O onto the model's answer.
+        """
+        if not self.hybrid:
+            return data
+        local = compute_local_factors(
+            inputs["leftover_income"],
+            inputs["item_cost"],
+            inputs["has_high_interest_debt"],
+            self.rules
+        )
+        return {**data, **local}
+
+    def zero_factors(self, inputs):
+        """
+        The answer shown when scoring failed: zeros, except for locally
+        scored factors, which don't depend on the model.
+        """
+        return self.with_local_factors(inputs, {f: 0 for f in FACTORS})
+
+    def fallback_factors(self, inputs, cache_key=None, error=None):
+        """
+        The answer served when the model can't be reached: the last cached
+        answer even if past its TTL, else the local rules for D and O with
+        G, L and B left neutral. The "fallback" key says which it was;
+        "blocked" when `error` says the model declined to answer and
+        "rate_limited" when the call ran out of time waiting for quota.
+        """
+        self.retry.record_fallback()
+        blocked = isinstance(error, BlockedResponseError)
+        if not blocked:
+            stale = self.cache.get_stale(cache_key or self.cache_key(inputs))
+            if stale is not None:
+                return {**self.with_local_factors(inputs, stale), "fallback": "cache"}
+        if blocked:
+            kind, reason = "blocked", "the AI declined to answer"
+        elif isinstance(error, QueueTimeoutError):
+            kind, reason = "rate_limited", "the request rate limit was reached"
+        else:
+            kind, reason = "rules", "the AI service is unavailable"
+        result = {}
+        for f in JUDGMENT_FACTORS:
+            result[f] = 0
+            result[f"{f}_explanation"] = f"Not scored: {reason}."
+        result.update(compute_local_factors(
+            inputs["leftover_income"],
+            inputs["item_cost"],
+            inputs["has_high_interest_debt"],
+            self.rules
+        ))
+        result["fallback"] = kind
+        return result
+
+    @staticmethod
+    def degradable(error):
+        """
+        Whether `error` means the upstream is unavailable or declined to
+        answer (so a fallback answer beats an error) rather than that its
+        answer was unusable.
+        """
+        return (
+            isinstance(error, (CircuitOpenError, QueueTimeoutError, BlockedResponseError))
+            or is_transient(error)
+        )
+
+    @staticmethod
+    def _retryable(error):
+        # A garbled or empty answer is worth one more try too
+        return is_transient(error) or isinstance(error, (FactorParseError, EmptyResponseError))
+
+    def request(self, inputs):
+        """
+        Returns the prompt for one purchase and its generation options.
+        """
+        if self.structured:
+            prompt = build_structured_prompt(inputs, self.hybrid, self.explanation_words)
+            return prompt, {
+                "temperature": 0.2,
+                "max_output_tokens": structured_output_budget(len(self.required), self.explanation_words),
+                "response_schema": response_schema(self.required, self.explanation_words),
+            }
+        if self.hybrid:
+            prompt = build_judgment_prompt(**inputs)
+        else:
+            prompt = build_factor_prompt(**inputs)
+        return prompt, {"temperature": 0.2, "max_output_tokens": 512}
+
+    def packed_request(self, items):
+        prompt = build_packed_prompt(
+            items,
+            judgment_only=self.hybrid,
+            structured=self.structured,
+            explanation_words=self.explanation_words
+        )
+        options = {"temperature": 0.2, "max_output_tokens": self.packed_max_output_tokens}
+        if self.structured:
+            options["response_schema"] = response_schema(
+                self.required, self.explanation_words, packed=True
+            )
+        return prompt, options
+
+    # --------------------------------------------------------
+    # Scoring
+    # --------------------------------------------------------
+    def get_factors(self, inputs, use_cache=True):
+        """
+        Returns factor assignments (D,O,G,L,B) from -2..+2 plus brief
+        explanations. Successful answers are cached; use_cache=False forces
+        a fresh call (and refreshes the cache). Identical requests already
+        in flight are joined rather than repeated. If the model stays
+        unreachable, returns fallback_factors.
+        """
+        cache_key = self.cache_key(inputs)
+        if use_cache:
+            cached = self.cached(inputs, cache_key)
+            if cached is not None:
+                return self.with_local_factors(inputs, cached)
+
+        try:
+            data = self.flights.do(cache_key, lambda: self._fetch(inputs, cache_key))
+        except Exception as e:
+            if not self.degradable(e):
+                raise
+            return self.fallback_factors(inputs, cache_key, e)
+        return self.with_local_factors(inputs, data)
+
+    def _fetch(self, inputs, cache_key):
+        with span("prompt_build"):
+            prompt, options = self.request(inputs)
+
+        def attempt(timeout):
+            with span("model_generate"):
+                completion = self.backend.generate(prompt, dict(options, timeout=timeout))
+            record_usage(completion.input_tokens or len(prompt) // 4,
+                         completion.output_tokens or len(completion.text) // 4)
+            try:
+                with span("json_extract"):
+                    return extract_factors(completion.text, self.required)
+            except FactorParseError as e:
+                self.parse_stats.record_failure(e)
+                raise
+
+        data = self.retry.run(attempt, self.breaker, self._retryable)
+        self.parse_stats.record_success()
+        self.store(inputs, cache_key, data)
+        return data
+
+    def stream_factors(self, inputs):
+        """
+        Streaming flavour of get_factors. Yields the factor dict again each
+        time the model completes another key (locally scored D and O come
+        first, before any model call); the last value yielded is the final
+        answer. If the same request is already in flight, waits for it
+        instead of streaming a second copy.
+        """
+        cache_key = self.cache_key(inputs)
+        cached = self.cached(inputs, cache_key)
+        if cached is not None:
+            yield self.with_local_factors(inputs, cached)
+            return
+
+        local = self.with_local_factors(inputs, {})
+        if local:
+            yield local
+
+        flight, leader = self.flights.begin(cache_key)
+        if not leader:
+            try:
+                # The leader only times out between chunks: don't wait on it for longer
+                yield self.with_local_factors(inputs, flight.wait(self.retry.deadline))
+            except FlightAbandonedError:
+                yield self.get_factors(inputs)
+            except FlightTimeoutError:
+                try:
+                    data = self._fetch(inputs, cache_key)
+                except Exception as e:
+                    if not self.degradable(e):
+                        raise
+                    yield self.fallback_factors(inputs, cache_key, e)
+                    return
+                yield self.with_local_factors(inputs, data)
+            except Exception as e:
+                if not self.degradable(e):
+                    raise
+                yield self.fallback_factors(inputs, cache_key, e)
+            return
+        try:
+            data = yield from self._stream_model(inputs, cache_key)
+        except Exception as e:
+            self.flights.finish(cache_key, flight, error=e)
+            if not self.degradable(e):
+                raise
+            yield self.fallback_factors(inputs, cache_key, e)
+            return
+        except BaseException:
+            # The consumer went away (GeneratorExit) mid-stream
+            self.flights.finish(cache_key, flight, error=FlightAbandonedError("stream was abandoned"))
+            raise
+        self.flights.finish(cache_key, flight, result=data)
+        yield self.with_local_factors(inputs, data)
+
+    def _stream_model(self, inputs, cache_key):
+        """
+        Streams one answer, yielding partial factor dicts, and returns the
+        validated result. Opening the stream is retried like any call; if
+        it breaks off midway or can't be parsed, a plain get-style call
+        finishes the job. A stream that goes quiet for longer than the
+        retry deadline raises StreamStalledError.
+        """
+        with span("prompt_build"):
+            prompt, options = self.request(inputs)
+
+        def open_stream(timeout):
+            with span("model_first_chunk"):
+                stream = iter(self.backend.stream(prompt, dict(options, timeout=timeout)))
+                return stream, next(stream, "")
+
+        stream, first = self.retry.run(open_stream, self.breaker)
+        stream = bounded_stream(stream, self.retry.deadline)
+        parser = IncrementalFactorParser()
+        chunks = []
+        # Time waiting on the model and time parsing, excluding the time
+        # the consumer spends on each partial result
+        waited = parsing = 0.0
+        try:
+            chunk_started = time.perf_counter()
+            for chunk in itertools.chain([first], stream):
+                received = time.perf_counter()
+                waited += received - chunk_started
+                chunks.append(chunk)
+                complete = parser.feed(chunk)
+                parsing += time.perf_counter() - received
+                if complete:
+                    yield self.with_local_factors(inputs, partial_factors(parser.values, self.required))
+                chunk_started = time.perf_counter()
+        except StreamStalledError:
+            self.breaker.record_failure()
+            raise
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            self.breaker.record_failure()
+            return self._fetch(inputs, cache_key)
+        finally:
+            stream.close()
+            record_span("model_stream", waited)
+            record_span("json_extract", parsing)
+            # Streams carry no usage metadata through the backend interface
+            record_usage(len(prompt) // 4, len("".join(chunks)) // 4)
+
+        try:
+            data = validate_factors(parser.values, self.required)
+        except FactorParseError:
+            try:
+                with span("json_extract"):
+                    data = extract_factors("".join(chunks), self.required)
+            except FactorParseError as e:
+                self.parse_stats.record_failure(e)
+                return self._fetch(inputs, cache_key)
+        self.parse_stats.record_success()
+        self.store(inputs, cache_key, data)
+        return data
+
+    def instant_factors(self, inputs):
+        """
+        The distilled model's answer, with an "instant" key holding its
+        confidence, when it is at least `instant_confidence` sure of every
+        factor the model would be asked for; else None (ask the model).
+        """
+        if self.distilled is None:
+            return None
+        with span("instant_predict"):
+            values, confidence = self.distilled.predict(inputs)
+        sure = min(confidence.get(f, 0.0) for f in self.required)
+        if sure < self.instant_confidence:
+            METRICS.inc("munger_instant_total", result="deferred")
+            return None
+        METRICS.inc("munger_instant_total", result="answered")
+        data = {"instant": sure}
+        for f in self.required:
+            data[f] = values[f]
+            data[f"{f}_explanation"] = (
+                f"Instant estimate from past answers ({confidence[f]:.0%} confident)."
+            )
+        return self.with_local_factors(inputs, data)
+
+    def get_factors_packed(self, items, fallback=None):
+        """
+        Scores several purchases (a list of inputs dicts) with as few model
+        requests as possible: cached items are served from the cache, the
+        rest share packed prompts sized to fit the output budget, and any
+        item the packed answer lost falls back to `fallback(**inputs)`
+        (get_factors by default). A pack whose call failed for good (open
+        breaker, quota, a non-transient error) gets fallback_factors
+        instead, rather than one more call per item. Answers served from
+        the cache carry a "cached" key.
+        """
+        fallback = fallback or (lambda **inputs: self.get_factors(inputs))
+        results = [None] * len(items)
+        keys = [self.cache_key(inputs) for inputs in items]
+
+        todo = []
+        for i, key in enumerate(keys):
+            cached = self.cached(items[i], key)
+            if cached is not None:
+                results[i] = {**self.with_local_factors(items[i], cached), "cached": True}
+            else:
+                todo.append(i)
+
+        for pack in split_into_packs(todo, self.pack_sizer.pack_size()):
+            with span("prompt_build"):
+                prompt, options = self.packed_request([items[i] for i in pack])
+
+            def generate(timeout):
+                with span("model_generate"):
+                    return self.backend.generate(prompt, dict(options, timeout=timeout))
+
+            try:
+                completion = self.retry.run(generate, self.breaker)
+            except Exception as e:
+                # Says nothing about how big a pack the model can handle,
+                # so the sizer doesn't see it
+                METRICS.inc("munger_pack_errors_total", error=type(e).__name__)
+                if not is_transient(e):
+                    for i in pack:
+                        results[i] = self.fallback_factors(items[i], keys[i], e)
+                continue
+            text = completion.text
+            output_tokens = completion.output_tokens or len(text) // 4
+            record_usage(completion.input_tokens or len(prompt) // 4, output_tokens)
+
+            with span("json_extract"):
+                parsed = parse_packed_response(text, len(pack), self.required)
+            self.pack_sizer.observe(len(pack), sum(p is not None for p in parsed), output_tokens)
+            for i, data in zip(pack, parsed):
+                if data is None:
+                    self.parse_stats.record_failure("PackedItemLost")
+                    continue
+                self.parse_stats.record_success()
+                self.store(items[i], keys[i], data)
+                results[i] = self.with_local_factors(items[i], data)
+
+        for i, data in enumerate(results):
+            if data is None:
+                results[i] = fallback(**items[i])
+        return results
@@ -0,0 +1,345 @@
+"""
+Decision history: every scored purchase, kept in SQLite.
+
+Rows are indexed by time, item and recommendation, so recent-decision and
+per-item lookups stay fast however long the history grows. Dashboards
+don't scan the rows at all: each insert also bumps a daily rollup keyed by
+(day, PDS, latency bucket), a few hundred rows a day at most, from which
+volumes, buy rates, the PDS distribution and latency percentiles are all
+derived. `export_parquet` streams the raw rows out in chunks.
+"""
+import bisect
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from munger.routing import LATENCY_BUCKETS
+from munger.scoring import FACTORS, compute_pds, get_recommendation
+
+BUY_PDS = 5
+
+COLUMNS = [
+    "created_at", "day", "page", "item_name", "item_key", "item_cost",
+    "leftover_income", "has_high_interest_debt", "main_financial_goal",
+    "purchase_urgency", "extra_context", *FACTORS, "pds", "recommendation",
+    "fallback", "model", "latency_ms", "input_tokens", "output_tokens",
+]
+
+_COL = {name: i for i, name in enumerate(COLUMNS)}
+_TEXT_COLUMNS = {
+    "day", "page", "item_name", "item_key", "has_high_interest_debt", "main_financial_goal",
+    "purchase_urgency", "extra_context", "recommendation", "fallback", "model",
+}
+_REAL_COLUMNS = {"created_at", "item_cost", "leftover_income", "latency_ms"}
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS decisions (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    page TEXT,
+    item_name TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    item_cost REAL,
+    leftover_income REAL,
+    has_high_interest_debt TEXT,
+    main_financial_goal TEXT,
+    purchase_urgency TEXT,
+    extra_context TEXT,
+    {", ".join(f"{f} INTEGER" for f in FACTORS)},
+    pds INTEGER NOT NULL,
+    recommendation TEXT NOT NULL,
+    fallback TEXT,
+    model TEXT,
+    latency_ms REAL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS decisions_created_at ON decisions (created_at);
+CREATE INDEX IF NOT EXISTS decisions_item ON decisions (item_key, created_at);
+CREATE INDEX IF NOT EXISTS decisions_recommendation ON decisions (recommendation, created_at);
+CREATE TABLE IF NOT EXISTS daily_rollup (
+    day TEXT NOT NULL,
+    pds INTEGER NOT NULL,
+    latency_bucket INTEGER NOT NULL,
+    decisions INTEGER NOT NULL,
+    fallbacks INTEGER NOT NULL,
+    latency_ms_sum REAL NOT NULL,
+    input_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cost_sum REAL NOT NULL,
+    PRIMARY KEY (day, pds, latency_bucket)
+);
+"""
+
+_BUMP_ROLLUP = """
+INSERT INTO daily_rollup VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT (day, pds, latency_bucket) DO UPDATE SET
+    decisions = decisions + 1,
+    fallbacks = fallbacks + excluded.fallbacks,
+    latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum,
+    input_tokens = input_tokens + excluded.input_tokens,
+    output_tokens = output_tokens + excluded.output_tokens,
+    cost_sum = cost_sum + excluded.cost_sum
+"""
+
+
+def _day(timestamp):
+    return time.strftime("%Y-%m-%d", time.gmtime(timestamp))
+
+
+def item_key(item_name):
+    return " ".join(str(item_name).split()).lower()
+
+
+def latency_bucket(latency_ms):
+    """
+    Index into LATENCY_BUCKETS (len(LATENCY_BUCKETS) for slower), or -1
+    when the latency is unknown.
+    """
+    if latency_ms is None:
+        return -1
+    return bisect.bisect_left(LATENCY_BUCKETS, latency_ms / 1000)
+
+
+class DecisionHistory:
+    """
+    Append-only store of scored decisions plus their daily rollup. Safe to
+    share across threads.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    # --------------------------------------------------------
+    # Writing
+    # --------------------------------------------------------
+    @staticmethod
+    def row(inputs, factors, page=None, model=None, latency_seconds=None,
+            input_tokens=0, output_tokens=0, created_at=None):
+        """
+        A decisions row (COLUMNS order) for a purchase_inputs dict and its
+        final factor dict.
+        """
+        created_at = time.time() if created_at is None else created_at
+        values = {f: int(factors.get(f, 0)) for f in FACTORS}
+        pds = compute_pds(values)
+        return (
+            created_at, _day(created_at), page,
+            inputs["item_name"], item_key(inputs["item_name"]), inputs["item_cost"],
+            inputs["leftover_income"], inputs["has_high_interest_debt"],
+            inputs["main_financial_goal"], inputs["purchase_urgency"], inputs.get("extra_context"),
+            *values.values(), pds, get_recommendation(pds)[0],
+            factors.get("fallback"), model,
+            None if latency_seconds is None else latency_seconds * 1000,
+            input_tokens, output_tokens,
+        )
+
+    def record(self, inputs, factors, **details):
+        """
+        Appends one decision; `details` are row()'s keyword arguments.
+        """
+        self.record_rows([self.row(inputs, factors, **details)])
+
+    def record_rows(self, rows):
+        """
+        Appends many row() tuples in one transaction.
+        """
+        rollup = [
+            (
+                r[_COL["day"]], r[_COL["pds"]], latency_bucket(r[_COL["latency_ms"]]),
+                int(bool(r[_COL["fallback"]])), r[_COL["latency_ms"]] or 0.0,
+                r[_COL["input_tokens"]], r[_COL["output_tokens"]], r[_COL["item_cost"]] or 0.0,
+            )
+            for r in rows
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT INTO decisions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+            self._db.executemany(_BUMP_ROLLUP, rollup)
+
+    def rebuild_rollups(self):
+        """
+        Recomputes the rollup from the raw rows (after deleting or
+        importing rows behind the store's back).
+        """
+        bucket = "CASE " + " ".join(
+            f"WHEN latency_ms <= {bound * 1000!r} THEN {i}" for i, bound in enumerate(LATENCY_BUCKETS)
+        ) + f" ELSE {len(LATENCY_BUCKETS)} END"
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM daily_rollup")
+            self._db.execute(
+                "INSERT INTO daily_rollup SELECT day, pds,"
+                f" CASE WHEN latency_ms IS NULL THEN -1 ELSE {bucket} END AS bucket,"
+                " COUNT(*), SUM(fallback IS NOT NULL AND fallback != ''), TOTAL(latency_ms),"
+                " SUM(input_tokens), SUM(output_tokens), TOTAL(item_cost)"
+                " FROM decisions GROUP BY day, pds, bucket"
+            )
+
+    # --------------------------------------------------------
+    # Reading
+    # --------------------------------------------------------
+    def _query(self, sql, params=()):
+        with self._lock:
+            return pd.read_sql_query(sql, self._db, params=params)
+
+    @staticmethod
+    def since_day(days):
+        """
+        The first day (UTC) of a window of the last `days` days; None for
+        all of history.
+        """
+        return None if days is None else _day(time.time() - (days - 1) * 86400)
+
+    def _where(self, since):
+        return ("WHERE day >= ?", (since,)) if since else ("", ())
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(decisions), 0) FROM daily_rollup").fetchone()[0]
+
+    def daily(self, since=None):
+        """
+        Per day: decisions, buys, don't-buys, fallbacks, buy rate, mean
+        latency (ms) and tokens.
+        """
+        where, params = self._where(since)
+        df = self._query(
+            "SELECT day, SUM(decisions) AS decisions,"
+            f" SUM(CASE WHEN pds >= {BUY_PDS} THEN decisions ELSE 0 END) AS buys,"
+            " SUM(CASE WHEN pds < 0 THEN decisions ELSE 0 END) AS dont_buys,"
+            " SUM(fallbacks) AS fallbacks,"
+            " SUM(latency_ms_sum) / NULLIF(SUM(CASE WHEN latency_bucket >= 0 THEN decisions END), 0) AS mean_latency_ms,"
+            " SUM(input_tokens) AS input_tokens, SUM(output_tokens) AS output_tokens"
+            f" FROM daily_rollup {where} GROUP BY day ORDER BY day",
+            params
+        )
+        df["buy_rate"] = df["buys"] / df["decisions"]
+        return df
+
+    def pds_distribution(self, since=None):
+        """
+        Decisions per PDS value.
+        """
+        where, params = self._where(since)
+        return self._query(
+            f"SELECT pds, SUM(decisions) AS decisions FROM daily_rollup {where} GROUP BY pds ORDER BY pds",
+            params
+        )
+
+    def latency_percentiles(self, since=None, quantiles=(0.5, 0.95, 0.99)):
+        """
+        Latency quantiles in ms, interpolated within histogram buckets as
+        Prometheus' histogram_quantile does. None when nothing was timed.
+        """
+        where, params = self._where(since)
+        where = f"{where} AND latency_bucket >= 0" if where else "WHERE latency_bucket >= 0"
+        counts = dict(self._query(
+            f"SELECT latency_bucket, SUM(decisions) AS n FROM daily_rollup {where} GROUP BY latency_bucket",
+            params
+        ).itertuples(index=False))
+        total = sum(counts.values())
+        result = {}
+        for q in quantiles:
+            if not total:
+                result[q] = None
+                continue
+            target, seen = q * total, 0
+            for i in range(len(LATENCY_BUCKETS) + 1):
+                n = counts.get(i, 0)
+                if n and seen + n >= target:
+                    if i == len(LATENCY_BUCKETS):
+                        result[q] = LATENCY_BUCKETS[-1] * 1000
+                    else:
+                        lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+                        result[q] = (lower + (LATENCY_BUCKETS[i] - lower) * (target - seen) / n) * 1000
+                    break
+                seen += n
+        return result
+
+    def recent(self, limit=200, item=None, recommendation=None):
+        """
+        The latest decisions, newest first, optionally for one item (name
+        matched ignoring case and spacing) or one recommendation.
+        """
+        clauses, params = [], []
+        if item:
+            clauses.append("item_key = ?")
+            params.append(item_key(item))
+        if recommendation:
+            clauses.append("recommendation = ?")
+            params.append(recommendation)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        df = self._query(
+            f"SELECT {', '.join(c for c in COLUMNS if c not in ('day', 'item_key'))} FROM decisions"
+            f" {where} ORDER BY created_at DESC LIMIT ?",
+            (*params, int(limit))
+        )
+        df["created_at"] = pd.to_datetime(df["created_at"], unit="s")
+        return df
+
+    def training_rows(self, since=None, limit=None, exclude_model_prefixes=("local:", "cache:")):
+        """
+        Inputs and factors of model-scored decisions, newest first, one row
+        per distinct purchase, for distilling a local model. Fallback
+        answers, answers from local models and answers served from a cache
+        (model names starting with one of `exclude_model_prefixes`) are
+        left out, so nothing learns from its own guesses and repeats don't
+        land on both sides of a train/test split.
+        """
+        clauses = ["(fallback IS NULL OR fallback = '')"]
+        params = []
+        for prefix in exclude_model_prefixes:
+            clauses.append("(model IS NULL OR model NOT LIKE ?)")
+            params.append(f"{prefix}%")
+        if since:
+            clauses.append("day >= ?")
+            params.append(since)
+        inputs = [
+            "item_name", "item_cost", "leftover_income", "has_high_interest_debt",
+            "main_financial_goal", "purchase_urgency", "extra_context",
+        ]
+        sql = (
+            f"SELECT {', '.join(inputs + FACTORS + ['model'])} FROM decisions"
+            f" WHERE {' AND '.join(clauses)} ORDER BY created_at DESC"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return self._query(sql, tuple(params)).drop_duplicates(subset=inputs, ignore_index=True)
+
+    def export_parquet(self, path, since=None, chunk_rows=100_000):
+        """
+        Writes the raw decisions (from day `since`, if given) to a Parquet
+        file (a path or a binary file object) in chunks, without holding
+        the whole history in memory. Returns the number of rows written.
+        """
+        # pyarrow comes with Streamlit; only exports need it
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([("id", pa.int64())] + [
+            (c, pa.string() if c in _TEXT_COLUMNS else pa.float64() if c in _REAL_COLUMNS else pa.int64())
+            for c in COLUMNS
+        ])
+        where, params = self._where(since)
+        with self._lock:
+            chunks = pd.read_sql_query(
+                f"SELECT * FROM decisions {where} ORDER BY id", self._db,
+                params=params, chunksize=chunk_rows
+            )
+            written = 0
+            with pq.ParquetWriter(path, schema) as writer:
+                for chunk in chunks:
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                    written += len(chunk)
+        return written
@@ -0,0 +1,129 @@
+"""
+Helpers for packing several purchases into one model request.
+
+`PackSizer` decides how many items fit in one response without running
+into `max_output_tokens`, learning the real per-item output size as
+responses come back. `parse_packed_response` pulls the per-item factor
+objects back out, leaving None for anything that didn't survive.
+"""
+import json
+import threading
+
+from munger.parsing import FactorParseError, validate_factors
+from munger.scoring import FACTORS
+
+
+class PackSizer:
+    """
+    Adaptive pack size: `max_output_tokens * headroom / tokens_per_item`,
+    where `tokens_per_item` is a moving average of observed output.
+    """
+
+    def __init__(self, max_output_tokens=8192, tokens_per_item=160,
+                 headroom=0.8, max_pack_size=40, smoothing=0.3):
+        self.max_output_tokens = max_output_tokens
+        self.tokens_per_item = float(tokens_per_item)
+        self.headroom = headroom
+        self.max_pack_size = max_pack_size
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def pack_size(self):
+        with self._lock:
+            budget = self.max_output_tokens * self.headroom
+            return max(1, min(self.max_pack_size, int(budget // self.tokens_per_item)))
+
+    def observe(self, items_requested, items_parsed, output_tokens):
+        """
+        Feeds back one packed response. A response that used most of the
+        output budget yet lost items was truncated, so the estimate grows
+        sharply instead of being averaged in.
+        """
+        with self._lock:
+            truncated = (
+                items_parsed < items_requested
+                and output_tokens >= self.max_output_tokens * self.headroom
+            )
+            if truncated:
+                self.tokens_per_item *= 1.5
+            elif items_parsed:
+                sample = output_tokens / items_parsed
+                self.tokens_per_item += self.smoothing * (sample - self.tokens_per_item)
+
+
+def split_into_packs(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _json_values(text):
+    """
+    Yields every top-level JSON value found in `text`, skipping prose and
+    code fences between them.
+    """
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        starts = [i for i in (text.find("[", pos), text.find("{", pos)) if i >= 0]
+        if not starts:
+            return
+        start = min(starts)
+        try:
+            value, pos = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            pos = start + 1
+            continue
+        yield value
+
+
+def _salvage_objects(text):
+    """
+    Recovers complete objects from a truncated or malformed array by
+    decoding from every "{" that starts a valid object.
+    """
+    decoder = json.JSONDecoder()
+    pos = text.find("{")
+    while pos >= 0:
+        try:
+            value, end = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            pos = text.find("{", pos + 1)
+            continue
+        if isinstance(value, dict):
+            yield value
+        pos = text.find("{", end)
+
+
+def parse_packed_response(text, count, required=FACTORS):
+    """
+    Returns a list of `count` factor dicts (or None where an item couldn't
+    be parsed) from a packed response. Objects are matched by their "id"
+    field, falling back to position when ids are missing, and must carry
+    every factor in `required`.
+    """
+    objects = []
+    for value in _json_values(text or ""):
+        if not isinstance(value, list):
+            continue
+        # Prose may hold stray lists ("[1]", "[]"): keep the one most like
+        # the pack, stopping at one with an object per item
+        dicts = [v for v in value if isinstance(v, dict)]
+        if len(dicts) > len(objects):
+            objects = dicts
+        if len(dicts) == count:
+            break
+    if not objects:
+        objects = list(_salvage_objects(text or ""))
+
+    results = [None] * count
+    for position, obj in enumerate(objects):
+        try:
+            factors = validate_factors(obj, required)
+        except FactorParseError:
+            continue
+        try:
+            idx = int(obj.get("id", position))
+        except (TypeError, ValueError):
+            idx = position
+        if 0 <= idx < count and results[idx] is None:
+            results[idx] = factors
+    return results
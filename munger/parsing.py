@@ -0,0 +1,319 @@
+"""
+Parsing of model output into factor dicts.
+"""
+import json
+import math
+import re
+import threading
+from collections import Counter
+from typing import TypedDict
+
+from munger.scoring import FACTORS
+
+_WHITESPACE = " \t\r\n"
+_STRUCTURAL = re.compile(r'[{}"\\]')
+
+
+class IncrementalFactorParser:
+    """
+    Parses a streamed JSON object key by key.
+
+    Feed it text chunks as they arrive; each call returns the top-level
+    key/value pairs completed by that chunk. Anything before the first
+    "{" (prose, code fences) is ignored. A number is only accepted once a
+    delimiter follows it, so "1" is never mistaken for a truncated "12".
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = None
+        self.values = {}
+        self.done = False
+
+    def feed(self, chunk):
+        self._buffer += chunk or ""
+        if self.done:
+            return {}
+        if self._pos is None:
+            start = self._buffer.find("{")
+            if start < 0:
+                return {}
+            self._pos = start + 1
+
+        new = {}
+        buf = self._buffer
+        while True:
+            pos = self._skip(buf, self._pos, _WHITESPACE + ",")
+            if pos >= len(buf):
+                break
+            if buf[pos] == "}":
+                self.done = True
+                break
+            if buf[pos] != '"':
+                # Not a key; step over stray characters
+                self._pos = pos + 1
+                continue
+            try:
+                key, pos = self._decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break
+            pos = self._skip(buf, pos, _WHITESPACE)
+            if pos >= len(buf):
+                break
+            if buf[pos] != ":":
+                self._pos = pos
+                continue
+            pos = self._skip(buf, pos + 1, _WHITESPACE)
+            if pos >= len(buf):
+                break
+            try:
+                value, end = self._decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break
+            if isinstance(value, (int, float)) and end >= len(buf):
+                break
+            self._pos = end
+            self.values[key] = value
+            new[key] = value
+        return new
+
+    @staticmethod
+    def _skip(buf, pos, chars):
+        while pos < len(buf) and buf[pos] in chars:
+            pos += 1
+        return pos
+
+
+# ------------------------------------------------------------
+# One-shot extraction
+# ------------------------------------------------------------
+class FactorParseError(ValueError):
+    """
+    Base class for model output that can't be turned into factors.
+    """
+
+
+class NoJSONObjectError(FactorParseError):
+    """
+    The output contains no complete JSON object at all.
+    """
+
+
+class MissingFactorsError(FactorParseError):
+    """
+    JSON objects were found, but none carries every required factor.
+    """
+
+    def __init__(self, missing):
+        self.missing = list(missing)
+        super().__init__(f"missing factor(s): {', '.join(self.missing)}")
+
+
+class InvalidFactorValueError(FactorParseError):
+    """
+    A factor is present but isn't a number.
+    """
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        super().__init__(f"factor {key} is not an integer: {value!r}")
+
+
+class FactorDict(TypedDict, total=False):
+    D: int
+    O: int
+    G: int
+    L: int
+    B: int
+    D_explanation: str
+    O_explanation: str
+    G_explanation: str
+    L_explanation: str
+    B_explanation: str
+
+
+FACTOR_MIN = -2
+FACTOR_MAX = 2
+
+
+def coerce_factor_value(key, value):
+    """
+    Returns `value` as an int clamped to -2..2. Accepts ints, floats and
+    numeric strings such as "+1"; anything else (including booleans, NaN
+    and infinities) is an InvalidFactorValueError.
+    """
+    if isinstance(value, bool):
+        raise InvalidFactorValueError(key, value)
+    if isinstance(value, str):
+        try:
+            value = float(value.strip())
+        except ValueError:
+            raise InvalidFactorValueError(key, value) from None
+    if not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise InvalidFactorValueError(key, value)
+    return max(FACTOR_MIN, min(FACTOR_MAX, int(round(value))))
+
+
+def validate_factors(data, required=FACTORS) -> FactorDict:
+    """
+    Returns a clean copy of `data` holding the `required` factors as
+    clamped ints plus any string explanations for them.
+    """
+    missing = [k for k in required if k not in data]
+    if missing:
+        raise MissingFactorsError(missing)
+    result = {k: coerce_factor_value(k, data[k]) for k in required}
+    for k in required:
+        explanation = data.get(f"{k}_explanation")
+        if explanation is not None:
+            result[f"{k}_explanation"] = str(explanation)
+    return result
+
+
+def partial_factors(data, keys=FACTORS):
+    """
+    Best-effort version of validate_factors for a half-streamed answer:
+    keeps whichever factors are present and valid, silently drops the rest.
+    """
+    result = {}
+    for k in keys:
+        if k in data:
+            try:
+                result[k] = coerce_factor_value(k, data[k])
+            except InvalidFactorValueError:
+                continue
+        explanation = data.get(f"{k}_explanation")
+        if isinstance(explanation, str):
+            result[f"{k}_explanation"] = explanation
+    return result
+
+
+def _balanced_objects(text):
+    """
+    Yields (start, end) spans of brace-balanced objects in one pass,
+    tracking strings so braces inside them don't count.
+
+    Top-level objects are yielded as they close. If a stray "{" is never
+    closed, the outermost objects that did close inside it are yielded at
+    the end; the spans never overlap, so total decoding work stays linear.
+    """
+    stack = []
+    closed_inside = []
+    in_string = False
+    escaped_at = -1
+    # Only braces, quotes and backslashes matter; jump straight to them
+    for match in _STRUCTURAL.finditer(text):
+        i = match.start()
+        ch = text[i]
+        if in_string:
+            if i == escaped_at:
+                continue
+            if ch == "\\":
+                escaped_at = i + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == "{":
+            stack.append(i)
+        elif not stack:
+            continue
+        elif ch == '"':
+            in_string = True
+        elif ch == "}":
+            start = stack.pop()
+            if stack:
+                closed_inside.append((start, i + 1))
+            else:
+                yield start, i + 1
+                closed_inside.clear()
+
+    covered_until = -1
+    for start, end in sorted(closed_inside):
+        if start >= covered_until:
+            covered_until = end
+            yield start, end
+
+
+def _dicts_with(value, depth=0):
+    """
+    The decoded object itself, then dicts nested in it (to a small depth),
+    so answers wrapped like {"factors": {...}} are still found.
+    """
+    if isinstance(value, dict):
+        yield value
+        if depth < 2:
+            for child in value.values():
+                yield from _dicts_with(child, depth + 1)
+    elif isinstance(value, list) and depth < 2:
+        for child in value:
+            yield from _dicts_with(child, depth + 1)
+
+
+def extract_factors(text, required=FACTORS) -> FactorDict:
+    """
+    Returns the first JSON object in `text` that carries every `required`
+    factor with a usable value, validated by validate_factors.
+
+    Raises NoJSONObjectError, MissingFactorsError or
+    InvalidFactorValueError (all FactorParseError) describing the closest
+    miss when nothing qualifies.
+    """
+    found_object = False
+    best_missing = None
+    invalid = None
+    for start, end in _balanced_objects(text or ""):
+        try:
+            value = json.loads(text[start:end])
+        except json.JSONDecodeError:
+            continue
+        for candidate in _dicts_with(value):
+            found_object = True
+            try:
+                return validate_factors(candidate, required)
+            except MissingFactorsError as e:
+                if best_missing is None or len(e.missing) < len(best_missing.missing):
+                    best_missing = e
+            except InvalidFactorValueError as e:
+                invalid = invalid or e
+
+    if invalid is not None:
+        raise invalid
+    if best_missing is not None:
+        raise best_missing
+    if not found_object:
+        raise NoJSONObjectError("no complete JSON object in model output")
+    raise MissingFactorsError(required)
+
+
+class ParseStats:
+    """
+    Thread-safe success/failure counters for factor parsing, broken down
+    by FactorParseError subclass, so parse failures are measurable.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def record_success(self):
+        with self._lock:
+            self._counts["parsed"] += 1
+
+    def record_failure(self, reason):
+        """
+        `reason` is the FactorParseError raised, or a short label for
+        failures that don't raise one.
+        """
+        name = reason if isinstance(reason, str) else type(reason).__name__
+        with self._lock:
+            self._counts["failed"] += 1
+            self._counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self._counts)
+        attempts = stats.get("parsed", 0) + stats.get("failed", 0)
+        stats["attempts"] = attempts
+        stats["failure_rate"] = stats.get("failed", 0) / attempts if attempts else 0.0
+        return stats
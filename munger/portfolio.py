@@ -0,0 +1,109 @@
+"""
+Choosing which wishlist items to buy within a budget.
+
+Every item has a cost and a small integer value (its PDS, or another
+objective), so the exact 0/1 knapsack is solved by dynamic programming
+over value instead of cost: the table is items x total value, a few
+thousand cells per item however large or fractional the prices, and each
+item's row is a single NumPy step. Hundreds of items solve in milliseconds.
+
+The budget is the leftover income each item is judged against. Only D
+depends on it, so re-planning for a new budget recomputes D with the local
+rules and reuses the model's G, L and B: no model calls.
+"""
+import time
+
+import numpy as np
+
+from munger.scoring import JUDGMENT_FACTORS, compute_opportunity
+from munger.sensitivity import BUY_THRESHOLD, discretionary_grid
+
+OBJECTIVES = {
+    "pds": "Total decision score",
+    "buys": "Number of recommended buys",
+    "goal": "Total goal alignment",
+}
+
+
+def solve_knapsack(costs, values, budget):
+    """
+    Indices (ascending) of the subset with the greatest total value whose
+    total cost fits in `budget`; among equally valuable subsets, the
+    cheapest. Values must be integers; items worth 0 or less, or costing
+    more than the budget, are never chosen.
+    """
+    costs = np.asarray(costs, dtype=float)
+    values = np.asarray(values, dtype=np.int64)
+    candidates = np.flatnonzero((values > 0) & (costs <= budget))
+    total = int(values[candidates].sum())
+    if total == 0:
+        return []
+
+    # min_cost[v]: cheapest subset of the items so far worth exactly v
+    min_cost = np.full(total + 1, np.inf)
+    min_cost[0] = 0.0
+    took = np.zeros((len(candidates), total + 1), dtype=bool)
+    reach = 0
+    for row, i in enumerate(candidates):
+        value, cost = int(values[i]), costs[i]
+        reach += value
+        with_item = min_cost[:reach + 1 - value] + cost
+        better = with_item < min_cost[value:reach + 1]
+        took[row, value:reach + 1] = better
+        min_cost[value:reach + 1] = np.where(better, with_item, min_cost[value:reach + 1])
+
+    best = int(np.flatnonzero(min_cost <= budget + 1e-9).max())
+    chosen = []
+    for row in range(len(candidates) - 1, -1, -1):
+        if took[row, best]:
+            chosen.append(int(candidates[row]))
+            best -= int(values[candidates[row]])
+    return sorted(chosen)
+
+
+def item_scores(scored, budget, rules=None):
+    """
+    Each item's PDS with `budget` as the leftover income: D from the local
+    rule, O from its debt answer, G, L and B as the model scored them.
+    `scored` is a batch.score_purchases result.
+    """
+    d = discretionary_grid(budget, scored["item_cost"].to_numpy(dtype=float), rules)
+    o = np.array([compute_opportunity(debt, rules) for debt in scored["has_high_interest_debt"]], dtype=np.int64)
+    return d.astype(np.int64) + o + scored[JUDGMENT_FACTORS].to_numpy(dtype=np.int64).sum(axis=1)
+
+
+def plan_purchases(scored, budget, objective="pds", min_pds=0, rules=None):
+    """
+    Picks the items to buy from a scored wishlist. Returns a copy of
+    `scored` with the budget's D and PDS, each item's value under
+    `objective` and a `selected` column; attrs hold the totals and the
+    solve time. Items scoring below `min_pds` are left out whatever the
+    objective.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective!r}; expected one of {', '.join(OBJECTIVES)}")
+    started = time.perf_counter()
+    pds = item_scores(scored, budget, rules)
+    if objective == "pds":
+        values = pds
+    elif objective == "buys":
+        values = (pds >= BUY_THRESHOLD).astype(np.int64)
+    else:
+        values = scored["G"].to_numpy(dtype=np.int64)
+    values = np.where(pds >= min_pds, values, 0)
+    chosen = solve_knapsack(scored["item_cost"].to_numpy(dtype=float), values, budget)
+
+    plan = scored.copy()
+    plan["D"] = discretionary_grid(budget, plan["item_cost"].to_numpy(dtype=float), rules)
+    plan["PDS"] = pds
+    plan["value"] = values
+    plan["selected"] = False
+    plan.loc[chosen, "selected"] = True
+    plan.attrs.update({
+        "budget": budget,
+        "total_cost": float(plan.loc[chosen, "item_cost"].sum()),
+        "total_value": int(values[chosen].sum()),
+        "total_pds": int(pds[chosen].sum()),
+        "solve_seconds": time.perf_counter() - started,
+    })
+    return plan
@@ -0,0 +1,218 @@
+"""
+Prompt text for the PDS factor model.
+
+The rubric is shared between the single-item prompt and the packed
+multi-item prompt so both ask exactly the same question. In hybrid mode D
+and O are scored locally (see munger.scoring) and the judgment prompts
+ask only for G, L and B, leaving out the numbers they don't depend on.
+
+With structured output the JSON shape is enforced by a response schema
+instead of an example in the prompt, and explanations are capped at a
+configurable number of words (0 drops them entirely).
+"""
+
+PDS_RUBRIC = """
+We have a Purchase Decision Score (PDS) formula:
+PDS = D + O + G + L + B, each factor is -2 to 2.
+
+Guidelines:
+1. D: Higher if leftover_income >> item_cost
+2. O: Positive if no high-interest debt, negative if debt
+3. G: Positive if aligns with main_financial_goal, negative if conflicts
+4. L: Positive if it has a long-term benefit, negative if not
+5. B: Positive if it's an urgent need, negative if it's an impulsive or non-essential
+""".strip()
+
+FACTOR_JSON_EXAMPLE = """
+{
+  "D": 2,
+  "O": 1,
+  "G": 0,
+  "L": -1,
+  "B": 2,
+  "D_explanation": "...",
+  "O_explanation": "...",
+  "G_explanation": "...",
+  "L_explanation": "...",
+  "B_explanation": "..."
+}
+""".strip()
+
+
+JUDGMENT_RUBRIC = """
+We score purchases on three judgment factors, each an integer from -2 to 2:
+
+1. G: Positive if aligns with main_financial_goal, negative if conflicts
+2. L: Positive if it has a long-term benefit, negative if not
+3. B: Positive if it's an urgent need, negative if it's an impulsive or non-essential
+""".strip()
+
+JUDGMENT_JSON_EXAMPLE = """
+{
+  "G": 0,
+  "L": -1,
+  "B": 2,
+  "G_explanation": "...",
+  "L_explanation": "...",
+  "B_explanation": "..."
+}
+""".strip()
+
+# The inputs G, L and B depend on; cost, income and debt only feed D and O
+JUDGMENT_INPUTS = ["item_name", "main_financial_goal", "purchase_urgency", "extra_context"]
+
+
+def judgment_inputs(inputs):
+    return {k: inputs.get(k) for k in JUDGMENT_INPUTS}
+
+
+def describe_purchase(leftover_income, has_high_interest_debt,
+                      main_financial_goal, purchase_urgency,
+                      item_name, item_cost, extra_context=None):
+    """
+    The per-item "Evaluate" block.
+    """
+    extra_text = f"\nAdditional user context: {extra_context}" if extra_context else ""
+    return f"""
+- Item: {item_name}
+- Cost: {item_cost}
+- leftover_income: {leftover_income}
+- high_interest_debt: {has_high_interest_debt}
+- main_financial_goal: {main_financial_goal}
+- purchase_urgency: {purchase_urgency}
+{extra_text}
+""".strip()
+
+
+def describe_judgment(item_name, main_financial_goal, purchase_urgency,
+                      extra_context=None, **_numeric_inputs):
+    """
+    The per-item block for judgment-only prompts.
+    """
+    extra_text = f"\nAdditional user context: {extra_context}" if extra_context else ""
+    return f"""
+- Item: {item_name}
+- main_financial_goal: {main_financial_goal}
+- purchase_urgency: {purchase_urgency}
+{extra_text}
+""".strip()
+
+
+def build_factor_prompt(**inputs):
+    """
+    Prompt for a single purchase; `inputs` are get_factors_from_gemini's
+    keyword arguments.
+    """
+    return f"""
+{PDS_RUBRIC}
+
+Evaluate:
+{describe_purchase(**inputs)}
+
+Return valid JSON:
+{FACTOR_JSON_EXAMPLE}
+""".strip()
+
+
+def build_judgment_prompt(**inputs):
+    """
+    Prompt asking only for G, L and B for a single purchase.
+    """
+    return f"""
+{JUDGMENT_RUBRIC}
+
+Evaluate:
+{describe_judgment(**inputs)}
+
+Return valid JSON:
+{JUDGMENT_JSON_EXAMPLE}
+""".strip()
+
+
+def explanation_instruction(explanation_words):
+    if not explanation_words:
+        return "Do not include explanations."
+    return f"Keep each explanation to at most {explanation_words} words."
+
+
+def build_structured_prompt(inputs, judgment_only=False, explanation_words=12):
+    """
+    Prompt for a single purchase when the response schema fixes the JSON
+    shape, so no example object is needed.
+    """
+    rubric = JUDGMENT_RUBRIC if judgment_only else PDS_RUBRIC
+    describe = describe_judgment if judgment_only else describe_purchase
+    return f"""
+{rubric}
+
+Evaluate:
+{describe(**inputs)}
+
+Score every factor. {explanation_instruction(explanation_words)}
+""".strip()
+
+
+def response_schema(factors, explanation_words=12, packed=False):
+    """
+    Response schema for structured output: an integer per factor plus,
+    when explanations are wanted, a string per factor. Packed answers are
+    an array of such objects tagged with an integer "id".
+    """
+    properties = {
+        f: {"type": "integer", "description": "Score from -2 to 2"}
+        for f in factors
+    }
+    if explanation_words:
+        for f in factors:
+            properties[f"{f}_explanation"] = {"type": "string"}
+    required = list(properties)
+    if packed:
+        properties = {"id": {"type": "integer"}, **properties}
+        required = ["id"] + required
+    item = {"type": "object", "properties": properties, "required": required}
+    return {"type": "array", "items": item} if packed else item
+
+
+def structured_output_budget(factor_count, explanation_words=12):
+    """
+    max_output_tokens for one structured answer: a little JSON overhead per
+    factor plus roughly two tokens per explanation word.
+    """
+    return 32 + factor_count * (12 + 2 * explanation_words)
+
+
+def build_packed_prompt(items, judgment_only=False, structured=False,
+                        explanation_words=12):
+    """
+    Prompt for several purchases at once. The rubric is sent once and the
+    model answers with a JSON array holding one factor object per item,
+    each tagged with the item's "id".
+    """
+    describe = describe_judgment if judgment_only else describe_purchase
+    blocks = "\n\n".join(
+        f"Purchase id {i}:\n{describe(**inputs)}"
+        for i, inputs in enumerate(items)
+    )
+    if structured:
+        return f"""
+{JUDGMENT_RUBRIC if judgment_only else PDS_RUBRIC}
+
+Evaluate each of the {len(items)} purchases below independently:
+
+{blocks}
+
+Return one object per purchase with "id" set to its purchase id.
+{explanation_instruction(explanation_words)}
+""".strip()
+    return f"""
+{JUDGMENT_RUBRIC if judgment_only else PDS_RUBRIC}
+
+Evaluate each of the {len(items)} purchases below independently:
+
+{blocks}
+
+Return a valid JSON array with exactly one object per purchase, in the same
+order, each shaped like this plus an "id" field matching the purchase id.
+Keep every explanation to one short sentence:
+{JUDGMENT_JSON_EXAMPLE if judgment_only else FACTOR_JSON_EXAMPLE}
+""".strip()
@@ -0,0 +1,400 @@
+"""
+Rate limits and a fair queue in front of the model.
+
+Every model request first waits for its turn in a `QuotaScheduler`:
+
+- global token buckets hold the whole process under the upstream's
+  requests-per-minute and tokens-per-minute quota, so one busy user can't
+  turn everybody's calls into 429s;
+- a per-session bucket (one per priority) caps how fast any one session
+  can spend that quota;
+- waiters are served by priority (interactive before batch), and within a
+  priority in start-time fair order: each session's requests are spaced
+  out in virtual time, so a session with a 500-row batch queued gets one
+  turn in every round rather than the next 500.
+
+Tokens are reserved up front (prompt estimate plus the output budget) and
+settled against the actual usage once the call returns. A waiter can be
+told its queue position and estimated wait as they change, and gives up
+with QueueTimeoutError after `max_wait` seconds, or sooner when the call's
+own `timeout` (what is left of its retry deadline) runs out first.
+
+`ScheduledBackend` puts a backend behind a scheduler. The requesting
+session and the wait callback travel in a context variable (see
+`requester`), like telemetry traces, since the backend sits several
+layers below the UI. Cache hits and requests that join another's
+in-flight call never reach the backend, so they cost no quota.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from munger.resilience import QueueTimeoutError, QuotaUnavailableError
+from munger.telemetry import METRICS, record_span
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Output budget assumed when a request doesn't set max_output_tokens
+DEFAULT_OUTPUT_TOKENS = 512
+
+_requester = ContextVar("munger_requester", default=(None, None))
+
+METRICS.describe("munger_queue_wait_seconds", "Time requests waited for quota, by priority.")
+METRICS.describe("munger_queue_timeouts_total", "Requests that gave up waiting for quota.")
+
+
+@contextmanager
+def requester(session, on_wait=None):
+    """
+    Model requests made inside the block queue as `session`;
+    on_wait(position, eta_seconds) is called while one waits (position 1
+    is next in line) and once with (0, 0) when it is admitted.
+    """
+    token = _requester.set((session, on_wait))
+    try:
+        yield
+    finally:
+        _requester.reset(token)
+
+
+def current_requester():
+    return _requester.get()
+
+
+class TokenBucket:
+    """
+    `rate` tokens per minute, up to `capacity` banked. Not thread-safe:
+    the scheduler's lock guards it.
+    """
+
+    def __init__(self, rate, capacity=None, now=None):
+        self.rate = rate / 60.0
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n, now):
+        """
+        Seconds until `n` tokens are banked; a request larger than the
+        capacity only needs a full bucket.
+        """
+        self._refill(now)
+        return max(0.0, (min(n, self.capacity) - self.tokens) / self.rate)
+
+    def eta(self, n, now):
+        """
+        Seconds until `n` tokens will have been available, for queue
+        estimates spanning several requests.
+        """
+        self._refill(now)
+        return max(0.0, (n - self.tokens) / self.rate)
+
+    def take(self, n, now):
+        self._refill(now)
+        self.tokens -= n
+
+    def give(self, n):
+        self.tokens = min(self.capacity, self.tokens + n)
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens
+
+
+class _Waiter:
+    __slots__ = ("seq", "priority", "session", "tokens", "tag")
+
+    def __init__(self, seq, priority, session, tokens, tag):
+        self.seq = seq
+        self.priority = priority
+        self.session = session
+        self.tokens = tokens
+        self.tag = tag
+
+
+class QuotaScheduler:
+    """
+    Admits model requests under global RPM/TPM budgets and per-session
+    request rates. `session_limits` maps a priority to (requests per
+    minute, burst) for each session; a rate of 0/None leaves that limit
+    off. Thread-safe.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None,
+                 session_limits=None, max_wait=30.0, max_sessions=4096):
+        now = time.monotonic()
+        self.rpm = TokenBucket(requests_per_minute, now=now) if requests_per_minute else None
+        self.tpm = TokenBucket(tokens_per_minute, now=now) if tokens_per_minute else None
+        self.session_limits = {p: limit for p, limit in (session_limits or {}).items() if limit and limit[0]}
+        self.max_wait = max_wait
+        self.max_sessions = max_sessions
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._seq = itertools.count()
+        self._sessions = {}
+        # Fair queuing: per priority, the start tag of the last admitted
+        # request and each session's latest tag
+        self._virtual = {}
+        self._last_tag = {}
+        self.stats = {"admitted": 0, "queued": 0, "timeouts": 0, "declined": 0, "wait_seconds": 0.0}
+
+    # --------------------------------------------------------
+    # Queue order
+    # --------------------------------------------------------
+    def _session_bucket(self, waiter, now):
+        limit = self.session_limits.get(waiter.priority)
+        if limit is None or waiter.session is None:
+            return None
+        key = (waiter.session, waiter.priority)
+        bucket = self._sessions.get(key)
+        if bucket is None:
+            if len(self._sessions) >= self.max_sessions:
+                # Forget idle sessions; a full bucket is what a new one gets anyway
+                self._sessions = {k: b for k, b in self._sessions.items() if b.available(now) < b.capacity}
+            rate, burst = limit
+            bucket = self._sessions[key] = TokenBucket(rate, burst or rate, now=now)
+        return bucket
+
+    def _tag(self, priority, session):
+        """
+        A new request's virtual start: one past its session's previous
+        request, or past the last admitted request if that is later.
+        """
+        virtual = self._virtual.get(priority, 0)
+        if session is None:
+            return virtual + 1
+        key = (priority, session)
+        if len(self._last_tag) >= self.max_sessions:
+            self._last_tag = {k: t for k, t in self._last_tag.items() if t > self._virtual.get(k[0], 0)}
+        tag = self._last_tag[key] = max(virtual, self._last_tag.get(key, 0)) + 1
+        return tag
+
+    def _order(self):
+        """
+        Waiters in service order: by priority, then start tag, then
+        arrival.
+        """
+        return sorted(self._waiting, key=lambda w: (w.priority, w.tag, w.seq))
+
+    def _global_wait(self, tokens, now):
+        return max(
+            self.rpm.wait_time(1, now) if self.rpm else 0.0,
+            self.tpm.wait_time(tokens, now) if self.tpm else 0.0,
+        )
+
+    def _next(self, order, now):
+        """
+        The waiter to admit now (or None) and how long until the
+        situation can change. A session over its own rate is skipped;
+        otherwise the first waiter in order gets the global budget or
+        nobody does, so priorities hold.
+        """
+        wait = float("inf")
+        for waiter in order:
+            bucket = self._session_bucket(waiter, now)
+            if bucket is not None:
+                session_wait = bucket.wait_time(1, now)
+                if session_wait > 0:
+                    wait = min(wait, session_wait)
+                    continue
+            global_wait = self._global_wait(waiter.tokens, now)
+            if global_wait > 0:
+                return None, min(wait, global_wait)
+            return waiter, 0.0
+        return None, wait
+
+    def _eta(self, order, waiter, now):
+        """
+        Rough seconds until `waiter` is admitted: the global budget for
+        everything up to and including it, or its session's own rate.
+        """
+        ahead = order[:order.index(waiter) + 1]
+        global_eta = max(
+            self.rpm.eta(len(ahead), now) if self.rpm else 0.0,
+            self.tpm.eta(sum(w.tokens for w in ahead), now) if self.tpm else 0.0,
+        )
+        bucket = self._session_bucket(waiter, now)
+        session_eta = 0.0
+        if bucket is not None:
+            own = sum(1 for w in ahead if w.session == waiter.session and w.priority == waiter.priority)
+            session_eta = bucket.eta(own, now)
+        return max(global_eta, session_eta)
+
+    # --------------------------------------------------------
+    # Admission
+    # --------------------------------------------------------
+    def acquire(self, tokens, priority=INTERACTIVE, session=None, on_wait=None, timeout=None):
+        """
+        Blocks until a request of `tokens` (estimated) may go out, then
+        charges it to the budgets. Raises QueueTimeoutError after
+        `timeout` (default max_wait) seconds.
+        """
+        started = time.monotonic()
+        deadline = started + (self.max_wait if timeout is None else timeout)
+        reported = None
+        with self._cond:
+            waiter = _Waiter(next(self._seq), priority, session, tokens, self._tag(priority, session))
+            self._waiting.append(waiter)
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    order = self._order()
+                    chosen, wait = self._next(order, now)
+                    if chosen is waiter:
+                        self._admit(waiter, now)
+                        break
+                    if chosen is not None:
+                        # Someone else's turn: wake them, then wait for them to go
+                        self._cond.notify_all()
+                        wait = deadline - now
+                    if now >= deadline:
+                        self.stats["timeouts"] += 1
+                        METRICS.inc("munger_queue_timeouts_total", priority=PRIORITY_NAMES.get(priority, priority))
+                        raise QueueTimeoutError(
+                            f"Gave up after waiting {now - started:.1f}s for a turn under the rate limits."
+                        )
+                    if reported is None:
+                        self.stats["queued"] += 1
+                    update = (order.index(waiter) + 1, round(self._eta(order, waiter, now)))
+                    if on_wait is None or update == reported:
+                        reported = update
+                        self._cond.wait(min(wait, deadline - now))
+                        continue
+                reported = update
+                # Outside the lock: the callback may draw on the page
+                on_wait(*update)
+                with self._cond:
+                    self._cond.wait(min(wait, deadline - time.monotonic(), 1.0))
+        finally:
+            with self._cond:
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+                self._cond.notify_all()
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self.stats["wait_seconds"] += waited
+        record_span("queue_wait", waited)
+        METRICS.observe("munger_queue_wait_seconds", waited, priority=PRIORITY_NAMES.get(priority, priority))
+        if reported is not None and on_wait is not None:
+            on_wait(0, 0)
+
+    def try_acquire(self, tokens, priority=INTERACTIVE):
+        """
+        Charges a request of `tokens` to the global budgets only if it can
+        go out right now with nobody waiting, and returns whether it did.
+        For optional calls (hedges), which should be skipped, not queued.
+        """
+        with self._cond:
+            now = time.monotonic()
+            if self._waiting or self._global_wait(tokens, now) > 0:
+                self.stats["declined"] += 1
+                return False
+            self._admit(_Waiter(next(self._seq), priority, None, tokens, self._virtual.get(priority, 0)), now)
+            return True
+
+    def _admit(self, waiter, now):
+        if self.rpm:
+            self.rpm.take(1, now)
+        if self.tpm:
+            self.tpm.take(waiter.tokens, now)
+        bucket = self._session_bucket(waiter, now)
+        if bucket is not None:
+            bucket.take(1, now)
+        self._virtual[waiter.priority] = max(self._virtual.get(waiter.priority, 0), waiter.tag)
+        self.stats["admitted"] += 1
+
+    def settle(self, reserved, used):
+        """
+        Corrects the token budget once a request's actual usage is known.
+        """
+        if self.tpm:
+            with self._cond:
+                self.tpm.give(reserved - used)
+                self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            now = time.monotonic()
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for waiter in self._waiting:
+                waiting[PRIORITY_NAMES.get(waiter.priority, str(waiter.priority))] += 1
+            stats = dict(self.stats)
+            stats.update({
+                "waiting": waiting,
+                "sessions": len(self._sessions),
+                "rpm_available": None if self.rpm is None else self.rpm.available(now),
+                "tpm_available": None if self.tpm is None else self.tpm.available(now),
+            })
+        stats["mean_wait_seconds"] = stats["wait_seconds"] / stats["admitted"] if stats["admitted"] else 0.0
+        return stats
+
+
+class ScheduledBackend:
+    """
+    Backend wrapper that waits for the scheduler before every request,
+    at `priority`, as the session set by `requester`. An `optional`
+    backend (a hedge leg) never waits: when the budgets have no room right
+    away it raises QuotaUnavailableError instead.
+    """
+
+    def __init__(self, backend, scheduler, priority=INTERACTIVE, optional=False):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.priority = priority
+        self.optional = optional
+        self.model_name = backend.model_name
+
+    def _acquire(self, prompt, options):
+        """
+        Returns the tokens reserved and the options to call with: time
+        spent queueing comes out of the call's `timeout`.
+        """
+        reserved = len(prompt) // 4 + int(options.get("max_output_tokens") or DEFAULT_OUTPUT_TOKENS)
+        if self.optional:
+            if not self.scheduler.try_acquire(reserved, self.priority):
+                raise QuotaUnavailableError("No quota to spare for an optional request.")
+            return reserved, options
+        session, on_wait = current_requester()
+        timeout = options.get("timeout")
+        started = time.monotonic()
+        self.scheduler.acquire(
+            reserved, self.priority, session, on_wait,
+            timeout=None if timeout is None else min(timeout, self.scheduler.max_wait)
+        )
+        if timeout is not None:
+            options = dict(options, timeout=max(0.1, timeout - (time.monotonic() - started)))
+        return reserved, options
+
+    def generate(self, prompt, options):
+        reserved, options = self._acquire(prompt, options)
+        # A failed call still sent its prompt; give back the output share
+        used = len(prompt) // 4
+        try:
+            completion = self.backend.generate(prompt, options)
+            used = (completion.input_tokens or used) + (completion.output_tokens or len(completion.text) // 4)
+            return completion
+        finally:
+            self.scheduler.settle(reserved, used)
+
+    def stream(self, prompt, options):
+        reserved, options = self._acquire(prompt, options)
+        chunks = []
+        try:
+            for chunk in self.backend.stream(prompt, options):
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            self.scheduler.settle(reserved, len(prompt) // 4 + len("".join(chunks)) // 4)
+
+    def snapshot(self):
+        return self.backend.snapshot()
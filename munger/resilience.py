@@ -0,0 +1,301 @@
+"""
+Retries, deadlines and a circuit breaker for upstream model calls.
+
+`RetryPolicy.run` retries transient failures (429, 5xx, timeouts) with
+full-jitter exponential backoff, inside an overall deadline, and reports
+every outcome to a shared `CircuitBreaker`. When the recent failure rate
+crosses a threshold the breaker opens and calls fail fast with
+CircuitOpenError until a cool-down passes and a probe call succeeds.
+`bounded_stream` puts a deadline on the gaps in a streamed answer.
+"""
+import contextvars
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+_STATUS_PREFIX = re.compile(r"^\s*(\d{3})\b")
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    The breaker is open: the call was not attempted.
+    """
+
+
+class QueueTimeoutError(RuntimeError):
+    """
+    The call waited too long for its turn under the rate limits (see
+    munger.quota) and was not attempted.
+    """
+
+
+class QuotaUnavailableError(QueueTimeoutError):
+    """
+    An optional call (such as a hedge) was skipped because the rate limits
+    had no room for it right away.
+    """
+
+
+class StreamStalledError(TimeoutError):
+    """
+    A streamed answer sent nothing for longer than its allowed gap.
+    """
+
+
+def status_code(error):
+    """
+    The HTTP-style status of an upstream error, if one can be told:
+    google.api_core exceptions carry it as `.code`, others (and the fake
+    backends) start their message with it.
+    """
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    match = _STATUS_PREFIX.match(str(error))
+    return int(match.group(1)) if match else None
+
+
+def is_transient(error):
+    """
+    True for failures worth retrying and worth counting against the
+    upstream's health: timeouts, dropped connections, 429 and 5xx.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return status_code(error) in TRANSIENT_STATUS
+
+
+# ------------------------------------------------------------
+# Circuit breaker
+# ------------------------------------------------------------
+class CircuitBreaker:
+    """
+    Opens when at least `failure_rate` of the last `window` calls (and at
+    least `min_calls` of them) failed transiently. After `cooldown_seconds`
+    one probe call is let through (half-open): success closes the breaker,
+    failure re-opens it for another cool-down.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_rate=0.5, window=20, min_calls=5, cooldown_seconds=30.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._trips = 0
+        self._short_circuited = 0
+
+    def allow(self):
+        """
+        Whether a call may go upstream now. Callers that get True must
+        report the outcome with record_success or record_failure.
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown_seconds:
+                    self._short_circuited += 1
+                    return False
+                self._state = self.HALF_OPEN
+                self._probing = False
+            if self._state == self.HALF_OPEN:
+                # A probe that never reported back (its caller died) stops
+                # blocking others after one more cool-down
+                now = time.monotonic()
+                if self._probing and now - self._probe_started < self.cooldown_seconds:
+                    self._short_circuited += 1
+                    return False
+                self._probing = True
+                self._probe_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+                self._probing = False
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if (self._state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_rate):
+                self._open()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self._trips += 1
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def snapshot(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            retry_in = 0.0
+            if self._state == self.OPEN:
+                retry_in = max(0.0, self.cooldown_seconds - (time.monotonic() - self._opened_at))
+            return {
+                "state": self._state,
+                "recent_calls": calls,
+                "recent_failure_rate": self._outcomes.count(False) / calls if calls else 0.0,
+                "trips": self._trips,
+                "short_circuited": self._short_circuited,
+                "retry_in_seconds": retry_in,
+            }
+
+
+# ------------------------------------------------------------
+# Retry policy
+# ------------------------------------------------------------
+class RetryPolicy:
+    """
+    Up to `max_attempts` tries, each limited to `attempt_timeout` seconds,
+    all within `deadline` seconds including the backoff sleeps. Backoff is
+    full jitter: uniform(0, min(max_delay, base_delay * 2**retry)).
+
+    Shared across sessions, so its counters describe the whole process.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=8.0,
+                 attempt_timeout=30.0, deadline=60.0, seed=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "gave_up": 0,
+            "timeouts": 0,
+            "fallbacks": 0,
+        }
+
+    def backoff(self, retry):
+        with self._lock:
+            return self._rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def record_fallback(self):
+        """
+        Counts an answer served from a fallback after run() gave up.
+        """
+        self._count("fallbacks")
+
+    def run(self, fn, breaker=None, retry_if=is_transient):
+        """
+        Returns fn(timeout) where `timeout` is the seconds this attempt may
+        take. Transient failures count against `breaker`; anything else
+        means the upstream answered, which counts as healthy.
+        """
+        self._count("calls")
+        give_up_at = time.monotonic() + self.deadline
+        retry = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                self._count("gave_up")
+                raise CircuitOpenError("Gemini is temporarily unavailable (circuit open).")
+            timeout = max(0.1, min(self.attempt_timeout, give_up_at - time.monotonic()))
+            self._count("attempts")
+            try:
+                result = fn(timeout)
+            except Exception as e:
+                transient = is_transient(e)
+                if isinstance(e, TimeoutError) or status_code(e) in (408, 504):
+                    self._count("timeouts")
+                # A call that never left the queue says nothing about the upstream
+                if breaker is not None and not isinstance(e, QueueTimeoutError):
+                    if transient:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                retry += 1
+                delay = self.backoff(retry - 1)
+                if (not retry_if(e) or retry >= self.max_attempts
+                        or time.monotonic() + delay >= give_up_at):
+                    self._count("gave_up")
+                    raise
+                self._count("retries")
+                time.sleep(delay)
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return result
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+# ------------------------------------------------------------
+# Streams
+# ------------------------------------------------------------
+def bounded_stream(chunks, gap_seconds):
+    """
+    Yields from the iterator `chunks`, read on a helper thread, and raises
+    StreamStalledError once `gap_seconds` pass without a chunk. Closing
+    this generator has the helper stop and close `chunks` after the chunk
+    it is waiting for; a stalled one is left to its thread.
+    """
+    items = queue.Queue()
+    stop = threading.Event()
+
+    def pump():
+        error = None
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                items.put(("chunk", chunk))
+        except Exception as e:
+            error = e
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            items.put(("end", error))
+
+    # The backend may read context (trace, requester) while streaming
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(pump,), daemon=True, name="stream-reader").start()
+    try:
+        while True:
+            try:
+                kind, value = items.get(timeout=gap_seconds)
+            except queue.Empty:
+                raise StreamStalledError(f"stream stalled for {gap_seconds:.1f}s") from None
+            if kind == "end":
+                if value is not None:
+                    raise value
+                return
+            yield value
+    finally:
+        stop.set()
@@ -0,0 +1,191 @@
+"""
+Hedged requests and per-route latency tracking.
+
+A `HedgedBackend` wraps a primary backend and, optionally, a hedge backend
+(the same model or a cheaper/faster one). If the primary hasn't answered
+within the route's recent p95 latency, the same request goes to the hedge
+as well and whichever answers first wins. Every leg's latency lands in a
+`LatencyHistogram` so the pay-off is measurable.
+"""
+import bisect
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 13.0, 21.0)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram (seconds) plus a window of recent
+    samples for quantiles.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=1000):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._recent = deque(maxlen=window)
+        self._sum = 0.0
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._recent.append(seconds)
+            self._sum += seconds
+
+    def __len__(self):
+        with self._lock:
+            return sum(self._counts)
+
+    def quantile(self, q):
+        """
+        The q-quantile (0..1) of the recent window, or None if empty.
+        """
+        with self._lock:
+            ordered = sorted(self._recent)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self):
+        """
+        count, sum, p50/p95/p99 and cumulative bucket counts as
+        (upper bound, count) pairs, the last bound being infinity.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        running = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            running += n
+            cumulative.append((bound, running))
+        return {
+            "count": running,
+            "sum": total,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": cumulative,
+        }
+
+
+class HedgedBackend:
+    """
+    Backend wrapper that hedges slow calls.
+
+    The hedge fires after the `quantile` of the primary's recent latency
+    (clamped to `min_delay`..`max_delay`; `initial_delay` until
+    `min_samples` calls have been seen), so roughly 1 - quantile of calls
+    are hedged. With `hedge=None` nothing is hedged but latency is still
+    recorded. The loser of a race is left to finish in the background:
+    sync SDK calls can't be cancelled.
+    """
+
+    def __init__(self, primary, hedge=None, name="default", quantile=0.95,
+                 min_delay=0.3, max_delay=10.0, initial_delay=2.0, min_samples=20,
+                 max_workers=32):
+        self.primary = primary
+        self.hedge = hedge
+        self.name = name
+        self.model_name = primary.model_name
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedge-{name}")
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0}
+        # generate: full response time; stream: time to first chunk
+        self.latency = {
+            (kind, leg): LatencyHistogram()
+            for kind in ("generate", "stream")
+            for leg in ("served", "primary", "hedge")
+        }
+
+    def hedge_delay(self, kind="generate"):
+        primary = self.latency[(kind, "primary")]
+        if len(primary) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, min(self.max_delay, primary.quantile(self.quantile)))
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _race(self, kind, start_leg):
+        """
+        Starts the primary leg, adds the hedge leg if the primary is slow,
+        and returns (winning future, whether it was the hedge, the other
+        futures). Raises the primary's error if every leg failed.
+        """
+        self._count("calls")
+        primary = self._pool.submit(start_leg, self.primary, self.latency[(kind, "primary")])
+        legs = {primary: False}
+        done, _ = wait([primary], timeout=self.hedge_delay(kind))
+        if not done and self.hedge is not None:
+            self._count("hedged")
+            legs[self._pool.submit(start_leg, self.hedge, self.latency[(kind, "hedge")])] = True
+
+        pending = set(legs)
+        errors = {}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if legs[future]:
+                        self._count("hedge_wins")
+                    return future, legs[future], [f for f in legs if f is not future]
+                errors[legs[future]] = future.exception()
+        raise errors.get(False, errors.get(True))
+
+    def generate(self, prompt, options):
+        def leg(backend, histogram):
+            started = time.perf_counter()
+            completion = backend.generate(prompt, options)
+            histogram.observe(time.perf_counter() - started)
+            return completion
+
+        started = time.perf_counter()
+        winner, _, _ = self._race("generate", leg)
+        self.latency[("generate", "served")].observe(time.perf_counter() - started)
+        return winner.result()
+
+    def stream(self, prompt, options):
+        def leg(backend, histogram):
+            started = time.perf_counter()
+            chunks = iter(backend.stream(prompt, options))
+            first = next(chunks, "")
+            histogram.observe(time.perf_counter() - started)
+            return chunks, first
+
+        def close_loser(future):
+            if future.exception() is None:
+                chunks = future.result()[0]
+                if hasattr(chunks, "close"):
+                    chunks.close()
+
+        started = time.perf_counter()
+        winner, _, losers = self._race("stream", leg)
+        self.latency[("stream", "served")].observe(time.perf_counter() - started)
+        for loser in losers:
+            loser.add_done_callback(close_loser)
+        chunks, first = winner.result()
+        yield first
+        yield from chunks
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update({
+            "route": self.name,
+            "model": self.model_name,
+            "hedge_model": self.hedge.model_name if self.hedge is not None else None,
+            "hedge_rate": stats["hedged"] / stats["calls"] if stats["calls"] else 0.0,
+            "hedge_delay": self.hedge_delay("generate"),
+            "latency": {f"{kind}/{leg}": h.snapshot() for (kind, leg), h in self.latency.items()},
+        })
+        return stats
@@ -0,0 +1,78 @@
+"""
+Purchase Decision Score (PDS) arithmetic.
+"""
+
+FACTORS = ["D", "O", "G", "L", "B"]
+
+
+def compute_pds(factors):
+    return sum(factors.get(f, 0) for f in FACTORS)
+
+
+def get_recommendation(pds):
+    if pds >= 5:
+        return "Buy it.", "positive"
+    elif pds < 0:
+        return "Don't buy it.", "negative"
+    else:
+        return "Consider carefully.", "neutral"
+
+
+# ------------------------------------------------------------
+# Local rule engine for the numeric factors
+# ------------------------------------------------------------
+# D and O follow directly from the form's numbers, so they can be scored
+# without a model call. Only G, L and B need judgment.
+LOCAL_FACTORS = ["D", "O"]
+JUDGMENT_FACTORS = ["G", "L", "B"]
+
+DEFAULT_RULES = {
+    # leftover_income / item_cost ratios at which D steps up from -2 to
+    # -1, 0, +1 and +2 respectively
+    "d_ratio_steps": [1.0, 2.0, 3.0, 5.0],
+    "o_with_debt": -2,
+    "o_without_debt": 1,
+}
+
+
+def _rule(rules, name):
+    return (rules or {}).get(name, DEFAULT_RULES[name])
+
+
+def compute_discretionary(leftover_income, item_cost, rules=None):
+    """
+    D: -2..+2 depending on how many times over leftover income covers the cost.
+    """
+    if item_cost <= 0:
+        return 2
+    ratio = leftover_income / item_cost
+    steps = sorted(_rule(rules, "d_ratio_steps"))
+    return -2 + sum(ratio >= step for step in steps[:4])
+
+
+def compute_opportunity(has_high_interest_debt, rules=None):
+    """
+    O: negative with high-interest debt (paying it down is the better use
+    of the money), positive without.
+    """
+    has_debt = str(has_high_interest_debt).strip().lower() in ("yes", "true", "1")
+    return _rule(rules, "o_with_debt") if has_debt else _rule(rules, "o_without_debt")
+
+
+def compute_local_factors(leftover_income, item_cost, has_high_interest_debt, rules=None):
+    """
+    Returns D and O with explanations, computed from the numbers alone.
+    """
+    d = compute_discretionary(leftover_income, item_cost, rules)
+    o = compute_opportunity(has_high_interest_debt, rules)
+    ratio = leftover_income / item_cost if item_cost > 0 else float("inf")
+    if o < 0:
+        o_text = "High-interest debt: paying it down likely beats this purchase."
+    else:
+        o_text = "No high-interest debt competing for this money."
+    return {
+        "D": d,
+        "O": o,
+        "D_explanation": f"Leftover income covers the cost {ratio:.1f}x.",
+        "O_explanation": o_text,
+    }
@@ -0,0 +1,381 @@
+"""
+Near-duplicate cache for purchase answers.
+
+The response cache only matches inputs that normalize to the same key, so
+"New Laptop", "laptop" and "Laptop (new)" at $499 and $500 are three
+model calls. `SemanticCache` catches those:
+
+- item names are normalized to a sorted set of lower-case, singular
+  tokens without filler words ("new", "a", "my", ...), so case, word
+  order, punctuation and plurals don't matter;
+- the other text inputs (goal, urgency, context, debt answer) must match
+  exactly after normalization, and numbers (cost, income) must lie within
+  a relative tolerance band of each other;
+- among entries with the same text inputs, candidates come from a
+  MinHash/LSH index over character trigrams of the normalized name, and
+  are accepted when their estimated trigram Jaccard similarity passes
+  `threshold` and every word that differs is a likely typo of one in the
+  other name. Numbers and short words must match exactly, so "laptop
+  pro", "laptop max" and "laptop 2" are all different from "laptop".
+
+Signatures live in one NumPy matrix and each LSH band is a dict from an
+integer band hash to the slots sharing it, so a lookup is a few NumPy
+operations and sixteen dict probes: well under a millisecond at 100k
+entries. The index lives in memory, bounded by `max_entries` (least
+recently used go first) and the same TTL as the response cache.
+"""
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from munger.cache import _normalize
+from munger.routing import LatencyHistogram
+from munger.telemetry import METRICS, STAGE_BUCKETS
+
+# Words that don't change what is being bought
+FILLER_WORDS = {"a", "an", "the", "my", "our", "new", "brand", "some", "one"}
+
+NUMERIC_FIELDS = ("item_cost", "leftover_income")
+
+_WORD = re.compile(r"[a-z0-9]+")
+_GOLDEN = 0x9E3779B97F4A7C15
+
+METRICS.describe("munger_semantic_lookups_total", "Near-duplicate cache lookups, by result.")
+METRICS.describe("munger_semantic_lookup_seconds", "Near-duplicate cache lookup time.")
+
+
+def normalize_item(name):
+    """
+    "Laptops (New)" -> "laptop": lower-case word tokens, filler words
+    dropped, simple plurals singularized, sorted.
+    """
+    tokens = set()
+    for word in _WORD.findall(str(name).lower()):
+        if word in FILLER_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.add(word)
+    return " ".join(sorted(tokens))
+
+
+def trigrams(text):
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _typo(a, b):
+    """
+    Whether one word could be a typo of the other: both alphabetic and
+    at least 4 letters, within 1 edit (2 from 8 letters), a swap of
+    neighbouring letters counting as one.
+    """
+    if len(a) < 4 or len(b) < 4 or not (a.isalpha() and b.isalpha()):
+        return False
+    limit = 2 if max(len(a), len(b)) >= 8 else 1
+    if abs(len(a) - len(b)) > limit:
+        return False
+    # Optimal string alignment distance, three rows at a time
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        before, previous = previous, current
+    return previous[-1] <= limit
+
+
+def words_match(a, b):
+    """
+    Whether two normalized names' word sets differ only by typos.
+    """
+    extra, missing = a - b, b - a
+    if len(extra) != len(missing):
+        return False
+    return all(any(_typo(x, y) for y in missing) for x in extra)
+
+
+class SemanticCache:
+    """
+    Near-duplicate lookup of answers by purchase inputs. `scope` keeps
+    answers from different models or prompt kinds apart; `tolerances`
+    maps each numeric input to the relative difference still treated as
+    the same (0.05: within 5%). Thread-safe.
+    """
+
+    def __init__(self, threshold=0.6, tolerances=None, max_entries=100_000,
+                 ttl_seconds=7 * 24 * 3600, bands=16, rows=4, enabled=True, seed=0):
+        self.threshold = threshold
+        self.tolerances = {"item_cost": 0.05, "leftover_income": 0.10, **(tolerances or {})}
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.bands = bands
+        self.rows = rows
+        self.enabled = enabled
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing: (a * x + b) mod 2**64, high 32 bits
+        self._a = rng.integers(1, 2 ** 63, size=(bands * rows, 1), dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=(bands * rows, 1), dtype=np.uint64)
+        self._row_mix = rng.integers(1, 2 ** 63, size=rows, dtype=np.uint64) | np.uint64(1)
+        self._lock = threading.Lock()
+        self._init_storage()
+        self.latency = LatencyHistogram(STAGE_BUCKETS)
+        self.stats = {"exact_hits": 0, "near_hits": 0, "misses": 0, "adds": 0, "evictions": 0, "expirations": 0}
+
+    def _init_storage(self):
+        # Entries live in numbered slots; freed slots are reused
+        self._signatures = np.zeros((0, self.bands * self.rows), dtype=np.uint32)
+        self._names = []
+        self._numbers = []
+        self._values = []
+        self._slot_contexts = []
+        self._created = []
+        self._free = []
+        self._order = OrderedDict()
+        # Context key -> [id, live entries], and back
+        self._contexts = {}
+        self._context_keys = {}
+        self._next_context = 0
+        self._exact = {}
+        self._buckets = [{} for _ in range(self.bands)]
+
+    # --------------------------------------------------------
+    # Keys
+    # --------------------------------------------------------
+    def _split(self, scope, inputs):
+        """
+        (context key, normalized name, numbers) for a purchase inputs dict.
+        """
+        context = (scope,) + tuple(
+            (k, _normalize(v)) for k, v in sorted(inputs.items())
+            if k != "item_name" and k not in NUMERIC_FIELDS
+        )
+        numbers = tuple(
+            (k, float(inputs[k])) for k in NUMERIC_FIELDS if inputs.get(k) is not None
+        )
+        return context, normalize_item(inputs["item_name"]), numbers
+
+    def _signature(self, name):
+        grams = trigrams(name)
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+        with np.errstate(over="ignore"):
+            mixed = (self._a * hashes + self._b) >> np.uint64(32)
+        return mixed.min(axis=1).astype(np.uint32)
+
+    def _band_hashes(self, signature):
+        with np.errstate(over="ignore"):
+            combined = signature.reshape(self.bands, self.rows).astype(np.uint64) * self._row_mix
+            return combined.sum(axis=1, dtype=np.uint64).tolist()
+
+    @staticmethod
+    def _salt(context_id):
+        # Folded into band hashes so one dict per band serves every context
+        return (context_id * _GOLDEN) & 0xFFFFFFFFFFFFFFFF
+
+    def _numbers_match(self, a, b):
+        if len(a) != len(b):
+            return False
+        for (key, x), (_, y) in zip(a, b):
+            tolerance = self.tolerances.get(key, 0.0)
+            if abs(x - y) > tolerance * max(abs(x), abs(y)):
+                return False
+        return True
+
+    # --------------------------------------------------------
+    # Lookup / insert
+    # --------------------------------------------------------
+    def get(self, scope, inputs):
+        """
+        A stored answer for a near-identical purchase, or None.
+        """
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        context, name, numbers = self._split(scope, inputs)
+        signature = self._signature(name) if name else None
+        now = time.time()
+        slot, kind, value = None, "miss", None
+        with self._lock:
+            known = self._contexts.get(context)
+            if known is not None:
+                slot = self._find_exact(known[0], name, numbers, now)
+                if slot is not None:
+                    kind = "exact"
+                elif signature is not None:
+                    slot = self._find_near(known[0], name, numbers, signature, now)
+                    if slot is not None:
+                        kind = "near"
+            if slot is not None:
+                self._order.move_to_end(slot)
+                value = self._values[slot]
+                self.stats[f"{kind}_hits"] += 1
+            else:
+                self.stats["misses"] += 1
+        elapsed = time.perf_counter() - started
+        self.latency.observe(elapsed)
+        METRICS.inc("munger_semantic_lookups_total", result=kind)
+        METRICS.observe("munger_semantic_lookup_seconds", elapsed)
+        return value
+
+    def add(self, scope, inputs, value):
+        """
+        Indexes `value` as the answer for `inputs`, replacing any answer
+        stored for the same name and numbers.
+        """
+        if not self.enabled:
+            return
+        context, name, numbers = self._split(scope, inputs)
+        if not name:
+            return
+        signature = self._signature(name)
+        hashes = self._band_hashes(signature)
+        now = time.time()
+        with self._lock:
+            self.stats["adds"] += 1
+            known = self._contexts.get(context)
+            if known is None:
+                known = self._contexts[context] = [self._next_context, 0]
+                self._context_keys[self._next_context] = context
+                self._next_context += 1
+            context_id = known[0]
+            for slot in self._exact.get((context_id, name), ()):
+                if self._numbers[slot] == numbers:
+                    self._values[slot] = value
+                    self._created[slot] = now
+                    self._order.move_to_end(slot)
+                    return
+            known[1] += 1
+            slot = self._new_slot()
+            self._signatures[slot] = signature
+            self._names[slot] = name
+            self._numbers[slot] = numbers
+            self._values[slot] = value
+            self._slot_contexts[slot] = context_id
+            self._created[slot] = now
+            self._order[slot] = None
+            self._exact.setdefault((context_id, name), set()).add(slot)
+            salt = self._salt(context_id)
+            for bucket, h in zip(self._buckets, hashes):
+                key = h ^ salt
+                held = bucket.get(key)
+                # Most bands hold a single slot: store it bare, not in a set
+                if held is None:
+                    bucket[key] = slot
+                elif isinstance(held, set):
+                    held.add(slot)
+                else:
+                    bucket[key] = {held, slot}
+            while len(self._order) > self.max_entries:
+                self._drop(next(iter(self._order)))
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._init_storage()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._order)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._order)
+        stats["hits"] = stats["exact_hits"] + stats["near_hits"]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["lookup_p50_ms"] = (self.latency.quantile(0.5) or 0.0) * 1000
+        stats["lookup_p99_ms"] = (self.latency.quantile(0.99) or 0.0) * 1000
+        stats["enabled"] = self.enabled
+        return stats
+
+    # --------------------------------------------------------
+    # Internals (callers hold self._lock)
+    # --------------------------------------------------------
+    def _new_slot(self):
+        if self._free:
+            return self._free.pop()
+        slot = len(self._names)
+        if slot == len(self._signatures):
+            grown = np.zeros((max(1024, 2 * slot), self.bands * self.rows), dtype=np.uint32)
+            grown[:slot] = self._signatures
+            self._signatures = grown
+        for column in (self._names, self._numbers, self._values, self._slot_contexts, self._created):
+            column.append(None)
+        return slot
+
+    def _find_exact(self, context_id, name, numbers, now):
+        for slot in list(self._exact.get((context_id, name), ())):
+            if self._live(slot, now) and self._numbers_match(numbers, self._numbers[slot]):
+                return slot
+        return None
+
+    def _find_near(self, context_id, name, numbers, signature, now):
+        salt = self._salt(context_id)
+        candidates = set()
+        for bucket, h in zip(self._buckets, self._band_hashes(signature)):
+            held = bucket.get(h ^ salt)
+            if held is None:
+                continue
+            if isinstance(held, set):
+                candidates |= held
+            else:
+                candidates.add(held)
+        candidates = [
+            slot for slot in candidates
+            if self._slot_contexts[slot] == context_id and self._numbers_match(numbers, self._numbers[slot])
+        ]
+        if not candidates:
+            return None
+        similarity = (self._signatures[candidates] == signature).mean(axis=1)
+        words = set(name.split())
+        for i in np.argsort(-similarity):
+            if similarity[i] < self.threshold:
+                break
+            slot = candidates[i]
+            if words_match(words, set(self._names[slot].split())) and self._live(slot, now):
+                return slot
+        return None
+
+    def _live(self, slot, now):
+        if self.ttl_seconds is not None and now - self._created[slot] > self.ttl_seconds:
+            self._drop(slot)
+            self.stats["expirations"] += 1
+            return False
+        return True
+
+    def _drop(self, slot):
+        context_id = self._slot_contexts[slot]
+        key = (context_id, self._names[slot])
+        self._exact[key].discard(slot)
+        if not self._exact[key]:
+            del self._exact[key]
+        salt = self._salt(context_id)
+        for bucket, h in zip(self._buckets, self._band_hashes(self._signatures[slot])):
+            key = h ^ salt
+            held = bucket.get(key)
+            if isinstance(held, set):
+                held.discard(slot)
+                if len(held) == 1:
+                    bucket[key] = next(iter(held))
+            elif held == slot:
+                del bucket[key]
+        context = self._context_keys[context_id]
+        self._contexts[context][1] -= 1
+        if not self._contexts[context][1]:
+            del self._contexts[context]
+            del self._context_keys[context_id]
+        del self._order[slot]
+        for column in (self._names, self._numbers, self._values, self._slot_contexts, self._created):
+            column[slot] = None
+        self._free.append(slot)
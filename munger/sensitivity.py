@@ -0,0 +1,80 @@
+"""
+What-if scoring over a grid of costs and incomes.
+
+The model's judgment factors (G, L, B) are asked for once; only D depends
+on cost and leftover income, so the PDS over any grid of the two follows
+from the local rules in one vectorized pass. O depends only on debt and is
+constant across the grid. The judgment factors are held fixed, which is an
+approximation: a much cheaper or dearer item might have been judged
+differently.
+"""
+import math
+
+import numpy as np
+
+from munger.scoring import DEFAULT_RULES, JUDGMENT_FACTORS, compute_opportunity
+
+BUY_THRESHOLD = 5
+DONT_BUY_THRESHOLD = 0
+
+
+def _ratio_steps(rules):
+    return np.sort(np.asarray((rules or {}).get("d_ratio_steps", DEFAULT_RULES["d_ratio_steps"]), dtype=float))[:4]
+
+
+def discretionary_grid(leftover_income, item_cost, rules=None):
+    """
+    D for arrays of leftover income and cost (broadcast against each
+    other); same rule as scoring.compute_discretionary.
+    """
+    income = np.asarray(leftover_income, dtype=float)
+    cost = np.asarray(item_cost, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(cost > 0, income / np.where(cost > 0, cost, 1.0), np.inf)
+    return np.searchsorted(_ratio_steps(rules), ratio, side="right").astype(np.int8) - 2
+
+
+def fixed_factors(factors, has_high_interest_debt, rules=None):
+    """
+    The part of the PDS that doesn't move with cost or income: O plus the
+    judgment factors.
+    """
+    return compute_opportunity(has_high_interest_debt, rules) + sum(
+        factors.get(f, 0) for f in JUDGMENT_FACTORS
+    )
+
+
+def pds_grid(factors, costs, incomes, has_high_interest_debt, rules=None):
+    """
+    PDS for every (income, cost) pair: rows follow `incomes`, columns
+    `costs`.
+    """
+    d = discretionary_grid(np.asarray(incomes, dtype=float)[:, None], np.asarray(costs, dtype=float)[None, :], rules)
+    return d + fixed_factors(factors, has_high_interest_debt, rules)
+
+
+def grid_axes(item_cost, leftover_income, points=100, span=5.0):
+    """
+    Costs spaced geometrically from item_cost / span to item_cost * span,
+    and incomes spaced linearly from 0 to `span` times the larger of the
+    income and the cost, `points` of each.
+    """
+    costs = np.geomspace(item_cost / span, item_cost * span, points)
+    incomes = np.linspace(0.0, span * max(leftover_income, item_cost), points)
+    return costs, incomes
+
+
+def max_cost_for(factors, leftover_income, has_high_interest_debt, target=BUY_THRESHOLD, rules=None):
+    """
+    The highest cost at which the PDS still reaches `target` at this
+    income: inf if any price does, 0.0 if none does.
+    """
+    needed = target - fixed_factors(factors, has_high_interest_debt, rules)
+    # D = -2 + (ratio steps cleared), so `needed` takes needed + 2 steps
+    steps = _ratio_steps(rules)
+    cleared = needed + 2
+    if cleared <= 0:
+        return math.inf
+    if cleared > len(steps) or leftover_income <= 0:
+        return 0.0
+    return float(leftover_income / steps[cleared - 1])
@@ -0,0 +1,412 @@
+"""
+Headless HTTP scoring service.
+
+    python -m munger.server --port 8080 --backend fake
+
+    POST /score        {"item": "Laptop", "cost": 800, ...}  -> PurchaseScore
+    POST /score/batch  {"purchases": [{...}, ...]}           -> {"results": [...]}
+    GET  /healthz, GET /stats, GET /metrics (Prometheus text format)
+
+Field names follow the batch CSV headers (item/item_name, cost/item_cost,
+income, debt, goal, urgency, context); only item and cost are required,
+the rest default like the basic Decision Tool.
+
+Requests go through a bounded queue (full -> 503 with Retry-After) to a
+few batch workers. Each worker collects whatever arrives within a few
+milliseconds and scores it with one packed model call, so concurrent
+callers share upstream requests. One backend and one thread pool serve
+the whole process, keeping upstream connections warm and bounded.
+
+A small asyncio HTTP/1.1 server (keep-alive, JSON apart from /metrics)
+rather than a web framework, so the service needs nothing beyond the
+app's requirements.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from munger.backends import BACKEND_KINDS, build_backend
+from munger.batch import COLUMN_ALIASES, DEFAULT_DEBT, DEFAULT_GOAL, DEFAULT_URGENCY
+from munger.cache import ResponseCache
+from munger.core import summarize
+from munger.factors import FactorClient, purchase_inputs
+from munger.routing import LatencyHistogram
+from munger.telemetry import METRICS
+
+MAX_BODY_BYTES = 1 << 20
+MAX_BATCH_ITEMS = 500
+ROUTES = ("/healthz", "/stats", "/metrics", "/score", "/score/batch")
+
+log = logging.getLogger(__name__)
+
+METRICS.describe("munger_http_request_seconds", "Scoring service request time, by route.")
+
+
+class BadRequestError(ValueError):
+    """
+    The request can't be scored as sent; the message goes back as a 400.
+    """
+
+
+class QueueFullError(RuntimeError):
+    """
+    The scoring queue is full; the caller should back off and retry.
+    """
+
+
+def parse_purchase(payload):
+    """
+    Validates one purchase from a request body and returns its inputs dict.
+    """
+    if not isinstance(payload, dict):
+        raise BadRequestError("each purchase must be a JSON object")
+    data = {COLUMN_ALIASES.get(str(k).strip().lower(), k): v for k, v in payload.items()}
+    if not data.get("item_name"):
+        raise BadRequestError("item is required")
+    try:
+        item_cost = float(data.get("item_cost"))
+    except (TypeError, ValueError):
+        raise BadRequestError("cost must be a number") from None
+    if not math.isfinite(item_cost) or item_cost <= 0:
+        raise BadRequestError("cost must be a positive number")
+    income = data.get("leftover_income")
+    try:
+        leftover_income = max(1000.0, item_cost * 2) if income in (None, "") else float(income)
+    except (TypeError, ValueError):
+        raise BadRequestError("income must be a number") from None
+    if not math.isfinite(leftover_income):
+        raise BadRequestError("income must be a finite number")
+    return purchase_inputs(
+        leftover_income,
+        data.get("has_high_interest_debt") or DEFAULT_DEBT,
+        data.get("main_financial_goal") or DEFAULT_GOAL,
+        data.get("purchase_urgency") or DEFAULT_URGENCY,
+        str(data["item_name"]),
+        item_cost,
+        data.get("extra_context") or None
+    )
+
+
+# ------------------------------------------------------------
+# Micro-batching
+# ------------------------------------------------------------
+class MicroBatcher:
+    """
+    Queues purchases and scores them in small batches: a worker takes the
+    first waiting purchase, gathers more for up to `window_ms` (at most
+    `max_batch`), then makes one packed model call for the lot (a plain
+    call for a batch of one). `workers` batches run at once.
+    """
+
+    def __init__(self, client, max_batch=32, window_ms=5.0, max_queue=2000, workers=32):
+        self.client = client
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.workers = workers
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batcher")
+        self._tasks = []
+        self.latency = LatencyHistogram()
+        self.stats = {"requests": 0, "rejected": 0, "batches": 0, "batched_items": 0}
+
+    def start(self):
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._pool.shutdown(wait=False)
+
+    def enqueue(self, inputs):
+        """
+        Queues `inputs` and returns a future for its factor dict; cancel
+        the future and the purchase is dropped unscored. Raises
+        QueueFullError straight away if the queue is full.
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((inputs, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            raise QueueFullError("scoring queue is full") from None
+        self.stats["requests"] += 1
+        return future
+
+    async def submit(self, inputs):
+        """
+        Returns the factor dict for `inputs` once its batch is scored.
+        Raises QueueFullError straight away if the queue is full.
+        """
+        return await self.enqueue(inputs)
+
+    def _score(self, items):
+        if len(items) == 1:
+            try:
+                return [self.client.get_factors(items[0])]
+            except Exception as e:
+                return [e]
+
+        def fallback(**inputs):
+            try:
+                return self.client.get_factors(inputs)
+            except Exception as e:
+                return e
+
+        return self.client.get_factors_packed(items, fallback=fallback)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            gather_until = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = gather_until - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Purchases whose requester gave up (cancelled futures) aren't scored
+            batch = [b for b in batch if not b[1].done()]
+            if not batch:
+                continue
+
+            self.stats["batches"] += 1
+            self.stats["batched_items"] += len(batch)
+            try:
+                outcomes = await loop.run_in_executor(self._pool, self._score, [b[0] for b in batch])
+            except Exception as e:
+                outcomes = [e] * len(batch)
+            now = time.perf_counter()
+            for (_, future, queued_at), outcome in zip(batch, outcomes):
+                self.latency.observe(now - queued_at)
+                if future.done():
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+
+    def snapshot(self):
+        stats = dict(self.stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["mean_batch_size"] = stats["batched_items"] / stats["batches"] if stats["batches"] else 0.0
+        latency = self.latency.snapshot()
+        stats["latency"] = {k: latency[k] for k in ("count", "p50", "p95", "p99")}
+        return stats
+
+
+# ------------------------------------------------------------
+# HTTP
+# ------------------------------------------------------------
+class ScoringServer:
+    """
+    Minimal HTTP/1.1 front for a MicroBatcher.
+    """
+
+    def __init__(self, batcher, host="127.0.0.1", port=8080):
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self._server = None
+        self._writers = set()
+
+    async def start(self):
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        # Idle keep-alive connections would otherwise hold wait_closed open
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, path, version = request_line.split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {"error": "malformed request line"}, False)
+                    return
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = (
+                    headers.get("connection", "").lower() != "close"
+                    and version.upper() == "HTTP/1.1"
+                )
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {"error": "bad Content-Length"}, False)
+                    return
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                        {"error": "request body too large"}, False)
+                    return
+                try:
+                    body = await reader.readexactly(length) if length else b""
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+
+                path = path.split("?", 1)[0]
+                started = time.perf_counter()
+                status, payload, extra = await self._route(method.upper(), path, body)
+                METRICS.observe("munger_http_request_seconds", time.perf_counter() - started,
+                                route=path if path in ROUTES else "other", status=status.value)
+                await self._respond(writer, status, payload, keep_alive, extra)
+                if not keep_alive:
+                    return
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _route(self, method, path, body):
+        try:
+            if method == "GET" and path == "/healthz":
+                return HTTPStatus.OK, {"status": "ok"}, None
+            if method == "GET" and path == "/stats":
+                return HTTPStatus.OK, self.stats(), None
+            if method == "GET" and path == "/metrics":
+                return HTTPStatus.OK, METRICS.render(), None
+            if method == "POST" and path == "/score":
+                inputs = parse_purchase(self._json(body))
+                try:
+                    factors = await self.batcher.submit(inputs)
+                except (QueueFullError, BadRequestError):
+                    raise
+                except Exception as e:
+                    return HTTPStatus.BAD_GATEWAY, {"error": str(e)}, None
+                return HTTPStatus.OK, summarize(factors), None
+            if method == "POST" and path == "/score/batch":
+                return HTTPStatus.OK, {"results": await self._score_batch(self._json(body))}, None
+            if path in ROUTES:
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{method} not allowed"}, None
+            return HTTPStatus.NOT_FOUND, {"error": f"no route for {path}"}, None
+        except BadRequestError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}, None
+        except QueueFullError as e:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}, {"Retry-After": "1"}
+        except Exception:
+            log.exception("%s %s failed", method, path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal server error"}, None
+
+    async def _score_batch(self, payload):
+        purchases = payload.get("purchases") if isinstance(payload, dict) else payload
+        if not isinstance(purchases, list):
+            raise BadRequestError('expected {"purchases": [...]}')
+        if len(purchases) > MAX_BATCH_ITEMS:
+            raise BadRequestError(f"at most {MAX_BATCH_ITEMS} purchases per batch")
+        inputs = [parse_purchase(p) for p in purchases]
+        futures = []
+        try:
+            for i in inputs:
+                futures.append(self.batcher.enqueue(i))
+        except QueueFullError:
+            # The client gets a 503: don't score the part that made it in
+            for future in futures:
+                future.cancel()
+            raise
+        outcomes = await asyncio.gather(*futures, return_exceptions=True)
+        return [
+            summarize(self.batcher.client.zero_factors(i), error=str(o))
+            if isinstance(o, Exception) else summarize(o)
+            for i, o in zip(inputs, outcomes)
+        ]
+
+    @staticmethod
+    def _json(body):
+        try:
+            return json.loads(body or b"null")
+        except ValueError:
+            raise BadRequestError("body is not valid JSON") from None
+
+    @staticmethod
+    async def _respond(writer, status, payload, keep_alive, extra_headers=None):
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            try:
+                body = json.dumps(payload).encode("utf-8")
+            except (TypeError, ValueError):
+                log.exception("couldn't serialize a %s response", status.value)
+                status = HTTPStatus.INTERNAL_SERVER_ERROR
+                body = json.dumps({"error": "internal server error"}).encode("utf-8")
+            content_type = "application/json"
+        headers = [
+            f"HTTP/1.1 {status.value} {status.phrase}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        headers += [f"{k}: {v}" for k, v in (extra_headers or {}).items()]
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    def stats(self):
+        client = self.batcher.client
+        return {
+            "batcher": self.batcher.snapshot(),
+            "cache": client.cache.snapshot(),
+            "parse": client.parse_stats.snapshot(),
+            "retry": client.retry.snapshot(),
+            "breaker": client.breaker.snapshot(),
+            "coalesced": client.flights.snapshot(),
+        }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve Munger scoring over HTTP.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--backend", choices=BACKEND_KINDS, default="gemini")
+    ap.add_argument("--model", default="gemini-2.0-flash")
+    ap.add_argument("--recording-path", default="recordings.jsonl")
+    ap.add_argument("--latency-ms", type=float, default=600.0, help="fake backend median latency")
+    ap.add_argument("--cache", help="SQLite response cache file (in-memory only by default)")
+    ap.add_argument("--workers", type=int, default=32, help="batches scored at once")
+    ap.add_argument("--max-batch", type=int, default=32)
+    ap.add_argument("--window-ms", type=float, default=5.0)
+    ap.add_argument("--max-queue", type=int, default=2000)
+    args = ap.parse_args()
+
+    backend = build_backend(args.backend, args.model, recording_path=args.recording_path,
+                            latency_ms=args.latency_ms)
+    client = FactorClient(backend, cache=ResponseCache(path=args.cache))
+    batcher = MicroBatcher(client, max_batch=args.max_batch, window_ms=args.window_ms,
+                           max_queue=args.max_queue, workers=args.workers)
+    server = ScoringServer(batcher, args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port} ({backend.model_name})")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+In-flight request coalescing ("single flight").
+
+While a call for some key is running, further callers with the same key
+don't start their own: they wait for the first one and share its result
+(or its exception). Nothing is remembered once the call finishes; that
+is the response cache's job.
+"""
+import threading
+
+
+class FlightAbandonedError(RuntimeError):
+    """
+    The leading call stopped without a result (e.g. its Streamlit session
+    went away mid-stream), so waiters have nothing to share.
+    """
+
+
+class FlightTimeoutError(TimeoutError):
+    """
+    A waiter gave up on the leading call before it finished.
+    """
+
+
+class Flight:
+    """
+    One in-flight call. Waiters block in `wait()` until the leader
+    publishes a result or an error.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+        self.waiters = 0
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise FlightTimeoutError("timed out waiting for a coalesced call")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key.
+
+    `do(key, fn)` is the simple form. Callers that need to do the work
+    themselves (streaming) use `begin(key)`, which returns `(flight,
+    leader)`: the leader must call `finish(key, flight, ...)` exactly once,
+    everyone else calls `flight.wait()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._leaders = 0
+        self._coalesced = 0
+        self._max_waiters = 0
+
+    def begin(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self._coalesced += 1
+                self._max_waiters = max(self._max_waiters, flight.waiters)
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self._leaders += 1
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight._result = result
+        flight._error = error
+        flight._done.set()
+
+    def do(self, key, fn):
+        """
+        Returns fn(), or the result of an identical call already running.
+        If that call is abandoned without an answer, runs fn() after all.
+        """
+        flight, leader = self.begin(key)
+        while not leader:
+            try:
+                return flight.wait()
+            except FlightAbandonedError:
+                flight, leader = self.begin(key)
+        try:
+            result = fn()
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        except BaseException:
+            self.finish(key, flight, error=FlightAbandonedError("leading call was interrupted"))
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+    def snapshot(self):
+        """
+        leaders: upstream calls made; coalesced: calls that piggybacked on
+        one instead of making their own.
+        """
+        with self._lock:
+            total = self._leaders + self._coalesced
+            return {
+                "leaders": self._leaders,
+                "coalesced": self._coalesced,
+                "coalesced_rate": self._coalesced / total if total else 0.0,
+                "in_flight": len(self._flights),
+                "max_waiters": self._max_waiters,
+            }
@@ -0,0 +1,220 @@
+"""
+Per-request accounting and process-wide metrics.
+
+The caller opens a `Trace` around the work it wants measured; code
+underneath reports into whichever trace is current (a context variable),
+so nothing has to be threaded through every signature. Traces nest: a
+report reaches the current trace and every trace enclosing it.
+
+    with Trace() as trace:
+        factors = client.get_factors(inputs)
+    trace.breakdown(), trace.input_tokens, trace.output_tokens
+
+Every span and token count also lands in `METRICS`, whose `render()` is
+the Prometheus text exposition format; `serve_metrics` publishes it on a
+local port for scraping.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from munger.routing import LatencyHistogram
+
+_current = contextvars.ContextVar("munger_trace", default=None)
+
+# Stages run from microseconds (parsing) to tens of seconds (the model)
+STAGE_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+# ------------------------------------------------------------
+# Metrics registry
+# ------------------------------------------------------------
+class Metrics:
+    """
+    Labelled counters and histograms, rendered in the Prometheus text
+    format. Thread-safe.
+    """
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram(self.buckets, window=1)
+        histogram.observe(seconds)
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+        lines = []
+        described = set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            snapshot = histogram.snapshot()
+            for bound, count in snapshot["buckets"]:
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {snapshot['sum']:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+METRICS = Metrics()
+METRICS.describe("munger_stage_seconds", "Time spent in each scoring stage.")
+METRICS.describe("munger_model_calls_total", "Model requests made.")
+METRICS.describe("munger_tokens_total", "Model tokens used, by direction.")
+
+
+# ------------------------------------------------------------
+# Traces and spans
+# ------------------------------------------------------------
+class Trace:
+    """
+    Stage timings, token usage and model calls made on behalf of one
+    request. Cache hits and requests that joined another's in-flight call
+    make no calls and report no tokens.
+    """
+
+    def __init__(self):
+        self.model_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.spans = []
+        self.parent = None
+        self._token = None
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _current.reset(self._token)
+
+    def breakdown(self):
+        """
+        [{"stage", "calls", "seconds"}] per stage, in first-seen order.
+        """
+        stages = {}
+        for stage, seconds in self.spans:
+            entry = stages.setdefault(stage, {"stage": stage, "calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+        return list(stages.values())
+
+
+def current_trace():
+    return _current.get()
+
+
+def _traces():
+    trace = _current.get()
+    while trace is not None:
+        yield trace
+        trace = trace.parent
+
+
+def record_span(stage, seconds):
+    """
+    Reports `seconds` spent in `stage` to the metrics and the open traces.
+    """
+    METRICS.observe("munger_stage_seconds", seconds, stage=stage)
+    for trace in _traces():
+        trace.spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    """
+    Times the block as one `stage` span (also when it raises).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - started)
+
+
+def record_usage(input_tokens, output_tokens):
+    """
+    Reports one model call's token counts.
+    """
+    METRICS.inc("munger_model_calls_total")
+    METRICS.inc("munger_tokens_total", input_tokens, direction="input")
+    METRICS.inc("munger_tokens_total", output_tokens, direction="output")
+    for trace in _traces():
+        trace.model_calls += 1
+        trace.input_tokens += input_tokens
+        trace.output_tokens += output_tokens
+
+
+# ------------------------------------------------------------
+# Exporter
+# ------------------------------------------------------------
+def serve_metrics(port, host="127.0.0.1", metrics=METRICS):
+    """
+    Serves `metrics` at http://host:port/metrics from a daemon thread and
+    returns the server (call shutdown() to stop it).
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
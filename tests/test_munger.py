@@ -0,0 +1,289 @@
+"""
+Regression checks for the munger package: the parser's error taxonomy,
+cache-key separation, purchase validation, packed scoring and the
+wishlist knapsack. No network, no Streamlit.
+
+    python -m pytest -q tests
+"""
+import io
+import itertools
+import json
+import random
+
+import pandas as pd
+import pytest
+
+from munger.backends import BlockedResponseError, Completion, FakeBackend, GeminiBackend, build_backend
+from munger.batch import load_purchases, score_purchases
+from munger.cache import ResponseCache
+from munger.factors import FactorClient, purchase_inputs
+from munger.packing import parse_packed_response
+from munger.parsing import (
+    FactorParseError,
+    InvalidFactorValueError,
+    MissingFactorsError,
+    NoJSONObjectError,
+    extract_factors,
+    partial_factors,
+)
+from munger.portfolio import solve_knapsack
+from munger.resilience import CircuitOpenError, RetryPolicy
+from munger.scoring import FACTORS
+from munger.server import BadRequestError, parse_purchase
+
+ANSWER = {"D": 1, "O": -1, "G": 2, "L": 0, "B": -2}
+
+
+def _inputs(item="laptop", cost=500.0, **overrides):
+    inputs = purchase_inputs(2000.0, "No", "Save for emergencies", "Mixed", item, cost)
+    inputs.update(overrides)
+    return inputs
+
+
+# ------------------------------------------------------------
+# Parsing
+# ------------------------------------------------------------
+@pytest.mark.parametrize("text", [
+    json.dumps(ANSWER),
+    f"```json\n{json.dumps(ANSWER)}\n```",
+    f"Sure! Format: {{ D, O ... }}\n{json.dumps(ANSWER)}\nHope that helps.",
+    json.dumps({"result": {"factors": ANSWER}}),
+    json.dumps({k: f"{v:+d}" for k, v in ANSWER.items()}),
+])
+def test_extract_factors_finds_the_answer(text):
+    got = extract_factors(text)
+    assert {k: got[k] for k in FACTORS} == ANSWER
+
+
+def test_extract_factors_clamps_out_of_range():
+    assert extract_factors(json.dumps(dict(ANSWER, D=7, O=-9.6)))["D"] == 2
+    assert extract_factors(json.dumps(dict(ANSWER, D=7, O=-9.6)))["O"] == -2
+
+
+@pytest.mark.parametrize("text, error", [
+    ("no braces at all", NoJSONObjectError),
+    (json.dumps(ANSWER)[:20], (NoJSONObjectError, MissingFactorsError)),
+    (json.dumps({k: v for k, v in ANSWER.items() if k != "G"}), MissingFactorsError),
+    (json.dumps(dict(ANSWER, G="high")), InvalidFactorValueError),
+    (json.dumps(dict(ANSWER, G=True)), InvalidFactorValueError),
+    (json.dumps(dict(ANSWER, G=None)), InvalidFactorValueError),
+    (json.dumps(ANSWER).replace('"G": 2', '"G": Infinity'), InvalidFactorValueError),
+    (json.dumps(ANSWER).replace('"G": 2', '"G": -Infinity'), InvalidFactorValueError),
+    (json.dumps(ANSWER).replace('"G": 2', '"G": 1e999'), InvalidFactorValueError),
+    (json.dumps(ANSWER).replace('"G": 2', '"G": NaN'), InvalidFactorValueError),
+    (json.dumps(dict(ANSWER, G="inf")), InvalidFactorValueError),
+    (json.dumps(dict(ANSWER, G="Infinity")), InvalidFactorValueError),
+])
+def test_extract_factors_error_taxonomy(text, error):
+    with pytest.raises(error) as raised:
+        extract_factors(text)
+    assert isinstance(raised.value, FactorParseError)
+
+
+def test_partial_factors_drops_non_finite_values():
+    assert partial_factors({"G": float("inf"), "L": 1}, ["G", "L"]) == {"L": 1}
+
+
+def test_packed_response_skips_stray_lists():
+    items = [{"id": i, "G": 1, "L": 0, "B": -1} for i in range(3)]
+    text = f"ids [1] and [] then {json.dumps(items)}"
+    parsed = parse_packed_response(text, 3, ["G", "L", "B"])
+    assert [p["G"] for p in parsed] == [1, 1, 1]
+
+
+# ------------------------------------------------------------
+# Cache keys
+# ------------------------------------------------------------
+def test_cache_key_separates_prompt_shapes():
+    backend = FakeBackend()
+    keys = {
+        FactorClient(backend, **options).cache_key(_inputs())
+        for options in ({}, {"structured": False}, {"explanation_words": 20}, {"hybrid": False})
+    }
+    assert len(keys) == 4
+    assert FactorClient(backend).cache_key(_inputs()) == FactorClient(backend).cache_key(_inputs())
+
+
+def test_cache_key_separates_models_and_inputs():
+    client = FactorClient(FakeBackend(model_name="fake:a"))
+    other = FactorClient(FakeBackend(model_name="fake:b"))
+    assert client.cache_key(_inputs()) != other.cache_key(_inputs())
+    assert client.cache_key(_inputs("laptop")) != client.cache_key(_inputs("phone"))
+    assert client.cache_key(_inputs("Laptop ")) == client.cache_key(_inputs("laptop"))
+
+
+def test_hybrid_cache_key_ignores_locally_scored_inputs():
+    hybrid = FactorClient(FakeBackend())
+    full = FactorClient(FakeBackend(), hybrid=False)
+    assert hybrid.cache_key(_inputs(cost=500.0)) == hybrid.cache_key(_inputs(cost=900.0))
+    assert full.cache_key(_inputs(cost=500.0)) != full.cache_key(_inputs(cost=900.0))
+
+
+# ------------------------------------------------------------
+# Purchase validation
+# ------------------------------------------------------------
+@pytest.mark.parametrize("payload", [
+    {"cost": 10},
+    {"item": "", "cost": 10},
+    {"item": "tv", "cost": "abc"},
+    {"item": "tv", "cost": float("nan")},
+    {"item": "tv", "cost": float("inf")},
+    {"item": "tv", "cost": 0},
+    {"item": "tv", "cost": -5},
+    {"item": "tv", "cost": 10, "income": float("inf")},
+    {"item": "tv", "cost": 10, "income": "lots"},
+    ["tv", 10],
+])
+def test_parse_purchase_rejects_bad_purchases(payload):
+    with pytest.raises(BadRequestError):
+        parse_purchase(payload)
+
+
+def test_parse_purchase_defaults_blank_income():
+    assert parse_purchase({"item": "tv", "cost": 400, "income": ""})["leftover_income"] == 1000.0
+
+
+def test_load_purchases_reports_bad_rows():
+    csv = io.StringIO(
+        "item,cost,income\n"
+        "laptop,500,2000\n"
+        ",30,100\n"
+        "phone,,1000\n"
+        "sofa,abc,\n"
+        "bike,-5,100\n"
+        "desk,100,inf\n"
+        "tv,400,\n"
+    )
+    purchases = load_purchases(csv)
+    assert purchases.at[6, "leftover_income"] == 1000.0
+
+    scored_items = []
+    client = FactorClient(FakeBackend(latency_ms=0))
+
+    def score(**inputs):
+        scored_items.append(inputs["item_name"])
+        return client.get_factors(inputs)
+
+    scored = score_purchases(purchases, score, max_workers=2)
+    assert scored["error"].tolist() == [
+        None,
+        "item is required",
+        "cost must be a positive number",
+        "cost must be a positive number",
+        "cost must be a positive number",
+        "income must be a finite number",
+        None,
+    ]
+    assert sorted(scored_items) == ["laptop", "tv"]
+
+
+# ------------------------------------------------------------
+# Backends and packed scoring
+# ------------------------------------------------------------
+class _Chunk:
+    def __init__(self, text=None, block_reason=None):
+        self._text = text
+        self.prompt_feedback = type("Feedback", (), {"block_reason": block_reason})()
+
+    @property
+    def text(self):
+        if self._text is None:
+            raise ValueError("no parts")
+        return self._text
+
+
+class _StreamingModel:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def generate_content(self, *args, **kwargs):
+        return iter(self.chunks)
+
+
+def test_gemini_stream_skips_a_closing_chunk_without_parts():
+    backend = GeminiBackend(_StreamingModel([_Chunk('{"G": 1'), _Chunk("}"), _Chunk()]), "m")
+    assert list(backend.stream("prompt", {})) == ['{"G": 1', "}"]
+
+
+@pytest.mark.parametrize("chunks", [[_Chunk()], [_Chunk(block_reason=2)]])
+def test_gemini_stream_without_text_is_blocked(chunks):
+    with pytest.raises(BlockedResponseError):
+        list(GeminiBackend(_StreamingModel(chunks), "m").stream("prompt", {}))
+
+
+class _FailingBackend:
+    model_name = "failing"
+
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def generate(self, prompt, options):
+        self.calls += 1
+        raise self.error
+
+
+def test_failed_pack_falls_back_without_fanning_out():
+    backend = _FailingBackend(CircuitOpenError("open"))
+    client = FactorClient(backend, retry=RetryPolicy(max_attempts=1))
+    sized = client.pack_sizer.tokens_per_item
+    results = client.get_factors_packed([_inputs(f"item {i}") for i in range(5)])
+    assert backend.calls == 1
+    assert [r["fallback"] for r in results] == ["rules"] * 5
+    assert client.pack_sizer.tokens_per_item == sized
+
+
+def test_packed_cache_hits_are_marked():
+    client = FactorClient(FakeBackend(latency_ms=0), cache=ResponseCache())
+    client.get_factors(_inputs("laptop"))
+    results = client.get_factors_packed([_inputs("laptop"), _inputs("phone")])
+    assert results[0].get("cached") is True
+    assert "cached" not in results[1]
+
+
+def test_replay_without_a_recording_uses_the_fallback(tmp_path):
+    backend = build_backend("replay", "gemini-2.0-flash", recording_path=tmp_path / "none.jsonl", latency_ms=0)
+    assert backend.model_name == "replay:gemini-2.0-flash"
+    assert isinstance(backend.generate("prompt", {}), Completion)
+
+
+# ------------------------------------------------------------
+# Wishlist knapsack
+# ------------------------------------------------------------
+def _brute_force(costs, values, budget):
+    best = (0, 0.0, ())
+    for n in range(1, len(costs) + 1):
+        for subset in itertools.combinations(range(len(costs)), n):
+            cost = sum(costs[i] for i in subset)
+            value = sum(values[i] for i in subset)
+            if cost <= budget and (value > best[0] or (value == best[0] and cost < best[1])):
+                best = (value, cost, subset)
+    return best
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_knapsack_matches_brute_force(seed):
+    rng = random.Random(seed)
+    n = rng.randint(1, 9)
+    costs = [round(rng.uniform(5, 500), 2) for _ in range(n)]
+    values = [rng.randint(-3, 10) for _ in range(n)]
+    budget = round(rng.uniform(0, sum(costs)), 2)
+
+    chosen = solve_knapsack(costs, values, budget)
+    best_value, best_cost, _ = _brute_force(costs, values, budget)
+    assert sum(costs[i] for i in chosen) <= budget + 1e-9
+    assert sum(values[i] for i in chosen) == best_value
+    assert sum(costs[i] for i in chosen) == pytest.approx(best_cost)
+
+
+def test_knapsack_skips_worthless_and_unaffordable_items():
+    assert solve_knapsack([10, 20, 500], [0, -1, 5], 100) == []
+    assert solve_knapsack([], [], 100) == []
+
+
+def test_score_purchases_keeps_row_order_and_counts_calls():
+    client = FactorClient(FakeBackend(latency_ms=0), cache=ResponseCache())
+    purchases = pd.DataFrame({"item": ["a", "b", "a"], "cost": [10.0, 20.0, 10.0]})
+    scored = score_purchases(purchases, lambda **inputs: client.get_factors(inputs), max_workers=1)
+    assert scored["item_name"].tolist() == ["a", "b", "a"]
+    assert scored.attrs["model_calls"] == [1, 1, 0]